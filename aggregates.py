@@ -0,0 +1,99 @@
+"""
+Consultas de agregación para el dashboard.
+
+Primero intenta la función RPC `dashboard_aggregates` (ver schema.sql), que
+devuelve totales exactos, top-N categorías, la serie diaria y los conteos en
+un solo round trip de pocos KB. Si la función no existe en la base, cae a un
+cálculo local que pagina con proyecciones angostas (sólo las columnas que
+suma) en vez de bajar `select("*")`.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+
+import postgrest_async
+from postgrest_async import PostgrestError
+
+AGGREGATES_PAGE_SIZE = int(os.getenv("AGGREGATES_PAGE_SIZE", "1000"))
+
+# Se apaga la primera vez que la RPC no existe, para no pagar un 404 en cada reconciliación
+_rpc_available = True
+
+def _user_filter(user_id):
+    return [("user_id", "eq", user_id)] if user_id is not None else []
+
+async def _rpc_aggregates(user_id, top_n: int, days: int) -> dict:
+    result = await postgrest_async.rpc("dashboard_aggregates",
+                                       {"p_user_id": user_id, "p_top_n": top_n, "p_days": days})
+    return {
+        "total_expenses": float(result.get("total_expenses") or 0),
+        "expense_count": int(result.get("expense_count") or 0),
+        "pending_tasks": int(result.get("pending_tasks") or 0),
+        "total_notes": int(result.get("total_notes") or 0),
+        "top_categories": [(c["description"], float(c["total"])) for c in result.get("top_categories") or []],
+        "daily": [(str(d["day"])[:10], float(d["total"])) for d in result.get("daily") or []],
+    }
+
+async def _local_aggregates(user_id, top_n: int, days: int) -> dict:
+    """Mismo resultado que la RPC, paginando por id con sólo amount/description/created_at."""
+    since = (datetime.now(timezone.utc).date() - timedelta(days=days - 1)).isoformat()
+    total = 0.0
+    count = 0
+    categories = {}
+    daily = {}
+    last_id = None
+    while True:
+        filters = _user_filter(user_id) + ([("id", "gt", last_id)] if last_id is not None else [])
+        page = await postgrest_async.select("expenses", columns="id,amount,description,created_at",
+                                            filters=filters, order="id", limit=AGGREGATES_PAGE_SIZE)
+        for row in page:
+            amount = float(row.get("amount") or 0)
+            total += amount
+            count += 1
+            description = row.get("description") or "Otros"
+            categories[description] = categories.get(description, 0) + amount
+            day = (row.get("created_at") or "")[:10]
+            if day and day >= since:
+                daily[day] = daily.get(day, 0) + amount
+        if len(page) < AGGREGATES_PAGE_SIZE:
+            break
+        last_id = page[-1]["id"]
+
+    pending_tasks, total_notes = await asyncio.gather(
+        postgrest_async.count("tasks", _user_filter(user_id) + [("status", "eq", "pending")]),
+        postgrest_async.count("notes", _user_filter(user_id)),
+    )
+    return {
+        "total_expenses": total,
+        "expense_count": count,
+        "pending_tasks": pending_tasks,
+        "total_notes": total_notes,
+        "top_categories": sorted(categories.items(), key=lambda x: x[1], reverse=True)[:top_n],
+        "daily": sorted(daily.items()),
+    }
+
+async def dashboard_aggregates(user_id: int = None, top_n: int = 5, days: int = 7) -> dict:
+    """Totales exactos sobre toda la historia (no sólo las últimas N filas)."""
+    global _rpc_available
+    if _rpc_available:
+        try:
+            return await _rpc_aggregates(user_id, top_n, days)
+        except PostgrestError as e:
+            if e.status_code != 404:
+                raise
+            logging.warning("RPC dashboard_aggregates no disponible (aplicar schema.sql); usando cálculo local")
+            _rpc_available = False
+    return await _local_aggregates(user_id, top_n, days)
+
+async def recent_items(user_id: int = None, expenses: int = 10, tasks: int = 5, notes: int = 10):
+    """Listados recientes con proyecciones angostas (sólo lo que pinta el dashboard)."""
+    return await asyncio.gather(
+        postgrest_async.select("expenses", columns="id,amount,description,currency,created_at",
+                               filters=_user_filter(user_id), order="created_at", desc=True, limit=expenses),
+        postgrest_async.select("tasks", columns="id,description,deadline,status,created_at",
+                               filters=_user_filter(user_id) + [("status", "eq", "pending")],
+                               order="created_at", desc=True, limit=tasks),
+        postgrest_async.select("notes", columns="id,content,created_at",
+                               filters=_user_filter(user_id), order="created_at", desc=True, limit=notes),
+    )
@@ -7,6 +7,15 @@ from groq import AsyncGroq
 from dotenv import load_dotenv
 import asyncio
 import json
+import time
+from functools import partial
+
+import fast_path
+import metrics
+import rate_limit
+import response_cache
+import structured_output
+import tracing
 
 load_dotenv()
 
@@ -29,26 +38,87 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 gemini_client = genai.Client(api_key=GEMINI_API_KEY) if GEMINI_API_KEY else None
 GEMINI_MODEL = "gemini-2.0-flash"
 
+# --- Hedging entre proveedores ---
+# Si el proveedor principal no responde en AI_HEDGE_DELAY segundos se lanza el siguiente en paralelo.
+AI_HEDGE_ENABLED = os.getenv("AI_HEDGE_ENABLED", "true").lower() == "true"
+AI_HEDGE_DELAY = float(os.getenv("AI_HEDGE_DELAY", "4.0"))
+# Presupuesto total por petición (debe ser menor que el timeout de chat_endpoint)
+AI_LATENCY_BUDGET = float(os.getenv("AI_LATENCY_BUDGET", "40.0"))
+
+# --- Salud de proveedores / circuit breaker ---
+AI_EWMA_ALPHA = float(os.getenv("AI_EWMA_ALPHA", "0.3"))
+AI_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("AI_CIRCUIT_FAILURE_THRESHOLD", "3"))
+AI_CIRCUIT_COOLDOWN = float(os.getenv("AI_CIRCUIT_COOLDOWN", "30"))
+AI_CIRCUIT_MAX_COOLDOWN = float(os.getenv("AI_CIRCUIT_MAX_COOLDOWN", "600"))
+
+# --- Cuotas por proveedor (requests y tokens por minuto, 0 = sin límite) ---
+# Los defaults son los de los planes gratuitos: es mejor esperar turno acá que comerse el 429
+OPENROUTER_RPM = float(os.getenv("OPENROUTER_RPM", "20"))
+OPENROUTER_TPM = float(os.getenv("OPENROUTER_TPM", "0"))
+GROQ_RPM = float(os.getenv("GROQ_RPM", "30"))
+GROQ_TPM = float(os.getenv("GROQ_TPM", "6000"))
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "15"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))
+# Tokens de salida que se reservan por mensaje (la respuesta real no se conoce de antemano)
+AI_EXPECTED_OUTPUT_TOKENS = int(os.getenv("AI_EXPECTED_OUTPUT_TOKENS", "150"))
+# Lo que cuenta Gemini por una imagen o unos segundos de audio, más o menos
+AI_MEDIA_TOKENS = int(os.getenv("AI_MEDIA_TOKENS", "1000"))
+
+# --- Salida estructurada ---
+# Proveedores a los que se les pide el JSON Schema estricto de structured_output (el resto, json_object).
+# Groq no lo acepta con llama-3.3-70b; OpenRouter lo ignora en los modelos que no lo soportan.
+AI_JSON_SCHEMA_PROVIDERS = {name.strip() for name in os.getenv("AI_JSON_SCHEMA_PROVIDERS", "openrouter,gemini").split(",")
+                            if name.strip()}
+RESPONSE_SCHEMA = structured_output.response_schema()
+
+# --- Clasificación por lotes ---
+AI_BATCH_MAX_ITEMS = int(os.getenv("AI_BATCH_MAX_ITEMS", "20"))
+AI_BATCH_MAX_RETRIES = int(os.getenv("AI_BATCH_MAX_RETRIES", "2"))
+
 SYSTEM_INSTRUCTION = """
 Eres un asistente de IA para una aplicación de gestión de vida. 
 Tu objetivo es categorizar la entrada del usuario en una de estas categorías:
-- EXPENSE: Gasto de dinero (monto, descripción, fecha, moneda).
-- TASK: Algo que hacer (descripción, fecha límite si existe).
-- NOTE: Información general o pensamiento (contenido).
-- PLANNING: Una meta o proyecto grande que necesita desglose.
-- OTHER: Cualquier otra cosa (saludo, pregunta, incierto).
+- EXPENSE: Gasto de dinero. data: {"amount": número, "description": texto, "currency": código ISO como "USD"}
+- TASK: Algo que hacer. data: {"description": texto, "deadline": fecha AAAA-MM-DD o null}
+- NOTE: Información general o pensamiento. data: {"content": texto}
+- PLANNING: Una meta o proyecto grande que necesita desglose. data: {"goal": texto, "steps": [textos]}
+- OTHER: Cualquier otra cosa (saludo, pregunta, incierto). data: {}
 
 IMPORTANTE: Responde SIEMPRE en ESPAÑOL.
 
 Salida: JSON válido en este formato exacto:
 {
     "category": "EXPENSE" | "TASK" | "NOTE" | "PLANNING" | "OTHER",
-    "data": { ... campos relevantes ... },
+    "data": { ... los campos de la categoría ... },
     "response": "Un mensaje corto y amigable de confirmación en español"
 }
 """
 
-async def analyze_message_openrouter(text: str):
+def _openai_response_format(provider: str, schema) -> dict:
+    """json_schema estricto si el proveedor está en AI_JSON_SCHEMA_PROVIDERS, si no json_object."""
+    if schema is not None and provider in AI_JSON_SCHEMA_PROVIDERS:
+        return {"type": "json_schema", "json_schema": {"name": "chat_response", "strict": True, "schema": schema}}
+    return {"type": "json_object"}
+
+BATCH_SYSTEM_INSTRUCTION = SYSTEM_INSTRUCTION.split("Salida:")[0] + """
+La entrada es un arreglo JSON de mensajes independientes: [{"id": 0, "text": "..."}, ...].
+Clasifica CADA mensaje por separado, sin mezclar datos entre mensajes.
+
+Salida: JSON válido en este formato exacto, con un resultado por cada id recibido:
+{
+    "results": [
+        {
+            "id": <id del mensaje>,
+            "category": "EXPENSE" | "TASK" | "NOTE" | "PLANNING" | "OTHER",
+            "data": { ... los campos de la categoría ... },
+            "response": "Un mensaje corto y amigable de confirmación en español"
+        }
+    ]
+}
+"""
+
+async def analyze_message_openrouter(text: str, system_instruction: str = SYSTEM_INSTRUCTION,
+                                     schema: dict = RESPONSE_SCHEMA):
     """Llamada usando OpenRouter (Prioridad 1)."""
     if not openrouter_client:
         raise ValueError("OpenROUTER API Key no configurada")
@@ -57,14 +127,14 @@ async def analyze_message_openrouter(text: str):
     response = await openrouter_client.chat.completions.create(
         model=OPENROUTER_MODEL,
         messages=[
-            {"role": "system", "content": SYSTEM_INSTRUCTION},
+            {"role": "system", "content": system_instruction},
             {"role": "user", "content": text}
         ],
-        response_format={"type": "json_object"}
+        response_format=_openai_response_format("openrouter", schema)
     )
     return response.choices[0].message.content
 
-async def analyze_message_groq(text: str):
+async def analyze_message_groq(text: str, system_instruction: str = SYSTEM_INSTRUCTION, schema: dict = RESPONSE_SCHEMA):
     """Llamada usando Groq (Prioridad 2)."""
     if not groq_client:
         raise ValueError("Groq API Key no configurada")
@@ -73,14 +143,16 @@ async def analyze_message_groq(text: str):
     response = await groq_client.chat.completions.create(
         model=GROQ_MODEL,
         messages=[
-            {"role": "system", "content": SYSTEM_INSTRUCTION},
+            {"role": "system", "content": system_instruction},
             {"role": "user", "content": text}
         ],
-        response_format={"type": "json_object"}
+        response_format=_openai_response_format("groq", schema)
     )
     return response.choices[0].message.content
 
-async def analyze_message_gemini(text: str, image_data: bytes = None, audio_data: bytes = None):
+async def analyze_message_gemini(text: str, image_data: bytes = None, audio_data: bytes = None,
+                                 image_mime: str = "image/jpeg", audio_mime: str = "audio/ogg",
+                                 system_instruction: str = SYSTEM_INSTRUCTION, schema: dict = RESPONSE_SCHEMA):
     """Llamada usando el SDK oficial de Google GenAI (Prioridad 3)."""
     if not gemini_client:
         raise ValueError("Gemini API Key no configurada")
@@ -88,60 +160,633 @@ async def analyze_message_gemini(text: str, image_data: bytes = None, audio_data
     content_parts = []
     if text: content_parts.append(text)
     if image_data:
-        content_parts.append(types.Part.from_bytes(data=image_data, mime_type="image/jpeg"))
+        content_parts.append(types.Part.from_bytes(data=image_data, mime_type=image_mime))
     if audio_data:
-        content_parts.append(types.Part.from_bytes(data=audio_data, mime_type="audio/ogg"))
+        content_parts.append(types.Part.from_bytes(data=audio_data, mime_type=audio_mime))
 
     generate_config = types.GenerateContentConfig(
         temperature=0.4,
-        system_instruction=SYSTEM_INSTRUCTION,
-        response_mime_type="application/json"
+        system_instruction=system_instruction,
+        response_mime_type="application/json",
+        response_json_schema=schema if "gemini" in AI_JSON_SCHEMA_PROVIDERS else None
     )
 
     logging.info(f"Fallback 2: Intentando con directo Gemini ({GEMINI_MODEL})...")
-    response = await gemini_client.models.generate_content(
+    response = await gemini_client.aio.models.generate_content(
         model=GEMINI_MODEL,
         contents=content_parts,
         config=generate_config
     )
     return response.text
 
-async def analyze_message(text: str, image_data: bytes = None, audio_data: bytes = None):
-    """Gestor principal con OpenRouter como prioridad."""
-    
-    # Si hay imagen o audio, vamos directo a Gemini porque es el que mejor lo soporta
-    if image_data or audio_data:
-        try:
-            return await analyze_message_gemini(text, image_data, audio_data)
-        except Exception as e:
-            logging.error(f"Gemini multimodal falló: {e}")
-            return json.dumps({"category": "OTHER", "data": {}, "response": "Error: No pude procesar el archivo multimedia."})
-
-    # 1. Intentar con OpenRouter (Primary)
-    if openrouter_client:
-        try:
-            return await analyze_message_openrouter(text)
-        except Exception as or_e:
-            logging.error(f"OpenRouter falló: {or_e}")
-
-    # 2. Intentar con Groq (Fallback 1)
-    if groq_client:
-        try:
-            return await analyze_message_groq(text)
-        except Exception as groq_e:
-            logging.error(f"Groq falló: {groq_e}")
-
-    # 3. Intentar con Gemini Directo (Fallback 2)
-    if gemini_client:
-        try:
-            return await analyze_message_gemini(text)
-        except Exception as e:
-            logging.warning(f"Gemini directo falló: {e}")
+# --- Variantes en streaming (mismos prompts, el texto llega por fragmentos) ---
+
+async def stream_message_openrouter(text: str):
+    if not openrouter_client:
+        raise ValueError("OpenROUTER API Key no configurada")
+
+    stream = await openrouter_client.chat.completions.create(
+        model=OPENROUTER_MODEL,
+        messages=[
+            {"role": "system", "content": SYSTEM_INSTRUCTION},
+            {"role": "user", "content": text}
+        ],
+        response_format=_openai_response_format("openrouter", RESPONSE_SCHEMA),
+        stream=True
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+async def stream_message_groq(text: str):
+    if not groq_client:
+        raise ValueError("Groq API Key no configurada")
+
+    stream = await groq_client.chat.completions.create(
+        model=GROQ_MODEL,
+        messages=[
+            {"role": "system", "content": SYSTEM_INSTRUCTION},
+            {"role": "user", "content": text}
+        ],
+        response_format=_openai_response_format("groq", RESPONSE_SCHEMA),
+        stream=True
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+async def stream_message_gemini(text: str):
+    if not gemini_client:
+        raise ValueError("Gemini API Key no configurada")
+
+    generate_config = types.GenerateContentConfig(
+        temperature=0.4,
+        system_instruction=SYSTEM_INSTRUCTION,
+        response_mime_type="application/json",
+        response_json_schema=RESPONSE_SCHEMA if "gemini" in AI_JSON_SCHEMA_PROVIDERS else None
+    )
+    stream = await gemini_client.aio.models.generate_content_stream(
+        model=GEMINI_MODEL,
+        contents=[text],
+        config=generate_config
+    )
+    async for chunk in stream:
+        if chunk.text:
+            yield chunk.text
+
+def clean_json_response(response_text: str) -> str:
+    """Quita los bloques de código markdown que algunos modelos agregan al JSON."""
+    return response_text.replace("```json", "").replace("```", "").strip()
+
+def estimate_tokens(text: str, system_instruction: str = SYSTEM_INSTRUCTION,
+                    output: int = AI_EXPECTED_OUTPUT_TOKENS) -> int:
+    """Tokens que va a consumir un request, para descontarlos de la cuota antes de hacerlo (~4 caracteres por token)."""
+    return (len(system_instruction) + len(text or "")) // 4 + output
+
+def is_valid_response(response_text: str) -> bool:
+    """Una respuesta es válida si valida contra structured_output, reparada localmente si hace falta."""
+    if not response_text:
+        return False
+    return structured_output.parse(response_text) is not None
+
+PROVIDER_CALL_SECONDS = metrics.Histogram("ai_provider_call_seconds", "Duración de las llamadas a cada proveedor LLM",
+                                          ["provider", "outcome"])
+PROVIDER_ERRORS = metrics.Counter("ai_provider_errors_total", "Llamadas fallidas por proveedor (incluye 429)", ["provider"])
+PROVIDER_RATE_LIMITED = metrics.Counter("ai_provider_rate_limited_total", "Respuestas 429 por proveedor", ["provider"])
+FALLBACK_DEPTH = metrics.Counter("ai_fallback_depth_total",
+                                 "Posición en la cadena del proveedor que respondió (0 = el primero)", ["depth"])
+PROVIDER_THROTTLED = metrics.Counter("ai_provider_throttled_total",
+                                     "Llamadas no hechas porque el proveedor no tenía cuota local", ["provider"])
+RESPONSES = metrics.Counter("ai_responses_total", "Respuestas de analyze_message según su origen", ["source"])
+
+def _count_response(source: str):
+    RESPONSES.inc(source=source)
+    span = tracing.current_span()
+    if span is not None:
+        span.set(**{"ai.source": source})
+
+def is_rate_limit_error(exc: Exception) -> bool:
+    """Detecta un 429 en los errores de OpenAI/Groq (status_code) y Google GenAI (code)."""
+    return getattr(exc, "status_code", None) == 429 or getattr(exc, "code", None) == 429
+
+class ProviderHealth:
+    """Estado de salud de un proveedor: latencia EWMA, tasa de error, 429s y circuit breaker."""
+
+    def __init__(self, name: str, func, priority: int, stream_func=None, limiter=None):
+        self.name = name
+        self.func = func
+        self.stream_func = stream_func
+        self.priority = priority
+        self.limiter = limiter or rate_limit.ProviderLimiter()
+        self.ewma_latency = None
+        self.ewma_error_rate = 0.0
+        self.calls = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.consecutive_failures = 0
+        self.circuit_openings = 0
+        self.open_until = 0.0
+        self.last_error = None
+
+    def is_open(self, now: float = None) -> bool:
+        return (now if now is not None else time.monotonic()) < self.open_until
+
+    def score(self) -> float:
+        """
+        Menor es mejor: latencia esperada más una penalización por tasa de error
+        (un fallo rápido igual nos cuesta esperar al siguiente proveedor).
+        Sin datos usamos 0 para que el proveedor se pruebe.
+        """
+        latency = self.ewma_latency or 0.0
+        return latency + self.ewma_error_rate * 2 * AI_HEDGE_DELAY
+
+    def acquire(self, tokens: int) -> bool:
+        """Descuenta un request de la cuota; False si no alcanza (el proveedor se salta)."""
+        if self.limiter.try_acquire(tokens):
+            return True
+        PROVIDER_THROTTLED.inc(provider=self.name)
+        return False
+
+    def record_success(self, latency: float):
+        PROVIDER_CALL_SECONDS.observe(latency, provider=self.name, outcome="success")
+        self.calls += 1
+        self.ewma_latency = latency if self.ewma_latency is None else (
+            AI_EWMA_ALPHA * latency + (1 - AI_EWMA_ALPHA) * self.ewma_latency)
+        self.ewma_error_rate = (1 - AI_EWMA_ALPHA) * self.ewma_error_rate
+        self.consecutive_failures = 0
+        self.circuit_openings = 0
+        self.open_until = 0.0
+
+    def record_failure(self, exc: Exception, latency: float):
+        self.calls += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = str(exc)[:200]
+        self.ewma_error_rate = AI_EWMA_ALPHA + (1 - AI_EWMA_ALPHA) * self.ewma_error_rate
+        # Las latencias de los fallos también cuentan: un timeout lento es peor que un error rápido
+        self.ewma_latency = latency if self.ewma_latency is None else (
+            AI_EWMA_ALPHA * latency + (1 - AI_EWMA_ALPHA) * self.ewma_latency)
+
+        rate_limited = is_rate_limit_error(exc)
+        PROVIDER_CALL_SECONDS.observe(latency, provider=self.name, outcome="rate_limited" if rate_limited else "error")
+        PROVIDER_ERRORS.inc(provider=self.name)
+        if rate_limited:
+            self.rate_limited += 1
+            PROVIDER_RATE_LIMITED.inc(provider=self.name)
+            self.limiter.drain()
+        if rate_limited or self.consecutive_failures >= AI_CIRCUIT_FAILURE_THRESHOLD:
+            # Cool-down exponencial mientras el proveedor siga fallando
+            cooldown = min(AI_CIRCUIT_COOLDOWN * (2 ** self.circuit_openings), AI_CIRCUIT_MAX_COOLDOWN)
+            self.circuit_openings += 1
+            self.open_until = time.monotonic() + cooldown
+            logging.warning(f"Circuit breaker abierto para {self.name} durante {cooldown:.0f}s "
+                            f"({'429' if rate_limited else f'{self.consecutive_failures} fallos seguidos'})")
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {
+            "name": self.name,
+            "priority": self.priority,
+            "circuit_open": self.is_open(now),
+            "reopens_in": round(max(0.0, self.open_until - now), 1),
+            "ewma_latency": round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+            "ewma_error_rate": round(self.ewma_error_rate, 3),
+            "calls": self.calls,
+            "failures": self.failures,
+            "rate_limited": self.rate_limited,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "score": round(self.score(), 3),
+            "quota": self.limiter.snapshot(),
+        }
+
+# Registro de proveedores de texto (el orden de alta es la prioridad por defecto)
+PROVIDERS = {}
+
+def register_provider(name: str, func, priority: int, stream_func=None, rpm: float = 0, tpm: float = 0):
+    PROVIDERS[name] = ProviderHealth(name, func, priority, stream_func, rate_limit.ProviderLimiter(rpm, tpm))
+
+if openrouter_client:
+    register_provider("openrouter", analyze_message_openrouter, 1, stream_message_openrouter,
+                      OPENROUTER_RPM, OPENROUTER_TPM)
+if groq_client:
+    register_provider("groq", analyze_message_groq, 2, stream_message_groq, GROQ_RPM, GROQ_TPM)
+if gemini_client:
+    register_provider("gemini", analyze_message_gemini, 3, stream_message_gemini, GEMINI_RPM, GEMINI_TPM)
+
+def ordered_providers():
+    """
+    Cadena de proveedores ordenada por salud observada, saltando los que tienen el circuito abierto.
+    Si todos están abiertos, se prueba el que antes se vuelve a cerrar (half-open).
+    """
+    now = time.monotonic()
+    healthy = [p for p in PROVIDERS.values() if not p.is_open(now)]
+    if not healthy and PROVIDERS:
+        healthy = [min(PROVIDERS.values(), key=lambda p: p.open_until)]
+    for p in PROVIDERS.values():
+        if p not in healthy:
+            logging.info(f"Saltando {p.name}: circuito abierto ({p.open_until - now:.0f}s restantes)")
+    healthy.sort(key=lambda p: (p.score(), p.priority))
+    return [(p.name, p.func) for p in healthy]
+
+def get_provider_status():
+    """Estado actual de cada proveedor, para ver por qué se está saltando alguno."""
+    order = [name for name, _ in ordered_providers()]
+    return {"order": order, "providers": [p.snapshot() for p in PROVIDERS.values()],
+            "admission": rate_limit.admission.stats(), "structured_output": structured_output.stats()}
+
+async def wait_for_quota(tokens: int, budget: float, names=None) -> float:
+    """
+    Espera a que alguno de los proveedores `names` (por defecto, los de ordered_providers)
+    tenga cuota para un request de `tokens`. Devuelve los segundos esperados; si la cuota
+    no va a alcanzar dentro de `budget`, lanza rate_limit.Overloaded sin esperar.
+    """
+    if names is None:
+        names = [name for name, _ in ordered_providers()]
+    candidates = [PROVIDERS[name] for name in names if name in PROVIDERS]
+    waited = 0.0
+    while candidates:
+        delay = min(p.limiter.delay(tokens) for p in candidates)
+        if delay <= 0:
+            break
+        if waited + delay > budget:
+            raise rate_limit.Overloaded(delay, "quota")
+        logging.info(f"Sin cuota en los proveedores, esperando {delay:.1f}s")
+        await asyncio.sleep(delay)
+        waited += delay
+    return waited
+
+async def _traced_call(name: str, func, text: str, hedged: bool):
+    with tracing.span("ai.provider", tracing.KIND_CLIENT, provider=name, hedged=hedged):
+        return await func(text)
+
+async def race_providers(text: str, providers, hedge_delay: float = None, budget: float = AI_LATENCY_BUDGET,
+                         validate=is_valid_response, tokens: int = None):
+    """
+    Ejecuta la cadena de proveedores con "hedging".
+
+    Arranca el primero; si no hay respuesta en `hedge_delay` segundos arranca también
+    el siguiente (sin cancelar el anterior). Si un proveedor falla, el siguiente arranca
+    de inmediato. Devuelve la primera respuesta que pasa `validate` y cancela el resto.
+    Con `hedge_delay=None` el comportamiento es secuencial. Todo queda acotado por `budget`.
+    Los proveedores sin cuota para `tokens` (por defecto, estimate_tokens(text)) se saltan.
+    """
+    tokens = tokens or estimate_tokens(text)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + budget
+    queue = list(providers)
+    position = {name: i for i, (name, _) in enumerate(queue)}
+    pending = {}
+    fallback_text = None
+
+    started = {}
+
+    def launch_next():
+        while queue:
+            name, func = queue.pop(0)
+            health = PROVIDERS.get(name)
+            if health is not None and not health.acquire(tokens):
+                logging.info(f"Saltando {name}: sin cuota (requests o tokens por minuto)")
+                continue
+            logging.info(f"Lanzando proveedor {name}...")
+            task = asyncio.create_task(_traced_call(name, func, text, hedged=bool(pending)))
+            pending[task] = name
+            started[task] = loop.time()
+            return
+
+    def record(task, name, exc=None):
+        health = PROVIDERS.get(name)
+        if health is None:
+            return
+        latency = loop.time() - started[task]
+        if exc is None:
+            health.record_success(latency)
+        else:
+            health.record_failure(exc, latency)
+
+    try:
+        launch_next()
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                logging.error(f"Presupuesto de latencia agotado ({budget}s)")
+                for task, name in pending.items():
+                    record(task, name, TimeoutError(f"sin respuesta dentro del presupuesto de {budget}s"))
+                break
+            timeout = min(hedge_delay, remaining) if (queue and hedge_delay is not None) else remaining
+            done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                if queue and hedge_delay is not None:
+                    logging.info(f"Sin respuesta tras {hedge_delay}s, lanzando proveedor de respaldo en paralelo")
+                    launch_next()
+                continue
+
+            failed = False
+            for task in done:
+                name = pending.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    logging.error(f"{name} falló: {e}")
+                    record(task, name, e)
+                    failed = True
+                    continue
+                if validate(result):
+                    logging.info(f"Respuesta válida de {name}")
+                    record(task, name)
+                    FALLBACK_DEPTH.inc(depth=position[name])
+                    return result
+                logging.warning(f"{name} devolvió una respuesta no JSON: {str(result)[:100]}")
+                record(task, name, ValueError("respuesta no JSON"))
+                fallback_text = fallback_text or result
+                failed = True
+
+            if failed and queue:
+                launch_next()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    FALLBACK_DEPTH.inc(depth="exhausted")
+    return fallback_text
+
+async def _analyze_multimodal(text: str, image_data: bytes, audio_data: bytes, budget: float,
+                              image_mime: str = "image/jpeg", audio_mime: str = "audio/ogg"):
+    """Imagen o audio van directo a Gemini, que es el que mejor lo soporta."""
+    start = time.monotonic()
+    health = PROVIDERS.get("gemini")
+    if health:
+        budget -= await wait_for_quota(estimate_tokens(text) + AI_MEDIA_TOKENS, budget, ["gemini"])
+        if not health.acquire(estimate_tokens(text) + AI_MEDIA_TOKENS):
+            return None
+    try:
+        with tracing.span("ai.provider", tracing.KIND_CLIENT, provider="gemini", multimodal=True):
+            result = await asyncio.wait_for(analyze_message_gemini(text, image_data, audio_data, image_mime, audio_mime),
+                                            timeout=budget)
+        if health:
+            health.record_success(time.monotonic() - start)
+        return result
+    except Exception as e:
+        logging.error(f"Gemini multimodal falló: {e}")
+        if health:
+            health.record_failure(e, time.monotonic() - start)
+        return None
+
+@tracing.traced("ai.analyze_message")
+async def analyze_message(text: str, image_data: bytes = None, audio_data: bytes = None, budget: float = AI_LATENCY_BUDGET,
+                          image_mime: str = "image/jpeg", audio_mime: str = "audio/ogg", user_id=None):
+    """
+    Gestor principal: fast path local, caché y luego la cadena de proveedores.
+
+    Lo que va a los proveedores pasa antes por la cola de admisión (turnos por
+    `user_id`); lanza rate_limit.Overloaded si la cola está llena o si la cuota
+    de los proveedores no alcanza dentro de `budget`.
+    """
+    multimodal = bool(image_data or audio_data)
+
+    # Camino rápido local: los mensajes obvios no necesitan un LLM
+    if fast_path.FAST_PATH_ENABLED and not multimodal:
+        local = fast_path.classify(text)
+        if local["confidence"] >= fast_path.FAST_PATH_THRESHOLD:
+            logging.info(f"Fast path local: {local['category']} (confianza {local['confidence']})")
+            _count_response("fast_path")
+            return json.dumps(local, ensure_ascii=False)
+
+    cache_key = None
+    if response_cache.AI_CACHE_ENABLED:
+        cache_key = response_cache.make_key(text, SYSTEM_INSTRUCTION, image_data, audio_data)
+        cached = response_cache.cache.get(cache_key)
+        if cached is not None:
+            logging.info("Respuesta servida desde la caché")
+            _count_response("cache")
+            return cached
+
+    async with rate_limit.admission.slot(user_id):
+        if multimodal:
+            result = await _analyze_multimodal(text, image_data, audio_data, budget, image_mime, audio_mime)
+            if not result:
+                _count_response("multimodal_failed")
+                return json.dumps({"category": "OTHER", "data": {}, "response": "Error: No pude procesar el archivo multimedia."})
+        else:
+            # OpenRouter -> Groq -> Gemini, con hedging si está habilitado
+            hedge_delay = AI_HEDGE_DELAY if AI_HEDGE_ENABLED else None
+            budget -= await wait_for_quota(estimate_tokens(text), budget)
+            result = await race_providers(text, ordered_providers(), hedge_delay=hedge_delay, budget=budget)
+
+    if result:
+        parsed = structured_output.parse(result)
+        structured_output.record(parsed)
+        if parsed is not None:
+            # Se entrega (y se cachea) la versión validada: quien la consume no tiene que adivinar claves
+            result = parsed.to_json()
+            if cache_key:
+                response_cache.cache.put(cache_key, result)
+        _count_response("multimodal" if multimodal else "provider")
+        return result
 
     # Fallback final
+    _count_response("saturated")
+    return saturated_response()
+
+def saturated_response() -> str:
     error_msg = "Lo siento, mis servicios de IA están saturados en este momento. Por favor, intenta de nuevo en unos minutos."
     return json.dumps({
         "category": "OTHER",
         "data": {},
         "response": error_msg
     })
+
+async def stream_analyze_message(text: str, image_data: bytes = None, audio_data: bytes = None,
+                                 budget: float = AI_LATENCY_BUDGET,
+                                 image_mime: str = "image/jpeg", audio_mime: str = "audio/ogg", user_id=None):
+    """
+    Igual que analyze_message pero entrega el texto del modelo por fragmentos.
+
+    Fast path, caché y multimedia no tienen nada que streamear: se entregan en un
+    único fragmento. Para texto se prueban los proveedores en orden de salud; sólo se
+    pasa al siguiente si el actual falla antes de emitir su primer fragmento (después
+    ya no se puede cambiar de proveedor sin mezclar dos respuestas).
+    """
+    multimodal = bool(image_data or audio_data)
+    if multimodal or (fast_path.FAST_PATH_ENABLED and
+                      fast_path.classify(text)["confidence"] >= fast_path.FAST_PATH_THRESHOLD):
+        yield await analyze_message(text, image_data, audio_data, budget, image_mime, audio_mime, user_id)
+        return
+
+    cache_key = None
+    if response_cache.AI_CACHE_ENABLED:
+        cache_key = response_cache.make_key(text, SYSTEM_INSTRUCTION)
+        cached = response_cache.cache.get(cache_key)
+        if cached is not None:
+            logging.info("Respuesta servida desde la caché")
+            _count_response("cache")
+            yield cached
+            return
+
+    tokens = estimate_tokens(text)
+    async with rate_limit.admission.slot(user_id):
+        budget -= await wait_for_quota(tokens, budget)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + budget
+        for depth, (name, _) in enumerate(ordered_providers()):
+            health = PROVIDERS[name]
+            if health.stream_func is None or not health.acquire(tokens):
+                continue
+            logging.info(f"Streaming con {name}...")
+            start = loop.time()
+            chunks = []
+            stream = health.stream_func(text)
+            # Span manual: el intento cruza yields y el contexto del consumidor puede cambiar entre uno y otro
+            attempt = tracing.start_span("ai.provider", tracing.KIND_CLIENT, provider=name, streaming=True)
+            error = None
+            try:
+                while True:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise TimeoutError(f"sin respuesta dentro del presupuesto de {budget}s")
+                    try:
+                        piece = await asyncio.wait_for(stream.__anext__(), timeout=remaining)
+                    except StopAsyncIteration:
+                        break
+                    chunks.append(piece)
+                    yield piece
+            except Exception as e:
+                error = e
+                logging.error(f"{name} falló en streaming: {e}")
+                health.record_failure(e, loop.time() - start)
+                if chunks:
+                    return
+                continue
+            except BaseException as e:
+                error = e  # GeneratorExit / CancelledError: el consumidor cortó el stream a mitad de camino
+                raise
+            finally:
+                if error is not None:
+                    tracing.end_span(attempt, error, chunks=len(chunks))
+                await stream.aclose()
+
+            result = "".join(chunks)
+            parsed = structured_output.parse(result)
+            structured_output.record(parsed)
+            tracing.end_span(attempt, None if parsed is not None else ValueError("respuesta no JSON"),
+                             chunks=len(chunks))
+            if parsed is not None:
+                health.record_success(loop.time() - start)
+                FALLBACK_DEPTH.inc(depth=depth)
+                _count_response("provider")
+                if cache_key:
+                    response_cache.cache.put(cache_key, parsed.to_json())
+            else:
+                logging.warning(f"{name} devolvió una respuesta no JSON: {result[:100]}")
+                health.record_failure(ValueError("respuesta no JSON"), loop.time() - start)
+            return
+
+    _count_response("saturated")
+    yield saturated_response()
+
+def _batch_results(response_text: str) -> dict:
+    """{id: ChatResponse} con los resultados que validan (o se reparan) de una respuesta por lotes."""
+    repairs = []
+    try:
+        parsed = structured_output.repair_json(response_text or "", repairs)
+    except ValueError:
+        return {}
+    results = parsed.get("results") if isinstance(parsed, dict) else parsed
+    valid = {}
+    for item in results if isinstance(results, list) else []:
+        if not isinstance(item, dict) or not str(item.get("id", "")).isdigit():
+            continue
+        # Las reparaciones del texto (truncado, comas) se cuentan en cada ítem que sobrevivió
+        result = structured_output.from_object({k: v for k, v in item.items() if k != "id"}, list(repairs))
+        if result is not None:
+            valid[int(item["id"])] = result
+    return valid
+
+async def _classify_batch(items: dict, budget: float) -> dict:
+    """Un request a la cadena de proveedores con hasta AI_BATCH_MAX_ITEMS mensajes ({id: texto})."""
+    prompt = json.dumps([{"id": i, "text": text} for i, text in items.items()], ensure_ascii=False)
+    providers = [(name, partial(func, system_instruction=BATCH_SYSTEM_INSTRUCTION, schema=None))
+                 for name, func in ordered_providers()]
+    hedge_delay = AI_HEDGE_DELAY if AI_HEDGE_ENABLED else None
+    tokens = estimate_tokens(prompt, BATCH_SYSTEM_INSTRUCTION, output=AI_EXPECTED_OUTPUT_TOKENS * len(items))
+    budget -= await wait_for_quota(tokens, budget)
+    result = await race_providers(prompt, providers, hedge_delay=hedge_delay, budget=budget,
+                                  validate=lambda text: bool(_batch_results(text)), tokens=tokens)
+    answer = {i: r for i, r in _batch_results(result).items() if i in items}
+    for i in items:
+        structured_output.record(answer.get(i))
+    return answer
+
+async def _classify_pending(pending: dict, results: list, budget: float):
+    """
+    Clasifica {índice: texto} en lotes, deja cada resultado en `results` y saca de `pending` lo resuelto.
+
+    Si un lote se queda sin cuota no se reintenta; si además no se resolvió nada, se
+    propaga rate_limit.Overloaded (mejor un 429 con Retry-After que todo "saturado").
+    """
+    total = len(pending)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + budget
+    for attempt in range(1 + AI_BATCH_MAX_RETRIES):
+        if not pending or deadline - loop.time() <= 0:
+            break
+        if attempt:
+            logging.warning(f"Reintentando {len(pending)} ítems del lote sin resultado válido")
+        ids = list(pending)
+        chunks = [{i: pending[i] for i in ids[n:n + AI_BATCH_MAX_ITEMS]}
+                  for n in range(0, len(ids), AI_BATCH_MAX_ITEMS)]
+        answers = await asyncio.gather(*(_classify_batch(chunk, deadline - loop.time()) for chunk in chunks),
+                                       return_exceptions=True)
+        overloaded = None
+        for answer in answers:
+            if isinstance(answer, rate_limit.Overloaded):
+                overloaded = answer
+                continue
+            if isinstance(answer, BaseException):
+                raise answer
+            for i, item in answer.items():
+                results[i] = item.to_json()
+                if response_cache.AI_CACHE_ENABLED:
+                    response_cache.cache.put(response_cache.make_key(pending[i], SYSTEM_INSTRUCTION), results[i])
+                del pending[i]
+        if overloaded is not None:
+            logging.warning(f"Lote sin cuota en los proveedores: {len(pending)} ítems sin resultado ({overloaded})")
+            if len(pending) == total:
+                raise overloaded
+            break
+
+@tracing.traced("ai.analyze_batch")
+async def analyze_batch(texts: list, budget: float = AI_LATENCY_BUDGET, user_id=None) -> list:
+    """
+    Clasifica varios mensajes de texto empaquetándolos en pocos requests.
+
+    Devuelve un JSON por mensaje, en el mismo orden y con el mismo formato que
+    analyze_message. Fast path y caché se resuelven localmente; el resto va en
+    lotes de AI_BATCH_MAX_ITEMS y sólo los ítems que faltan o vinieron mal
+    formados se reintentan (hasta AI_BATCH_MAX_RETRIES veces). El lote entero ocupa
+    un solo lugar en la cola de admisión.
+    """
+    results = [None] * len(texts)
+    pending = {}
+    for i, text in enumerate(texts):
+        if fast_path.FAST_PATH_ENABLED:
+            local = fast_path.classify(text)
+            if local["confidence"] >= fast_path.FAST_PATH_THRESHOLD:
+                results[i] = json.dumps(local, ensure_ascii=False)
+                continue
+        if response_cache.AI_CACHE_ENABLED:
+            cached = response_cache.cache.get(response_cache.make_key(text, SYSTEM_INSTRUCTION))
+            if cached is not None:
+                results[i] = cached
+                continue
+        pending[i] = text
+    logging.info(f"Lote de {len(texts)} mensajes: {len(texts) - len(pending)} resueltos localmente")
+
+    if pending:
+        async with rate_limit.admission.slot(user_id):
+            await _classify_pending(pending, results, budget)
+
+    for i in pending:
+        results[i] = saturated_response()
+    return results
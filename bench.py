@@ -0,0 +1,259 @@
+"""
+Benchmark offline de la API: la app FastAPI corre en proceso, los tres
+proveedores LLM apuntan a `fake_llm` y la base a `fake_postgrest`, todo por
+httpx.ASGITransport (no se abre ningún socket).
+
+Reporta p50/p95/p99 por endpoint, requests/s, regeneraciones del dashboard,
+estado de los proveedores y memoria (RSS). Con --max-p95 / --max-error-rate
+sale con código 1 si se superan, para usarlo antes de un deploy.
+
+Ejemplos:
+    python bench.py --requests 500 --concurrency 20
+    python bench.py --provider openrouter:rate_limit=0.3 --provider groq:latency=1.5
+    python bench.py --endpoint stream --dashboard-ratio 0 --json resultado.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+
+# La configuración se lee al importar los módulos de la app: va antes de importarlos
+_workdir = tempfile.mkdtemp(prefix="bench-")
+os.environ.update({
+    "SUPABASE_URL": "http://fake-postgrest",
+    "SUPABASE_KEY": "bench",
+    "OPENROUTER_API_KEY": "bench",
+    "GROQ_API_KEY": "bench",
+    "GEMINI_API_KEY": "bench",
+    "WAL_PATH": os.path.join(_workdir, "write_ahead_log.db"),
+    "DASHBOARD_FILE": os.path.join(_workdir, "dashboard.html"),
+    "AI_CACHE_DB": "",
+})
+
+import httpx
+import psutil
+from openai import AsyncOpenAI
+from groq import AsyncGroq
+from google import genai
+from google.genai import types
+
+import ai
+import main
+import postgrest_async
+import fake_postgrest
+import fake_llm
+
+STUB_URL = "http://fake-llm"
+
+# Mitad gastos/tareas obvios (fast path), mitad texto libre que necesita al LLM
+MESSAGES = [
+    "gasté {n} dólares en taxi",
+    "pagué {n} pesos de almuerzo",
+    "recordar llamar al dentista mañana",
+    "tengo que revisar el informe {n} el viernes",
+    "idea: armar una lista de lecturas para el proyecto {n}",
+    "hoy estuve pensando en cambiar de rutina, intento {n}",
+    "¿qué te parece si organizamos la semana {n}?",
+    "el viaje {n} a la costa fue mejor de lo esperado",
+]
+
+def _stub_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_llm.app), timeout=60)
+
+def install_stubs():
+    """Apunta los tres SDKs a fake_llm y la base de datos a fake_postgrest."""
+    ai.openrouter_client = AsyncOpenAI(base_url=f"{STUB_URL}/openrouter/v1", api_key="bench",
+                                       http_client=_stub_client())
+    ai.groq_client = AsyncGroq(base_url=f"{STUB_URL}/groq", api_key="bench", http_client=_stub_client())
+    ai.gemini_client = genai.Client(api_key="bench", http_options=types.HttpOptions(
+        base_url=f"{STUB_URL}/gemini/", httpx_async_client=_stub_client()))
+    postgrest_async.configure(base_url="http://fake-postgrest",
+                              transport=httpx.ASGITransport(app=fake_postgrest.app))
+
+def percentile(values: list, p: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+class MemorySampler:
+    """RSS del proceso cada `interval` segundos; guarda el máximo observado."""
+
+    def __init__(self, interval: float = 0.1):
+        self.process = psutil.Process()
+        self.interval = interval
+        self.start_rss = self.process.memory_info().rss
+        self.peak_rss = self.start_rss
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> dict:
+        self._task.cancel()
+        end_rss = self.process.memory_info().rss
+        mb = 1024 * 1024
+        return {"start_mb": round(self.start_rss / mb, 1), "end_mb": round(end_rss / mb, 1),
+                "peak_mb": round(max(self.peak_rss, end_rss) / mb, 1)}
+
+async def run(args) -> dict:
+    install_stubs()
+    random.seed(args.seed)
+    chat_path = "/api/chat/stream" if args.endpoint == "stream" else "/api/chat"
+    latencies = {"chat": [], "dashboard": []}
+    errors = {"chat": 0, "dashboard": 0}
+    issued = 0
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            async def one_request():
+                kind = "dashboard" if random.random() < args.dashboard_ratio else "chat"
+                start = time.perf_counter()
+                try:
+                    if kind == "dashboard":
+                        response = await client.get("/", headers={"Accept-Encoding": "gzip, br"})
+                    else:
+                        message = random.choice(MESSAGES).format(n=random.randint(1, 10 ** 6))
+                        response = await client.post(chat_path, data={"message": message})
+                    ok = response.status_code < 400
+                except Exception as e:
+                    logging.error(f"Request falló: {e}")
+                    ok = False
+                latencies[kind].append(time.perf_counter() - start)
+                if not ok:
+                    errors[kind] += 1
+
+            async def worker():
+                nonlocal issued
+                while issued < args.requests:
+                    issued += 1
+                    await one_request()
+
+            for _ in range(args.warmup):
+                await one_request()
+            for kind in latencies:
+                latencies[kind].clear()
+                errors[kind] = 0
+
+            sampler = MemorySampler()
+            sampler.start()
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+            memory = await sampler.stop()
+
+        await main.dashboard_scheduler.flush(timeout=10)
+        report = {
+            "config": {"requests": args.requests, "concurrency": args.concurrency, "endpoint": chat_path,
+                       "dashboard_ratio": args.dashboard_ratio, "providers": fake_llm.SETTINGS},
+            "elapsed_seconds": round(elapsed, 3),
+            "requests_per_second": round(args.requests / elapsed, 1) if elapsed else None,
+            "endpoints": {
+                kind: {
+                    "count": len(values),
+                    "errors": errors[kind],
+                    "p50_ms": _ms(percentile(values, 50)),
+                    "p95_ms": _ms(percentile(values, 95)),
+                    "p99_ms": _ms(percentile(values, 99)),
+                    "max_ms": _ms(max(values) if values else None),
+                } for kind, values in latencies.items()
+            },
+            "dashboard": main.dashboard_scheduler.stats(),
+            "stub_providers": fake_llm.counters,
+            "providers": ai.get_provider_status(),
+            "rows": {table: len(rows) for table, rows in fake_postgrest.tables.items()},
+            "memory": memory,
+        }
+    return report
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+def print_report(report: dict):
+    print(f"\n{report['config']['requests']} requests, concurrencia {report['config']['concurrency']}, "
+          f"{report['elapsed_seconds']}s -> {report['requests_per_second']} req/s")
+    print(f"{'endpoint':<10} {'n':>6} {'err':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (ms)")
+    for kind, stats in report["endpoints"].items():
+        print(f"{kind:<10} {stats['count']:>6} {stats['errors']:>5} " + " ".join(
+            f"{stats[k] if stats[k] is not None else '-':>9}" for k in ("p50_ms", "p95_ms", "p99_ms", "max_ms")))
+    dashboard = report["dashboard"]
+    print(f"dashboard: {dashboard['runs']} regeneraciones para {dashboard['notifications']} avisos "
+          f"({dashboard['coalesced']} agrupados, render medio {dashboard['avg_render_seconds']}s)")
+    print("proveedores: " + ", ".join(
+        f"{name} {c['requests']} req / {c['errors']} err / {c['rate_limited']} 429"
+        for name, c in report["stub_providers"].items()) + f" | orden actual {report['providers']['order']}")
+    print(f"filas escritas: {report['rows']}")
+    memory = report["memory"]
+    print(f"memoria RSS: {memory['start_mb']} -> {memory['end_mb']} MB (pico {memory['peak_mb']} MB)")
+
+def parse_provider(spec: str):
+    """"openrouter:latency=0.5,rate_limit=0.1" -> ("openrouter", {"latency": 0.5, "rate_limit": 0.1})"""
+    name, _, options = spec.partition(":")
+    if name not in fake_llm.SETTINGS:
+        raise argparse.ArgumentTypeError(f"proveedor desconocido: {name}")
+    settings = {}
+    for option in filter(None, options.split(",")):
+        key, _, value = option.partition("=")
+        if key not in fake_llm.DEFAULTS:
+            raise argparse.ArgumentTypeError(f"opción desconocida: {key}")
+        settings[key] = type(fake_llm.DEFAULTS[key])(float(value))
+    return name, settings
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark offline de la API con proveedores y base falsos")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--dashboard-ratio", type=float, default=0.2, help="fracción de requests a GET /")
+    parser.add_argument("--endpoint", choices=["chat", "stream"], default="chat")
+    parser.add_argument("--latency", type=float, default=fake_llm.DEFAULTS["latency"])
+    parser.add_argument("--jitter", type=float, default=fake_llm.DEFAULTS["jitter"])
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fracción de respuestas 429")
+    parser.add_argument("--provider", type=parse_provider, action="append", default=[],
+                        help="ajustes de un proveedor, p. ej. groq:latency=1.5,error_rate=0.2")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="guardar el reporte completo en este archivo")
+    parser.add_argument("--max-p95", type=float, help="falla si el p95 de chat (ms) lo supera")
+    parser.add_argument("--max-error-rate", type=float, help="falla si la tasa de error total lo supera")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    for name in fake_llm.SETTINGS:
+        fake_llm.configure(name, latency=args.latency, jitter=args.jitter,
+                           error_rate=args.error_rate, rate_limit=args.rate_limit)
+    for name, settings in args.provider:
+        fake_llm.configure(name, **settings)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    failed = []
+    chat_p95 = report["endpoints"]["chat"]["p95_ms"]
+    if args.max_p95 is not None and chat_p95 is not None and chat_p95 > args.max_p95:
+        failed.append(f"p95 de chat {chat_p95} ms > {args.max_p95} ms")
+    total_errors = sum(e["errors"] for e in report["endpoints"].values())
+    if args.max_error_rate is not None and total_errors / args.requests > args.max_error_rate:
+        failed.append(f"tasa de error {total_errors / args.requests:.3f} > {args.max_error_rate}")
+    for reason in failed:
+        print(f"FALLO: {reason}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,216 @@
+"""
+Coordinación entre workers de uvicorn (`--workers N`) en una misma máquina.
+
+- Líder: el worker que tiene el flock de COORD_LOCK_FILE. Sólo él regenera
+  dashboard.html y reproduce el WAL; el lock lo libera el sistema operativo si
+  el proceso muere, y otro worker lo toma en el siguiente intento.
+- Bus: una tabla SQLite (COORD_DB) donde cada worker agrega eventos
+  ("write" con las filas guardadas, "page" cuando el líder publicó una página
+  nueva) y de la que todos leen lo nuevo cada COORD_POLL_INTERVAL. Así cada
+  worker aplica a sus agregados en memoria lo que escribieron los demás,
+  invalida sus cachés y recarga la página compartida desde disco.
+
+Con COORDINATION_ENABLED=false (un solo proceso, el default) este worker es
+siempre el líder y publicar en el bus no hace nada.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import contextvars
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:  # sin flock (Windows) no hay elección: cada proceso se considera líder
+    fcntl = None
+
+COORDINATION_ENABLED = os.getenv(
+    "COORDINATION_ENABLED", str(int(os.getenv("WEB_CONCURRENCY", "1")) > 1)).lower() == "true"
+COORD_DB = os.getenv("COORD_DB", "coordination.db")
+COORD_LOCK_FILE = os.getenv("COORD_LOCK_FILE", "coordination.lock")
+COORD_POLL_INTERVAL = float(os.getenv("COORD_POLL_INTERVAL", "0.2"))
+COORD_LEADER_RETRY = float(os.getenv("COORD_LEADER_RETRY", "2.0"))
+COORD_EVENT_TTL = float(os.getenv("COORD_EVENT_TTL", "300"))
+
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+class Coordinator:
+    def __init__(self, enabled: bool = COORDINATION_ENABLED, db_path: str = COORD_DB,
+                 lock_path: str = COORD_LOCK_FILE, poll_interval: float = COORD_POLL_INTERVAL):
+        self.enabled = enabled and fcntl is not None
+        self.db_path = db_path
+        self.lock_path = lock_path
+        self.poll_interval = poll_interval
+        self.leader = not self.enabled
+        self._lock_fd = None
+        self._db = None
+        self._db_lock = threading.Lock()  # una conexión compartida por los hilos de asyncio.to_thread
+        self._last_seq = 0
+        self._handlers = {}
+        self._on_elected = []
+        self._tasks = []
+        self.published = 0
+        self.received = 0
+        self.last_error = None
+
+    # --- elección de líder ---
+
+    def _try_lock(self) -> bool:
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        os.ftruncate(self._lock_fd, 0)
+        os.write(self._lock_fd, WORKER_ID.encode())
+        return True
+
+    def on_elected(self, callback):
+        """callback() se llama (en el event loop) cuando este worker pasa a ser el líder."""
+        if callback not in self._on_elected:
+            self._on_elected.append(callback)
+        return callback
+
+    def _become_leader(self):
+        self.leader = True
+        logging.info(f"Worker {WORKER_ID} es el líder (regenera el dashboard y reproduce el WAL)")
+        for callback in self._on_elected:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Error al asumir como líder: {e}")
+
+    async def _campaign(self):
+        while not self.leader:
+            if await asyncio.to_thread(self._try_lock):
+                self._become_leader()
+                return
+            await asyncio.sleep(COORD_LEADER_RETRY)
+
+    # --- bus de eventos ---
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    origin TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )""")
+            self._db.commit()
+        return self._db
+
+    def subscribe(self, kind: str, handler=None):
+        """handler(payload) (función o corrutina) para los eventos `kind` de los otros workers. Sirve como decorador."""
+        if handler is None:
+            return lambda func: self.subscribe(kind, func)
+        self._handlers.setdefault(kind, []).append(handler)
+        return handler
+
+    def _append(self, kind: str, payload: str):
+        with self._db_lock, self._connect() as db:
+            db.execute("INSERT INTO events (origin, kind, payload, created_at) VALUES (?, ?, ?, ?)",
+                       (WORKER_ID, kind, payload, time.time()))
+
+    async def publish(self, kind: str, payload: dict):
+        """Avisa a los demás workers. No hace nada si la coordinación está apagada."""
+        if not self.enabled:
+            return
+        try:
+            await asyncio.to_thread(self._append, kind, json.dumps(payload, ensure_ascii=False, default=str))
+            self.published += 1
+        except sqlite3.Error as e:
+            # Los demás se resincronizan en su próxima reconciliación: no se corta la escritura por esto
+            self.last_error = str(e)
+            logging.error(f"No se pudo publicar '{kind}' en el bus de coordinación: {e}")
+
+    def _read_since(self, seq: int):
+        with self._db_lock:
+            db = self._connect()
+            rows = db.execute("SELECT seq, origin, kind, payload FROM events WHERE seq > ? ORDER BY seq",
+                              (seq,)).fetchall()
+            if self.leader and rows:
+                with db:
+                    db.execute("DELETE FROM events WHERE created_at < ?", (time.time() - COORD_EVENT_TTL,))
+            return rows
+
+    def _current_seq(self) -> int:
+        with self._db_lock:
+            return self._connect().execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0]
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                rows = await asyncio.to_thread(self._read_since, self._last_seq)
+            except sqlite3.Error as e:
+                self.last_error = str(e)
+                logging.error(f"Error leyendo el bus de coordinación: {e}")
+                continue
+            for seq, origin, kind, payload in rows:
+                self._last_seq = seq
+                if origin == WORKER_ID:
+                    continue
+                self.received += 1
+                for handler in self._handlers.get(kind, ()):
+                    try:
+                        result = handler(json.loads(payload))
+                        if asyncio.iscoroutine(result):
+                            await result
+                    except Exception as e:
+                        logging.error(f"Error aplicando el evento '{kind}' de {origin}: {e}")
+
+    # --- ciclo de vida ---
+
+    async def start(self):
+        if not self.enabled:
+            self._become_leader()
+            return
+        # Sólo lo que pase desde ahora: lo anterior ya está en Supabase/WAL y entra con la reconciliación
+        self._last_seq = await asyncio.to_thread(self._current_seq)
+        # El primer intento es sincrónico: al terminar start() ya se sabe si este worker es el líder
+        if await asyncio.to_thread(self._try_lock):
+            self._become_leader()
+        loop = asyncio.get_running_loop()
+        # Contexto vacío: son tareas de fondo, no heredan la traza de nadie
+        self._tasks = [loop.create_task(self._poll(), context=contextvars.Context())]
+        if not self.leader:
+            self._tasks.append(loop.create_task(self._campaign(), context=contextvars.Context()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)  # libera el flock: otro worker toma el liderazgo
+            self._lock_fd = None
+            self.leader = not self.enabled
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def is_leader(self) -> bool:
+        return self.leader
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "worker": WORKER_ID, "leader": self.leader,
+                "published": self.published, "received": self.received, "last_seq": self._last_seq,
+                "last_error": self.last_error}
+
+coordinator = Coordinator()
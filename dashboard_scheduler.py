@@ -0,0 +1,150 @@
+"""
+Planificador de regeneraciones del dashboard.
+
+Un único worker en segundo plano con un flag de "sucio": cualquier cantidad
+de avisos de escritura se agrupa (debounce) en como mucho una regeneración
+pendiente, con un tope de antigüedad para que una ráfaga continua no la
+posponga para siempre. Si llega un aviso mientras se está renderizando, se
+vuelve a renderizar al terminar, así nunca se pierde la última escritura.
+"""
+import os
+import time
+import asyncio
+import contextvars
+import logging
+
+import metrics
+import tracing
+
+DASHBOARD_DEBOUNCE = float(os.getenv("DASHBOARD_DEBOUNCE", "0.5"))
+DASHBOARD_MAX_STALENESS = float(os.getenv("DASHBOARD_MAX_STALENESS", "5.0"))
+
+RENDER_SECONDS = metrics.Histogram("dashboard_render_seconds", "Duración de cada regeneración del dashboard", ["outcome"])
+
+class RegenerationScheduler:
+    def __init__(self, render, debounce: float = DASHBOARD_DEBOUNCE, max_staleness: float = DASHBOARD_MAX_STALENESS):
+        self.render = render
+        self.debounce = debounce
+        self.max_staleness = max_staleness
+        self._event = None
+        self._worker = None
+        self._first_dirty = None
+        self._last_notify = None
+        self._idle = None
+        self._links = []  # trazas de los requests que pidieron la próxima regeneración
+        # Métricas
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.notifications = 0
+        self.runs = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.last_render_seconds = None
+        self.total_render_seconds = 0.0
+        self.last_run_at = None
+        self.last_error = None
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._event = self._event or asyncio.Event()
+            self._idle = self._idle or asyncio.Event()
+            # Contexto vacío: el worker sobrevive al request que lo arranca y no debe heredar su traza
+            self._worker = asyncio.get_running_loop().create_task(self._run(), context=contextvars.Context())
+
+    def start(self):
+        self._ensure_worker()
+
+    def notify(self):
+        """Marca el dashboard como sucio. No bloquea y nunca descarta el aviso."""
+        self._ensure_worker()
+        now = asyncio.get_running_loop().time()
+        if self._first_dirty is None:
+            self._first_dirty = now
+        self._last_notify = now
+        self.notifications += 1
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        context = tracing.current_context()
+        if context is not None:
+            tracing.add_event("dashboard.scheduled", pending=self.queue_depth)
+            if len(self._links) < 32:
+                self._links.append(context)
+        self._idle.clear()
+        self._event.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._event.is_set():
+                self._idle.set()
+            await self._event.wait()
+            # Debounce: esperamos a que la ráfaga se calme, pero nunca más que max_staleness
+            while True:
+                deadline = min(self._last_notify + self.debounce, self._first_dirty + self.max_staleness)
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(remaining)
+
+            self._event.clear()
+            batch = self.queue_depth
+            waited = loop.time() - self._first_dirty
+            self.queue_depth = 0
+            self._first_dirty = None
+            links, self._links = self._links, []
+            self.coalesced += max(0, batch - 1)
+
+            start = time.perf_counter()
+            outcome = "success"
+            try:
+                logging.info(f"Regenerando dashboard ({batch} escrituras agrupadas)...")
+                # Traza propia, enlazada a los requests que la pidieron
+                with tracing.start_trace("dashboard.regenerate", links=links, coalesced=batch,
+                                        waited_seconds=round(waited, 3)) as trace:
+                    if await self.render() is False:
+                        self.failures += 1
+                        outcome = "failure"
+                        if trace is not None:
+                            trace.status = tracing.STATUS_ERROR
+            except Exception as e:
+                self.failures += 1
+                outcome = "failure"
+                self.last_error = str(e)
+                logging.error(f"Error regenerating dashboard: {e}")
+            finally:
+                self.runs += 1
+                self.last_render_seconds = time.perf_counter() - start
+                RENDER_SECONDS.observe(self.last_render_seconds, outcome=outcome)
+                self.total_render_seconds += self.last_render_seconds
+                self.last_run_at = time.time()
+
+    async def flush(self, timeout: float = None):
+        """Espera a que no quede ninguna regeneración pendiente."""
+        if self._idle is None:
+            return
+        await asyncio.wait_for(self._idle.wait(), timeout)
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "notifications": self.notifications,
+            "runs": self.runs,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "last_render_seconds": round(self.last_render_seconds, 4) if self.last_render_seconds is not None else None,
+            "avg_render_seconds": round(self.total_render_seconds / self.runs, 4) if self.runs else None,
+            "last_run_at": self.last_run_at,
+            "last_error": self.last_error,
+            "debounce": self.debounce,
+            "max_staleness": self.max_staleness,
+        }
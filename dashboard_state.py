@@ -0,0 +1,282 @@
+"""
+Agregados del dashboard en memoria.
+
+Se cargan una vez desde Supabase (y se reconcilian cada tanto) y luego
+`database.add_expense` / `add_task` / `add_note` los actualizan en O(1),
+así regenerar el dashboard no necesita volver a consultar las tablas.
+"""
+import os
+import uuid
+import time
+import heapq
+from collections import deque, OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+
+DASHBOARD_RECENT_EXPENSES = int(os.getenv("DASHBOARD_RECENT_EXPENSES", "10"))
+DASHBOARD_RECENT_TASKS = int(os.getenv("DASHBOARD_RECENT_TASKS", "5"))
+DASHBOARD_RECENT_NOTES = int(os.getenv("DASHBOARD_RECENT_NOTES", "10"))
+DASHBOARD_DAILY_WINDOW = int(os.getenv("DASHBOARD_DAILY_WINDOW", "90"))  # días que guardamos en buckets
+DASHBOARD_CATEGORY_LIMIT = int(os.getenv("DASHBOARD_CATEGORY_LIMIT", "50"))  # categorías que traemos del servidor
+DASHBOARD_RECONCILE_INTERVAL = float(os.getenv("DASHBOARD_RECONCILE_INTERVAL", "900"))
+DASHBOARD_USER_STATES = int(os.getenv("DASHBOARD_USER_STATES", "256"))  # usuarios con agregados en memoria
+DASHBOARD_WRITE_JOURNAL = int(os.getenv("DASHBOARD_WRITE_JOURNAL", "1000"))  # escrituras que recordamos para reconciliar
+
+# Lo que el dashboard muestra de cada fila reciente (no hace falta mandar user_id ni el resto)
+RECENT_FIELDS = {
+    "expenses": ("id", "description", "amount", "currency", "created_at"),
+    "tasks": ("id", "description", "deadline", "created_at"),
+    "notes": ("id", "content", "created_at"),
+}
+
+def recent_view(table: str, rows) -> list:
+    return [{field: row.get(field) for field in RECENT_FIELDS[table]} for row in rows]
+
+# Distingue los cursores de este proceso de los de uno anterior (la versión vuelve a empezar)
+BOOT_ID = uuid.uuid4().hex[:8]
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+class DashboardState:
+    """Totales, sumas por categoría, buckets diarios y anillos de ítems recientes."""
+
+    def __init__(self):
+        self.lock = Lock()
+        # Crece con cada cambio y no vuelve atrás al recargar: es la base de los ETags y cursores
+        self.version = 0
+        # (versión, tabla, fila) de las últimas escrituras: sobrevive a las recargas para reaplicar
+        # lo que se registró mientras la reconciliación consultaba Supabase
+        self._journal = deque(maxlen=DASHBOARD_WRITE_JOURNAL)
+        self.reset()
+
+    def reset(self):
+        self.total_expenses = 0.0
+        self.expense_count = 0
+        self.category_totals = {}
+        self._top_cache = None  # (n, [(categoría, total), ...]) mantenido al registrar gastos
+        self.daily_totals = {}
+        self.pending_tasks = 0
+        self.total_notes = 0
+        self.recent_expenses = deque(maxlen=DASHBOARD_RECENT_EXPENSES)
+        self.recent_pending_tasks = deque(maxlen=DASHBOARD_RECENT_TASKS)
+        self.recent_notes = deque(maxlen=DASHBOARD_RECENT_NOTES)
+        # Versión en la que entró cada ítem de los anillos (mismo orden), para los deltas de recent_since
+        self._recent_seqs = {"expenses": deque(maxlen=DASHBOARD_RECENT_EXPENSES),
+                             "tasks": deque(maxlen=DASHBOARD_RECENT_TASKS),
+                             "notes": deque(maxlen=DASHBOARD_RECENT_NOTES)}
+        self.base_version = self.version + 1  # los cursores anteriores a la última recarga ya no sirven
+        self.loaded = False
+        self.last_reconciled = 0.0
+
+    def needs_reconcile(self) -> bool:
+        return not self.loaded or time.monotonic() - self.last_reconciled > DASHBOARD_RECONCILE_INTERVAL
+
+    def load(self, expenses, tasks, notes):
+        """Reconstrucción completa a partir de filas ordenadas por created_at descendente."""
+        with self.lock:
+            self.reset()
+            for e in reversed(expenses):
+                self._add_expense(e)
+            for t in reversed(tasks):
+                self._add_task(t)
+            for n in reversed(notes):
+                self._add_note(n)
+            self.loaded = True
+            self.last_reconciled = time.monotonic()
+            self.version += 1
+
+    def load_aggregates(self, aggregates: dict, recent_expenses, recent_tasks, recent_notes, unsaved=()):
+        """
+        Reconstrucción a partir de los agregados del servidor (aggregates.py) y los listados recientes.
+        `unsaved` son las filas [(tabla, fila), ...] que la consulta no pudo ver (todavía en el WAL o
+        escritas mientras tanto): se vuelven a sumar encima, como si se registraran de nuevo.
+        """
+        with self.lock:
+            self.reset()
+            self.total_expenses = aggregates["total_expenses"]
+            self.expense_count = aggregates["expense_count"]
+            self.pending_tasks = aggregates["pending_tasks"]
+            self.total_notes = aggregates["total_notes"]
+            self.category_totals = dict(aggregates["top_categories"])
+            self._top_cache = None
+            self.daily_totals = dict(aggregates["daily"])
+            self.recent_expenses.extend(recent_expenses)
+            self.recent_pending_tasks.extend(recent_tasks)
+            self.recent_notes.extend(recent_notes)
+            for name, ring in (("expenses", self.recent_expenses), ("tasks", self.recent_pending_tasks),
+                               ("notes", self.recent_notes)):
+                self._recent_seqs[name].extend([self.version + 1] * len(ring))
+            adders = {"expenses": self._add_expense, "tasks": self._add_task, "notes": self._add_note}
+            for table, row in unsaved:
+                adders[table](row)
+            self.loaded = True
+            self.last_reconciled = time.monotonic()
+            self.version += 1
+
+    def _add_expense(self, row: dict):
+        amount = float(row.get("amount") or 0)
+        description = row.get("description") or "Otros"
+        self.total_expenses += amount
+        self.expense_count += 1
+        self.category_totals[description] = self.category_totals.get(description, 0) + amount
+        self._update_top_cache(description, amount)
+        day = (row.get("created_at") or "")[:10]
+        if day:
+            self.daily_totals[day] = self.daily_totals.get(day, 0) + amount
+            if len(self.daily_totals) > DASHBOARD_DAILY_WINDOW:
+                # Los buckets viejos no se muestran nunca: descartamos el más antiguo
+                del self.daily_totals[min(self.daily_totals)]
+        self.recent_expenses.appendleft(row)
+        self._recent_seqs["expenses"].appendleft(self.version + 1)
+
+    def _update_top_cache(self, description: str, amount: float):
+        """Los totales sólo crecen: basta con ver si la categoría tocada entra (o sube) en el top."""
+        if self._top_cache is None:
+            return
+        n, top = self._top_cache
+        total = self.category_totals[description]
+        if amount < 0:
+            self._top_cache = None  # un total que baja puede sacar a alguien del top: se recalcula
+        elif any(name == description for name, _ in top) or len(top) < n or total > top[-1][1]:
+            top = [item for item in top if item[0] != description] + [(description, total)]
+            top.sort(key=lambda x: x[1], reverse=True)
+            self._top_cache = (n, top[:n])
+
+    def _add_task(self, row: dict):
+        if row.get("status", "pending") == "pending":
+            self.pending_tasks += 1
+            self.recent_pending_tasks.appendleft(row)
+            self._recent_seqs["tasks"].appendleft(self.version + 1)
+
+    def _add_note(self, row: dict):
+        self.total_notes += 1
+        self.recent_notes.appendleft(row)
+        self._recent_seqs["notes"].appendleft(self.version + 1)
+
+    def record_expense(self, row: dict):
+        with self.lock:
+            self._add_expense(row)
+            self.version += 1
+            self._journal.append((self.version, "expenses", row))
+
+    def record_task(self, row: dict):
+        with self.lock:
+            self._add_task(row)
+            self.version += 1
+            self._journal.append((self.version, "tasks", row))
+
+    def record_note(self, row: dict):
+        with self.lock:
+            self._add_note(row)
+            self.version += 1
+            self._journal.append((self.version, "notes", row))
+
+    def record(self, table: str, row: dict):
+        {"expenses": self.record_expense, "tasks": self.record_task, "notes": self.record_note}[table](row)
+
+    def writes_since(self, version: int) -> list:
+        """Las escrituras registradas después de `version`, en orden: [(tabla, fila), ...]."""
+        with self.lock:
+            return [(table, row) for v, table, row in self._journal if v > version]
+
+    def _top_categories(self, n: int):
+        if self._top_cache is None or self._top_cache[0] != n:
+            self._top_cache = (n, heapq.nlargest(n, self.category_totals.items(), key=lambda x: x[1]))
+        return list(self._top_cache[1])
+
+    def _daily_series(self, days: int):
+        dates = sorted(self.daily_totals)[-days:]
+        return dates, [self.daily_totals[d] for d in dates]
+
+    def top_categories(self, n: int = 5):
+        with self.lock:
+            return self._top_categories(n)
+
+    def daily_series(self, days: int = 7):
+        """Los últimos `days` días con gastos (mismo criterio que el dashboard original)."""
+        with self.lock:
+            return self._daily_series(days)
+
+    def cursor(self, version: int = None) -> str:
+        return f"{BOOT_ID}.{self.version if version is None else version}"
+
+    def summary(self, top_n: int = 5, days: int = 7) -> dict:
+        """Totales y series de los gráficos, consistentes con una misma versión."""
+        with self.lock:
+            categories = self._top_categories(top_n)
+            dates, values = self._daily_series(days)
+            return {
+                "cursor": self.cursor(),
+                "total_expenses": self.total_expenses,
+                "expense_count": self.expense_count,
+                "pending_tasks": self.pending_tasks,
+                "total_notes": self.total_notes,
+                "categories": {"labels": [c[0] for c in categories], "values": [c[1] for c in categories]},
+                "daily": {"labels": dates, "values": values},
+            }
+
+    def recent_since(self, cursor: str = None) -> dict:
+        """
+        Ítems recientes que entraron después de `cursor` (el de una respuesta anterior).
+        Con un cursor ausente, de otro proceso o anterior a la última recarga devuelve
+        los anillos completos con reset=True: el cliente reemplaza en vez de agregar.
+        """
+        boot, _, version = (cursor or "").partition(".")
+        with self.lock:
+            since = int(version) if boot == BOOT_ID and version.isdigit() else None
+            reset = since is None or not self.base_version <= since <= self.version
+            rings = {"expenses": self.recent_expenses, "tasks": self.recent_pending_tasks,
+                     "notes": self.recent_notes}
+            items = {}
+            for name, ring in rings.items():
+                seqs = self._recent_seqs[name]
+                items[name] = [row for row, seq in zip(ring, seqs) if reset or seq > since]
+            return {"cursor": self.cursor(), "reset": reset, **items}
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "total_expenses": self.total_expenses,
+                "expense_count": self.expense_count,
+                "pending_tasks": self.pending_tasks,
+                "total_notes": self.total_notes,
+                "recent_expenses": list(self.recent_expenses),
+                "recent_pending_tasks": list(self.recent_pending_tasks),
+                "recent_notes": list(self.recent_notes),
+                "version": self.version,
+                "cursor": self.cursor(),
+            }
+
+class UserStates:
+    """Un DashboardState por usuario, sólo para los últimos DASHBOARD_USER_STATES usuarios activos."""
+
+    def __init__(self, capacity: int = DASHBOARD_USER_STATES):
+        self.capacity = capacity
+        self._states = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id) -> DashboardState:
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is not None:
+                self._states.move_to_end(user_id)
+            return state
+
+    def get_or_create(self, user_id) -> DashboardState:
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is None:
+                state = self._states[user_id] = DashboardState()
+                if len(self._states) > self.capacity:
+                    # El menos usado se vuelve a cargar de Supabase si regresa
+                    self._states.popitem(last=False)
+            else:
+                self._states.move_to_end(user_id)
+            return state
+
+    def __len__(self):
+        return len(self._states)
+
+state = DashboardState()
+user_states = UserStates()
@@ -1,8 +1,19 @@
 import asyncio
 import os
+import logging
+from contextlib import nullcontext
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
+import coordination
+import live_updates
+import page_cache
+import postgrest_async
+import tracing
+from dashboard_state import state as dashboard_state, user_states, now_iso
+from write_behind import WriteBehindBuffer
+from write_ahead_log import WriteAheadLog, Replayer
+
 load_dotenv()
 
 url: str = os.getenv("SUPABASE_URL")
@@ -11,8 +22,208 @@ key: str = os.getenv("SUPABASE_KEY")
 if not url or not key:
     raise ValueError("SUPABASE_URL or SUPABASE_KEY not found in environment variables")
 
+# Synchronous client, kept for the Streamlit dashboard (dashboard.py).
+# The API goes through the native async PostgREST client in postgrest_async.
 supabase: Client = create_client(url, key)
 
+# Every insert is made durable in the local write-ahead log first and replayed to Supabase in the background
+WAL_ENABLED = os.getenv("WAL_ENABLED", "true").lower() == "true"
+# Columna con restricción UNIQUE para que los reintentos del replay sean idempotentes (ver schema.sql).
+# Si la base no tiene la migración se desactiva sola (ver _disable_idempotency).
+IDEMPOTENCY_COLUMN = os.getenv("WAL_IDEMPOTENCY_COLUMN", "idempotency_key")
+
+# Lo que responde PostgREST cuando falta la columna (PGRST204 / 42703) o su índice único (42P10)
+MISSING_SCHEMA_CODES = ("PGRST204", "42703", "42P10")
+
+def _missing_idempotency_schema(error: Exception) -> bool:
+    return (isinstance(error, postgrest_async.PostgrestError) and error.status_code == 400
+            and any(code in error.body for code in MISSING_SCHEMA_CODES))
+
+def _disable_idempotency(reason: str):
+    global IDEMPOTENCY_COLUMN
+    if IDEMPOTENCY_COLUMN:
+        logging.error(f"La base no tiene la migración de schema.sql para '{IDEMPOTENCY_COLUMN}' ({reason}). "
+                      f"El WAL sigue con inserts comunes: un reintento después de un timeout puede DUPLICAR filas. "
+                      f"Corré schema.sql en Supabase y reiniciá.")
+    IDEMPOTENCY_COLUMN = None
+
+async def _insert_rows(table: str, rows: list):
+    """Un único insert masivo. Devuelve una fila (o None si era un duplicado) por cada fila enviada, en orden."""
+    column = IDEMPOTENCY_COLUMN
+    if column and rows and all(r.get(column) for r in rows):
+        try:
+            inserted = await postgrest_async.insert(table, rows, on_conflict=column, ignore_duplicates=True)
+        except postgrest_async.PostgrestError as e:
+            if not _missing_idempotency_schema(e):
+                raise
+            _disable_idempotency(e.body[:200])
+        else:
+            by_key = {r.get(column): r for r in inserted}
+            return [by_key.get(r[column]) for r in rows]
+    if column:
+        rows = [{k: v for k, v in r.items() if k != column} for r in rows]
+    return await postgrest_async.insert(table, rows)
+
+async def check_schema():
+    """Al arrancar: sin la columna de idempotencia cada replay fallaría con 400, mejor avisar ya."""
+    if not IDEMPOTENCY_COLUMN:
+        return
+    for table in write_buffers:
+        try:
+            await postgrest_async.select(table, columns=IDEMPOTENCY_COLUMN, limit=1)
+        except postgrest_async.PostgrestError as e:
+            if e.status_code == 400:
+                _disable_idempotency(f"{table}: {e.body[:200]}")
+                return
+            logging.warning(f"No se pudo verificar el esquema de {table}: {e}")
+        except Exception as e:
+            logging.warning(f"No se pudo verificar el esquema de {table}: {e}")
+
+# Un buffer write-behind por tabla: agrupa los inserts concurrentes en un solo round trip
+write_buffers = {
+    table: WriteBehindBuffer(table, lambda rows, table=table: _insert_rows(table, rows))
+    for table in ("expenses", "tasks", "notes")
+}
+
+async def _replay_insert(table: str, row: dict, key: str):
+    if IDEMPOTENCY_COLUMN:
+        row = {**row, IDEMPOTENCY_COLUMN: key}
+    return await write_buffers[table].submit(row)
+
+wal = WriteAheadLog() if WAL_ENABLED else None
+replayer = Replayer(wal, _replay_insert) if wal else None
+
+_replay_starter = None
+
+# Clave del WAL en las filas registradas en el dashboard: la reconciliación la usa para no sumar dos veces
+# una fila que está a la vez en el WAL y en lo que se registró mientras consultaba
+WAL_KEY = "_wal_key"
+
+async def _start_replay():
+    await check_schema()
+    replayer.start()
+
+def start_background():
+    """
+    Arranca el replayer del WAL. Lo llama el worker líder al asumir (ver coordination):
+    con varios workers el WAL es compartido y lo reproduce uno solo.
+    """
+    global _replay_starter
+    if replayer:
+        _replay_starter = asyncio.get_running_loop().create_task(_start_replay())
+
+async def flush_writes():
+    """Escribe todo lo que quede en los buffers (shutdown)."""
+    await asyncio.gather(*(buffer.close() for buffer in write_buffers.values()))
+
+async def write_stats():
+    stats = {table: buffer.stats() for table, buffer in write_buffers.items()}
+    if wal:
+        stats["wal"] = {**await wal.stats(), "replayed": replayer.replayed,
+                        "failures": replayer.failures, "dead_lettered": replayer.dead_lettered,
+                        "last_error": replayer.last_error, "idempotency_column": IDEMPOTENCY_COLUMN,
+                        "dead_letters": await wal.dead_letters(5)}
+    return stats
+
+def _inserted_row(inserted: dict, data: dict) -> dict:
+    """La fila que devolvió PostgREST o, si no trae created_at, la que mandamos con created_at local."""
+    if inserted and inserted.get("created_at"):
+        return inserted
+    return {**data, "created_at": now_iso()}
+
+async def _write(table: str, data: dict) -> dict:
+    """
+    Con WAL: vuelve en cuanto la fila es durable localmente; el replayer la sube después.
+    Sin WAL: espera al insert (agrupado) en Supabase.
+    """
+    if wal is None:
+        return _inserted_row(await write_buffers[table].submit(data), data)
+    key = await wal.append(table, data)
+    replayer.notify()
+    return {**data, "created_at": now_iso(), WAL_KEY: key}
+
+async def _write_many(table: str, rows: list) -> list:
+    """Varias filas de una tabla en un único append al WAL o un único insert masivo."""
+    if wal is None:
+        inserted = await _insert_rows(table, rows)
+        return [_inserted_row(i, d) for i, d in zip(list(inserted) + [None] * len(rows), rows)]
+    keys = await wal.append_many(table, rows)
+    replayer.notify()
+    created_at = now_iso()
+    return [{**data, "created_at": created_at, WAL_KEY: key} for data, key in zip(rows, keys)]
+
+def replay_paused():
+    """Mientras dure, ningún worker reproduce el WAL: lo pendiente no llega a Supabase en el medio."""
+    return wal.replay_lock() if wal else nullcontext()
+
+async def unsaved_rows(user_id: int = None) -> list:
+    """Las filas aceptadas en el WAL que Supabase todavía no tiene: [(tabla, fila), ...] en orden."""
+    if wal is None:
+        return []
+    return [(entry["table"], {**entry["row"], "created_at": entry["created_at"], WAL_KEY: entry["key"]})
+            for entry in await wal.unsaved(user_id)]
+
+RECORDERS = {
+    "expenses": dashboard_state.record_expense,
+    "tasks": dashboard_state.record_task,
+    "notes": dashboard_state.record_note,
+}
+
+def _record(table: str, rows: list):
+    """Actualiza el dashboard global y el de cada usuario que escribió, y avisa a los que están mirando."""
+    since = dashboard_state.cursor()
+    for row in rows:
+        RECORDERS[table](row)
+    live_updates.publish_change(since)
+    for user_id in {row.get("user_id") for row in rows}:
+        # Sólo se invalida la página de quien escribió; los demás usuarios siguen en caché
+        page_cache.user_pages.invalidate(user_id)
+        state = user_states.get(user_id)
+        if state is None or not state.loaded:
+            continue  # se carga completo de Supabase cuando alguien abra su dashboard
+        since = state.cursor()
+        for row in rows:
+            if row.get("user_id") == user_id:
+                state.record(table, row)
+        live_updates.publish_change(since, state, topic=user_id)
+
+async def _record_and_share(table: str, rows: list):
+    _record(table, rows)
+    await coordination.coordinator.publish("write", {"table": table, "rows": rows})
+
+@coordination.coordinator.subscribe("write")
+def _apply_remote_write(payload: dict):
+    """Filas que guardó otro worker: mismos agregados y cachés que si se hubieran escrito acá."""
+    _record(payload["table"], payload["rows"])
+    if coordination.coordinator.is_leader() and replayer:
+        replayer.notify()  # las agregó al WAL compartido: el líder es el que las reproduce
+
+async def add_entry(table: str, data: dict) -> dict:
+    with tracing.span("db.add_entry", table=table, wal=wal is not None):
+        row = await _write(table, data)
+    await _record_and_share(table, [row])
+    return row
+
+async def add_entries(entries: list) -> list:
+    """
+    entries: [(tabla, fila), ...] mezclando tablas. Hace un solo insert masivo por tabla
+    y devuelve las filas guardadas en el mismo orden de `entries`.
+    """
+    by_table = {}
+    for index, (table, data) in enumerate(entries):
+        by_table.setdefault(table, []).append((index, data))
+    results = [None] * len(entries)
+
+    async def write_table(table, items):
+        rows = await _write_many(table, [data for _, data in items])
+        await _record_and_share(table, rows)
+        for (index, _), row in zip(items, rows):
+            results[index] = row
+
+    with tracing.span("db.add_entries", rows=len(entries), wal=wal is not None):
+        await asyncio.gather(*(write_table(table, items) for table, items in by_table.items()))
+    return results
+
 async def add_expense(user_id: int, amount: float, description: str, currency: str = "USD"):
     data = {
         "user_id": user_id,
@@ -20,9 +231,7 @@ async def add_expense(user_id: int, amount: float, description: str, currency: s
         "description": description,
         "currency": currency
     }
-    # Use asyncio.to_thread to run the synchronous supabase call without blocking the event loop
-    response = await asyncio.to_thread(supabase.table("expenses").insert(data).execute)
-    return response
+    return await add_entry("expenses", data)
 
 async def add_task(user_id: int, description: str, deadline: str = None):
     data = {
@@ -31,17 +240,33 @@ async def add_task(user_id: int, description: str, deadline: str = None):
         "deadline": deadline,
         "status": "pending"
     }
-    response = await asyncio.to_thread(supabase.table("tasks").insert(data).execute)
-    return response
+    return await add_entry("tasks", data)
 
 async def add_note(user_id: int, content: str):
     data = {
         "user_id": user_id,
         "content": content
     }
-    response = await asyncio.to_thread(supabase.table("notes").insert(data).execute)
-    return response
+    return await add_entry("notes", data)
 
 async def get_pending_tasks(user_id: int):
-    response = await asyncio.to_thread(supabase.table("tasks").select("*").eq("user_id", user_id).eq("status", "pending").execute)
-    return response.data
+    return await postgrest_async.select("tasks", filters=[("user_id", "eq", user_id), ("status", "eq", "pending")])
+
+async def close():
+    """
+    Drena el WAL, vacía los buffers de escritura y cierra el pool HTTP (shutdown).
+    Se llama antes de coordinator.stop(): sólo el líder drena el WAL compartido, igual que lo reproduce uno solo.
+    """
+    if replayer:
+        if _replay_starter is not None:
+            _replay_starter.cancel()
+        await replayer.stop()
+        if coordination.coordinator.is_leader():
+            try:
+                await replayer.drain(timeout=5)
+            except Exception as e:
+                logging.error(f"No se pudo drenar el WAL al apagar (se reproducirá al arrancar): {e}")
+    await flush_writes()
+    await postgrest_async.close()
+    if wal:
+        wal.close()
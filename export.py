@@ -0,0 +1,146 @@
+"""
+Exportación masiva de expenses / tasks / notes en streaming.
+
+Las filas se leen con paginación keyset sobre (created_at, id) — nunca con
+offset — y se serializan página por página con generadores, así la memoria
+se mantiene plana tanto para 1k como para 10M filas. Formatos: CSV, NDJSON
+y Parquet (este último requiere `pyarrow`, que es opcional).
+"""
+import io
+import os
+import csv
+import json
+from datetime import date, datetime, timedelta
+
+import postgrest_async
+from postgrest_async import quote
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet es opcional: sin pyarrow sólo CSV y NDJSON
+    pyarrow = None
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+
+EXPORT_COLUMNS = {
+    "expenses": ["id", "user_id", "amount", "currency", "description", "created_at"],
+    "tasks": ["id", "user_id", "description", "deadline", "status", "created_at"],
+    "notes": ["id", "user_id", "content", "created_at"],
+}
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+def parse_date(value: str, name: str = "fecha") -> str:
+    """Valida un filtro de fecha (YYYY-MM-DD o fecha y hora ISO 8601); ValueError si no se entiende."""
+    try:
+        if len(value) == 10:
+            return date.fromisoformat(value).isoformat()
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"{name} inválida: {value!r} (usar YYYY-MM-DD o ISO 8601)") from None
+
+def _date_filters(date_from: str = None, date_to: str = None) -> list:
+    """date_to es inclusivo cuando viene sólo la fecha (YYYY-MM-DD)."""
+    filters = []
+    if date_from:
+        filters.append(("created_at", "gte", date_from))
+    if date_to:
+        if len(date_to) == 10:
+            filters.append(("created_at", "lt", (date.fromisoformat(date_to) + timedelta(days=1)).isoformat()))
+        else:
+            filters.append(("created_at", "lte", date_to))
+    return filters
+
+async def iter_pages(table: str, user_id: int = None, date_from: str = None, date_to: str = None,
+                     page_size: int = EXPORT_PAGE_SIZE):
+    """Páginas de filas en orden (created_at, id), continuando desde la última fila vista."""
+    base_filters = _date_filters(date_from, date_to)
+    if user_id is not None:
+        base_filters.append(("user_id", "eq", user_id))
+    columns = ",".join(EXPORT_COLUMNS[table])
+    cursor = None
+    while True:
+        filters = list(base_filters)
+        if cursor:
+            created_at, row_id = cursor
+            filters.append(("or", None, f"(created_at.gt.{quote(created_at)},"
+                                        f"and(created_at.eq.{quote(created_at)},id.gt.{row_id}))"))
+        page = await postgrest_async.select(table, columns=columns, filters=filters,
+                                            order="created_at,id", limit=page_size)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        cursor = (page[-1]["created_at"], page[-1]["id"])
+
+async def stream_csv(table: str, **query):
+    columns = EXPORT_COLUMNS[table]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    async for page in iter_pages(table, **query):
+        writer.writerows(page)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+async def stream_ndjson(table: str, **query):
+    async for page in iter_pages(table, **query):
+        yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in page).encode("utf-8")
+
+class _ChunkSink(io.RawIOBase):
+    """Destino de escritura que acumula bytes hasta que el generador los entrega."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def _parquet_value(column: str, value):
+    if value is None:
+        return None
+    if column == "amount":
+        return float(value)
+    if column in ("id", "user_id"):
+        return int(value)
+    return str(value)
+
+async def stream_parquet(table: str, **query):
+    """Un row group por página: el archivo se escribe incrementalmente sin tenerlo entero en memoria."""
+    columns = EXPORT_COLUMNS[table]
+    schema = pyarrow.schema([(c, pyarrow.float64() if c == "amount" else pyarrow.int64() if c in ("id", "user_id")
+                              else pyarrow.string()) for c in columns])
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        async for page in iter_pages(table, **query):
+            data = {c: [_parquet_value(c, row.get(c)) for row in page] for c in columns}
+            writer.write_table(pyarrow.Table.from_pydict(data, schema=schema))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.drain()
+
+STREAMERS = {"csv": stream_csv, "ndjson": stream_ndjson, "parquet": stream_parquet}
+
+def stream(table: str, fmt: str, **query):
+    return STREAMERS[fmt](table, **query)
@@ -0,0 +1,140 @@
+"""
+Proveedores LLM falsos (OpenRouter, Groq y Gemini) para benchmarks sin red.
+
+Imita lo que usan los SDKs de `ai.py`: chat completions de OpenAI (con y sin
+stream) bajo /openrouter y /groq, y generateContent / streamGenerateContent de
+Gemini bajo /gemini. Cada proveedor tiene latencia, jitter, tasa de error (500)
+y tasa de 429 configurables en `SETTINGS`. La respuesta sale de
+`fast_path.classify`, así el JSON es realista y determinista.
+
+Uso:
+    python fake_llm.py            # escucha en http://127.0.0.1:54322
+    AsyncOpenAI(base_url="http://stub/openrouter/v1", http_client=httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=fake_llm.app)))
+"""
+import os
+import json
+import time
+import random
+import asyncio
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+
+import fast_path
+
+app = FastAPI()
+
+DEFAULTS = {"latency": 0.2, "jitter": 0.1, "error_rate": 0.0, "rate_limit": 0.0, "chunks": 8}
+SETTINGS = {name: dict(DEFAULTS) for name in ("openrouter", "groq", "gemini")}
+counters = {name: {"requests": 0, "errors": 0, "rate_limited": 0} for name in SETTINGS}
+
+def configure(name: str, **settings):
+    SETTINGS[name].update(settings)
+
+def reset():
+    for name in SETTINGS:
+        SETTINGS[name] = dict(DEFAULTS)
+        counters[name] = {"requests": 0, "errors": 0, "rate_limited": 0}
+
+def answer(text: str) -> str:
+    """JSON con el formato de SYSTEM_INSTRUCTION (o de BATCH_SYSTEM_INSTRUCTION si llega un arreglo)."""
+    try:
+        items = json.loads(text)
+    except json.JSONDecodeError:
+        items = None
+    if isinstance(items, list):
+        return json.dumps({"results": [{"id": item["id"], **_classify(item["text"])} for item in items]},
+                          ensure_ascii=False)
+    return json.dumps(_classify(text), ensure_ascii=False)
+
+def _classify(text: str) -> dict:
+    result = fast_path.classify(text)
+    if result["confidence"] < fast_path.FAST_PATH_THRESHOLD:
+        return {"category": "NOTE", "data": {"content": text}, "response": "Anotado."}
+    return {key: result[key] for key in ("category", "data", "response")}
+
+async def _simulate(name: str):
+    """Espera la latencia simulada y devuelve una respuesta de error si toca inyectar una."""
+    settings = SETTINGS[name]
+    counters[name]["requests"] += 1
+    await asyncio.sleep(max(0.0, settings["latency"] + random.uniform(-1, 1) * settings["jitter"]))
+    roll = random.random()
+    if roll < settings["rate_limit"]:
+        counters[name]["rate_limited"] += 1
+        return Response(status_code=429, content=json.dumps({"error": {"message": "rate limited", "code": 429}}),
+                        media_type="application/json", headers={"Retry-After": "1"})
+    if roll < settings["rate_limit"] + settings["error_rate"]:
+        counters[name]["errors"] += 1
+        return Response(status_code=500, content=json.dumps({"error": {"message": "stub error", "code": 500}}),
+                        media_type="application/json")
+    return None
+
+def _pieces(text: str, count: int) -> list:
+    size = max(1, -(-len(text) // max(1, count)))
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+async def _openai_completion(name: str, request: Request):
+    body = await request.json()
+    error = await _simulate(name)
+    if error is not None:
+        return error
+    user = next((m["content"] for m in reversed(body["messages"]) if m["role"] == "user"), "")
+    content = answer(user)
+    created = int(time.time())
+    if not body.get("stream"):
+        return {
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": created, "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(user) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(user) + len(content)) // 4},
+        }
+
+    async def events():
+        for piece in _pieces(content, SETTINGS[name]["chunks"]):
+            chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created,
+                     "model": body["model"],
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(0)
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.post("/openrouter/v1/chat/completions")
+async def openrouter_completions(request: Request):
+    return await _openai_completion("openrouter", request)
+
+@app.post("/groq/openai/v1/chat/completions")
+async def groq_completions(request: Request):
+    return await _openai_completion("groq", request)
+
+def _gemini_response(text: str) -> dict:
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}]}
+
+@app.post("/gemini/{version}/models/{model}:generateContent")
+async def gemini_generate(version: str, model: str, request: Request):
+    body = await request.json()
+    error = await _simulate("gemini")
+    if error is not None:
+        return error
+    parts = body["contents"][0]["parts"]
+    text = next((p["text"] for p in parts if "text" in p), "")
+    return _gemini_response(answer(text))
+
+@app.post("/gemini/{version}/models/{model}:streamGenerateContent")
+async def gemini_stream(version: str, model: str, request: Request):
+    body = await request.json()
+    error = await _simulate("gemini")
+    if error is not None:
+        return error
+    parts = body["contents"][0]["parts"]
+    content = answer(next((p["text"] for p in parts if "text" in p), ""))
+
+    async def events():
+        for piece in _pieces(content, SETTINGS["gemini"]["chunks"]):
+            yield f"data: {json.dumps(_gemini_response(piece))}\n\n"
+            await asyncio.sleep(0)
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("FAKE_LLM_PORT", 54322)))
@@ -0,0 +1,157 @@
+"""
+Servidor PostgREST falso, en memoria, para probar sin Supabase.
+
+Implementa lo que usa `postgrest_async`: select con filtros (eq, neq, gt,
+gte, lt, lte y árboles or/and), order, limit/offset, count exacto, inserts
+simples y masivos (con on_conflict + ignore-duplicates) y funciones RPC registradas en `RPCS`.
+
+Uso:
+    python fake_postgrest.py            # escucha en http://127.0.0.1:54321
+    postgrest_async.configure(base_url="http://test", transport=httpx.ASGITransport(app=fake_postgrest.app))
+"""
+import os
+import json
+import itertools
+from datetime import datetime, timezone
+from fastapi import FastAPI, Request, Response
+
+app = FastAPI()
+
+tables = {"expenses": [], "tasks": [], "notes": []}
+_ids = itertools.count(1)
+RPCS = {}  # nombre -> función(params: dict, tables: dict)
+
+def reset():
+    for rows in tables.values():
+        rows.clear()
+
+def _coerce(value: str, sample):
+    if isinstance(sample, bool):
+        return value == "true"
+    if isinstance(sample, int):
+        return int(value)
+    if isinstance(sample, float):
+        return float(value)
+    return value
+
+OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+}
+
+def _split_top(inner: str) -> list:
+    """Parte "a.eq.1,and(b.gt.2,c.lt.3)" por las comas de nivel 0 (respetando comillas)."""
+    parts, depth, quoted, current = [], 0, False, ""
+    for char in inner:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and char == "," and depth == 0:
+            parts.append(current)
+            current = ""
+            continue
+        current += char
+    return parts + [current] if current else parts
+
+def _matches_tree(row: dict, kind: str, tree: str) -> bool:
+    """Árboles lógicos de PostgREST: or=(a.eq.1,and(b.gt.2,c.lt.3))."""
+    results = []
+    for condition in _split_top(tree.strip()[1:-1]):
+        if condition.startswith(("or(", "and(")):
+            sub_kind, _, sub_tree = condition.partition("(")
+            results.append(_matches_tree(row, sub_kind, "(" + sub_tree))
+        else:
+            column, _, expression = condition.partition(".")
+            results.append(_matches(row, column, expression))
+    return any(results) if kind == "or" else all(results)
+
+def _matches(row: dict, column: str, expression: str) -> bool:
+    if column in ("or", "and"):
+        return _matches_tree(row, column, expression)
+    op, _, raw = expression.partition(".")
+    if raw.startswith('"') and raw.endswith('"'):
+        raw = raw[1:-1].replace('\\"', '"')
+    if op == "is":
+        return row.get(column) is None if raw == "null" else row.get(column) is not None
+    if op not in OPERATORS:
+        return True
+    value = row.get(column)
+    return OPERATORS[op](value, _coerce(raw, value) if value is not None else raw)
+
+def _query(table: str, params) -> list:
+    rows = tables.setdefault(table, [])
+    reserved = {"select", "order", "limit", "offset", "on_conflict"}
+    for column, expression in params.multi_items():
+        if column not in reserved:
+            rows = [r for r in rows if _matches(r, column, expression)]
+    for part in reversed((params.get("order") or "").split(",")):
+        if part:
+            column, _, direction = part.partition(".")
+            rows = sorted(rows, key=lambda r: (r.get(column) is None, r.get(column)),
+                          reverse=direction.startswith("desc"))
+    return rows
+
+def _project(rows: list, select: str) -> list:
+    if not select or select == "*":
+        return rows
+    columns = [c.strip() for c in select.split(",")]
+    return [{c: r.get(c) for c in columns} for r in rows]
+
+@app.get("/rest/v1/{table}")
+async def select_rows(table: str, request: Request):
+    params = request.query_params
+    rows = _query(table, params)
+    total = len(rows)
+    offset = int(params.get("offset") or 0)
+    limit = params.get("limit")
+    range_header = request.headers.get("range")
+    if range_header:
+        start, _, end = range_header.partition("-")
+        offset, limit = int(start), int(end) - int(start) + 1
+    rows = rows[offset:offset + int(limit)] if limit is not None else rows[offset:]
+    headers = {}
+    if "count=exact" in request.headers.get("prefer", ""):
+        headers["Content-Range"] = f"{offset}-{offset + len(rows) - 1 if rows else offset}/{total}"
+    return Response(content=json.dumps(_project(rows, params.get("select"))),
+                    media_type="application/json", headers=headers)
+
+@app.post("/rest/v1/rpc/{function}")
+async def call_rpc(function: str, request: Request):
+    if function not in RPCS:
+        return Response(status_code=404, content=json.dumps({"message": f"function {function} not found"}),
+                        media_type="application/json")
+    body = await request.body()
+    return RPCS[function](json.loads(body or b"{}"), tables)
+
+@app.post("/rest/v1/{table}")
+async def insert_rows(table: str, request: Request):
+    payload = json.loads(await request.body())
+    rows = payload if isinstance(payload, list) else [payload]
+    target = tables.setdefault(table, [])
+    prefer = request.headers.get("prefer", "")
+    on_conflict = request.query_params.get("on_conflict")
+    inserted = []
+    for row in rows:
+        if on_conflict and row.get(on_conflict) is not None:
+            if any(r.get(on_conflict) == row[on_conflict] for r in target):
+                if "ignore-duplicates" in prefer:
+                    continue
+                return Response(status_code=409, content=json.dumps({"message": "duplicate key"}),
+                                media_type="application/json")
+        stored = {"id": next(_ids), "created_at": datetime.now(timezone.utc).isoformat(), **row}
+        target.append(stored)
+        inserted.append(stored)
+    if "return=representation" in prefer:
+        return Response(status_code=201, content=json.dumps(inserted), media_type="application/json")
+    return Response(status_code=201)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("FAKE_POSTGREST_PORT", 54321)))
@@ -0,0 +1,253 @@
+"""
+Clasificador local y determinista para los mensajes obvios (gastos, tareas y notas).
+
+Se ejecuta delante de la cadena de LLMs en `ai.analyze_message`: si la confianza
+supera FAST_PATH_THRESHOLD devolvemos el mismo JSON {category, data, response}
+que devolvería el modelo, sin salir del proceso.
+"""
+import os
+import re
+import unicodedata
+from datetime import date, timedelta
+
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+FAST_PATH_THRESHOLD = float(os.getenv("FAST_PATH_THRESHOLD", "0.85"))
+DEFAULT_CURRENCY = "USD"
+
+def normalize(text: str) -> str:
+    """Minúsculas y sin tildes, para que las reglas no dependan de la ortografía."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c)).strip()
+
+# --- Gramática de montos ---
+# "500", "1.500", "1.500,50", "1,500.50", "12,5", "$500", "2 mil", "5k"
+AMOUNT_RE = re.compile(
+    r"(?<![\w.,])(?:\$|usd\s*|us\$\s*|u\$s\s*|€\s*)?"
+    r"(\d{1,3}(?:[.,]\d{3})+(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?)"
+    r"(\s*(?:mil\b|k\b|lucas?\b))?"
+)
+
+def parse_number(raw: str) -> float:
+    """Convierte montos con separadores españoles o ingleses a float."""
+    if "," in raw and "." in raw:
+        # El último separador es el decimal: "1.500,50" o "1,500.50"
+        if raw.rfind(",") > raw.rfind("."):
+            raw = raw.replace(".", "").replace(",", ".")
+        else:
+            raw = raw.replace(",", "")
+    elif "," in raw:
+        head, _, tail = raw.rpartition(",")
+        raw = raw.replace(",", "") if len(tail) == 3 else head.replace(",", "") + "." + tail
+    elif "." in raw:
+        head, _, tail = raw.rpartition(".")
+        if len(tail) == 3:
+            raw = raw.replace(".", "")
+    return float(raw)
+
+def parse_amount(norm: str):
+    """Devuelve (monto, match) del primer monto en el texto normalizado, o (None, None)."""
+    for match in AMOUNT_RE.finditer(norm):
+        # Un número pegado a "/" o ":" es una fecha u hora, no un monto
+        end = match.end(1)
+        if end < len(norm) and norm[end] in "/:":
+            continue
+        amount = parse_number(match.group(1))
+        if match.group(2):
+            amount *= 1000
+        return amount, match
+    return None, None
+
+# --- Gramática de monedas ---
+CURRENCIES = [
+    (re.compile(r"\b(?:dolares?|usd|us\$|u\$s|verdes?)\b|us\$|u\$s"), "USD"),
+    (re.compile(r"\b(?:euros?|eur)\b|€"), "EUR"),
+    (re.compile(r"\b(?:pesos?|ars|lucas?|mangos?)\b"), "ARS"),
+]
+
+def parse_currency(norm: str) -> str:
+    for pattern, code in CURRENCIES:
+        if pattern.search(norm):
+            return code
+    return DEFAULT_CURRENCY
+
+# --- Gramática de fechas ---
+WEEKDAYS = {"lunes": 0, "martes": 1, "miercoles": 2, "jueves": 3, "viernes": 4, "sabado": 5, "domingo": 6}
+MONTHS = {"enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7,
+          "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12}
+DATE_NUMERIC_RE = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b")
+DATE_WORDS_RE = re.compile(r"\b(\d{1,2}) de (" + "|".join(MONTHS) + r")\b")
+WEEKDAY_RE = re.compile(r"\b(?:el |este |el proximo |proximo )?(" + "|".join(WEEKDAYS) + r")\b")
+
+def _safe_date(year: int, month: int, day: int):
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+def parse_date(norm: str, today: date = None):
+    """Devuelve (fecha ISO, texto reconocido) para hoy/mañana/días de semana/dd-mm, o (None, None)."""
+    today = today or date.today()
+    if re.search(r"\bpasado manana\b", norm):
+        return (today + timedelta(days=2)).isoformat(), "pasado manana"
+    if re.search(r"\bmanana\b", norm):
+        return (today + timedelta(days=1)).isoformat(), "manana"
+    if re.search(r"\bhoy\b", norm):
+        return today.isoformat(), "hoy"
+    match = DATE_NUMERIC_RE.search(norm)
+    if match:
+        day, month = int(match.group(1)), int(match.group(2))
+        year = int(match.group(3)) if match.group(3) else today.year
+        if year < 100:
+            year += 2000
+        parsed = _safe_date(year, month, day)
+        if parsed and not match.group(3) and parsed < today:
+            parsed = _safe_date(year + 1, month, day)
+        if parsed:
+            return parsed.isoformat(), match.group(0)
+    match = DATE_WORDS_RE.search(norm)
+    if match:
+        day, month = int(match.group(1)), MONTHS[match.group(2)]
+        parsed = _safe_date(today.year, month, day)
+        if parsed and parsed < today:
+            parsed = _safe_date(today.year + 1, month, day)
+        if parsed:
+            return parsed.isoformat(), match.group(0)
+    match = WEEKDAY_RE.search(norm)
+    if match:
+        delta = (WEEKDAYS[match.group(1)] - today.weekday()) % 7 or 7
+        return (today + timedelta(days=delta)).isoformat(), match.group(0)
+    return None, None
+
+# --- Reglas por palabras clave ---
+EXPENSE_VERBS_RE = re.compile(
+    r"^(?:hoy |ayer )?(?:gaste|pague|compre|me gaste|me costo|me salio|cargue|invite|abone|gasto|gastos|pago de|compra de)\b")
+TASK_START_RE = re.compile(
+    r"^(?:tengo que|hay que|debo|necesito|recordar(?:me)?|recuerdame|acordarme de|no olvidar|no olvides|"
+    r"comprar|llamar|pagar|hacer|enviar|mandar|escribir|revisar|buscar|sacar|reservar|agendar|"
+    r"limpiar|preparar|terminar|ir a|llevar|renovar|turno|tarea)\b")
+NOTE_PREFIX_RE = re.compile(r"^(?:nota|anotar|anota|apunte|idea|pensamiento|recordatorio mental)\s*[:,-]?\s*(?:que\s+)?")
+GREETING_RE = re.compile(r"^(?:hola|buenas|buen dia|buenos dias|buenas tardes|buenas noches|gracias|ok|dale|chau)[\s!.]*$")
+QUESTION_RE = re.compile(r"[?¿]")
+CONNECTOR_RE = re.compile(r"^(?:en|de|por|para|a|el|la|los|las|un|una)\s+")
+FILLER_RE = re.compile(r"\b(?:pesos?|dolares?|euros?|usd|ars|eur|lucas?|mangos?|verdes?|mil|k)\b|[$€]")
+
+def _clean_description(text: str) -> str:
+    text = FILLER_RE.sub(" ", text)
+    text = re.sub(r"\s+", " ", text).strip(" .,;:-")
+    # Quitar conectores iniciales repetidos: "en la pizzeria" -> "pizzeria"
+    previous = None
+    while previous != text:
+        previous = text
+        text = CONNECTOR_RE.sub("", text)
+    return text
+
+def _original_slice(original: str, norm: str, start: int, end: int) -> str:
+    """Recorta el texto original con índices del normalizado (sin tildes tiene el mismo largo salvo ñ compuestas)."""
+    if len(original) == len(norm):
+        return original[start:end]
+    return norm[start:end]
+
+def _classify_expense(text: str, norm: str, today: date):
+    amount, match = parse_amount(norm)
+    if amount is None or amount <= 0:
+        return None, 0.0
+    verb = EXPENSE_VERBS_RE.search(norm)
+    currency = parse_currency(norm)
+
+    # Descripción: lo que no es verbo ni monto, priorizando lo que viene después de "en"/"de"
+    rest = norm[:match.start()] + " " + norm[match.end():]
+    if verb:
+        rest = rest.replace(verb.group(0), " ", 1)
+    _, date_text = parse_date(rest, today)
+    if date_text:
+        rest = rest.replace(date_text, " ", 1)
+    rest = re.sub(r"\b(?:ayer|hoy)\b", " ", rest)
+    # Otro número además del monto ("2 entradas por 40", "3 cuotas de 1500", "500 en pizza y 200 en
+    # cerveza"): no sabemos cuál es el monto ni si es un solo gasto, que decida el LLM
+    ambiguous = bool(re.search(r"\d", rest))
+    after = re.search(r"\b(?:en|de|por|para)\s+(.+)$", rest)
+    description = _clean_description(after.group(1)) if after else ""
+    if not description:
+        # "compré café por 3,5 euros": el complemento era sólo la moneda
+        description = _clean_description(re.sub(r"\b(?:en|de|por|para)\b", " ", rest))
+    if not description:
+        return None, 0.0
+    start = norm.find(description)
+    if start >= 0:
+        description = _original_slice(text, norm, start, start + len(description))
+
+    confidence = 0.95 if verb else 0.6
+    # Si además parece una tarea ("pagar 500 de luz mañana") es ambiguo
+    if TASK_START_RE.search(norm):
+        confidence = min(confidence, 0.5)
+    if ambiguous:
+        confidence = min(confidence, 0.5)
+    symbol = {"USD": "$", "EUR": "€", "ARS": "$"}.get(currency, "")
+    result = {
+        "category": "EXPENSE",
+        "data": {"amount": amount, "description": description, "currency": currency},
+        "response": f"¡Listo! Registré un gasto de {symbol}{amount:,.2f} {currency} en {description}.",
+    }
+    return result, confidence
+
+def _classify_task(text: str, norm: str, today: date):
+    start = TASK_START_RE.search(norm)
+    if not start:
+        return None, 0.0
+    deadline, _ = parse_date(norm, today)
+    description = text.strip(" .!")
+    # Sacamos las muletillas del principio: "tengo que llamar a mamá" -> "llamar a mamá"
+    prefix = re.match(r"^(?:tengo que|hay que|debo|necesito|recordar(?:me)?|recuerdame|acordarme de|no olvidar|no olvides)\s+(?:de\s+|que\s+)?", norm)
+    if prefix:
+        description = _original_slice(text, norm, prefix.end(), len(norm)).strip(" .!") or description
+    if description:
+        description = description[0].upper() + description[1:]
+    data = {"description": description}
+    if deadline:
+        data["when"] = deadline
+    when = f" para el {deadline}" if deadline else ""
+    return {
+        "category": "TASK",
+        "data": data,
+        "response": f"¡Anotado! Agregué la tarea \"{description}\"{when}.",
+    }, 0.9
+
+def _classify_note(text: str, norm: str, today: date):
+    prefix = NOTE_PREFIX_RE.match(norm)
+    if not prefix:
+        return None, 0.0
+    content = _original_slice(text, norm, prefix.end(), len(norm)).strip()
+    if not content:
+        return None, 0.0
+    return {
+        "category": "NOTE",
+        "data": {"content": content},
+        "response": "¡Guardado! Agregué tu nota.",
+    }, 0.95
+
+def classify(text: str, today: date = None):
+    """
+    Clasifica `text` localmente. Devuelve un dict {category, data, response, confidence};
+    confidence 0 significa que no hay una regla aplicable y hay que preguntarle al LLM.
+    """
+    empty = {"category": "OTHER", "data": {}, "response": "", "confidence": 0.0}
+    if not text or not text.strip():
+        return empty
+    text = text.strip()
+    norm = normalize(text)
+
+    if QUESTION_RE.search(text) or len(norm) > 200:
+        return empty
+    if GREETING_RE.match(norm):
+        return {"category": "OTHER", "data": {},
+                "response": "¡Hola! Puedo ayudarte a registrar gastos, tareas o notas.", "confidence": 0.9}
+
+    best, best_confidence = None, 0.0
+    for rule in (_classify_note, _classify_expense, _classify_task):
+        result, confidence = rule(text, norm, today or date.today())
+        if result and confidence > best_confidence:
+            best, best_confidence = result, confidence
+    if best is None:
+        return empty
+    best["confidence"] = best_confidence
+    return best
@@ -1,58 +1,62 @@
 import os
-import json
+import sys
+import time
+import random
 import asyncio
-from database import supabase
+import argparse
+import aggregates
+import database
+from coordination import coordinator
 from datetime import datetime
-
-async def fetch_supabase_data_async():
-    """Fetch necessary data from Supabase asynchronously."""
+from dashboard_state import (
+    state as dashboard_state, user_states, DashboardState, DASHBOARD_CATEGORY_LIMIT, DASHBOARD_DAILY_WINDOW,
+    DASHBOARD_RECENT_EXPENSES, DASHBOARD_RECENT_TASKS, DASHBOARD_RECENT_NOTES,
+)
+import live_updates
+import metrics
+import page_cache
+from templating import Template
+
+# El render completo tiene que quedar en el orden del milisegundo aunque crezca el historial
+RENDER_SECONDS = metrics.Histogram("dashboard_template_render_seconds", "Tiempo de generate_html (sin I/O)",
+                                   buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+
+async def reconcile_state_async(user_id: int = None, target: DashboardState = None):
+    """Full reload of the in-memory aggregates (startup and periodic reconciliation).
+
+    With a user_id the queries are filtered to that user; `target` is the state to load
+    (the global dashboard state by default).
+
+    Supabase only has what the WAL already replayed: rows still in the WAL and rows
+    recorded while the queries were in flight are applied again on top of the result.
+    """
+    state = target or dashboard_state
     try:
-        # Using asyncio.to_thread because the current supabase-py client is synchronous
-        expenses_task = asyncio.to_thread(
-            lambda: supabase.table("expenses").select("*").order("created_at", desc=True).limit(200).execute().data
-        )
-        tasks_task = asyncio.to_thread(
-            lambda: supabase.table("tasks").select("*").order("created_at", desc=True).execute().data
-        )
-        notes_task = asyncio.to_thread(
-            lambda: supabase.table("notes").select("*").order("created_at", desc=True).limit(50).execute().data
-        )
-        
-        expenses, tasks, notes = await asyncio.gather(expenses_task, tasks_task, notes_task)
-        return expenses, tasks, notes
+        print("Fetching dashboard aggregates from Supabase (Async)...")
+        # With replay paused no WAL entry can move to Supabase between the queries and the
+        # read of the pending rows, so each row is counted exactly once
+        async with database.replay_paused():
+            since = state.version
+            aggr, recent = await asyncio.gather(
+                aggregates.dashboard_aggregates(user_id, top_n=DASHBOARD_CATEGORY_LIMIT, days=DASHBOARD_DAILY_WINDOW),
+                aggregates.recent_items(user_id, DASHBOARD_RECENT_EXPENSES, DASHBOARD_RECENT_TASKS, DASHBOARD_RECENT_NOTES),
+            )
+            unsaved = await database.unsaved_rows(user_id)
     except Exception as e:
-        print(f"Error fetching data: {e}")
-        return [], [], []
-
-def generate_html(expenses, tasks, notes):
-    """Generate the premium HTML content with Chart.js and refined aesthetics."""
-    
-    total_expenses = sum(float(e.get('amount', 0)) for e in expenses)
-    pending_tasks = len([t for t in tasks if t.get('status') == 'pending'])
-    total_notes = len(notes)
-    
-    # Process Category Data for Pie Chart
-    cat_data = {}
-    for e in expenses:
-        desc = e.get('description', 'Otros')
-        cat_data[desc] = cat_data.get(desc, 0) + float(e.get('amount', 0))
-    
-    # Limit to top 5 categories
-    sorted_cats = sorted(cat_data.items(), key=lambda x: x[1], reverse=True)[:5]
-    cat_labels = [c[0] for c in sorted_cats]
-    cat_values = [c[1] for c in sorted_cats]
-
-    # Process Daily Data for Line Chart
-    daily_data = {}
-    for e in expenses:
-        date_str = e.get('created_at', '')[:10]
-        if date_str:
-            daily_data[date_str] = daily_data.get(date_str, 0) + float(e.get('amount', 0))
-    
-    sorted_dates = sorted(daily_data.keys())[-7:] # Last 7 days
-    daily_values = [daily_data[d] for d in sorted_dates]
-
-    template = f"""
+        # Keep serving the previous aggregates; we will retry on the next regeneration
+        print(f"Error fetching data, keeping previous dashboard state: {e}")
+        return False
+    print(f"Found {aggr['expense_count']} expenses, {aggr['pending_tasks']} pending tasks, and {aggr['total_notes']} notes.")
+    # Writes recorded after the fetch started; the ones that are also in the WAL were already read above
+    in_wal = {row[database.WAL_KEY] for _, row in unsaved}
+    unsaved += [(table, row) for table, row in state.writes_since(since) if row.get(database.WAL_KEY) not in in_wal]
+    state.load_aggregates(aggr, *recent, unsaved=unsaved)
+    return True
+
+# Plantillas compiladas una sola vez al importar: el <head>, el CSS, el chat y el JS de los
+# gráficos son fragmentos estáticos ya minificados; en cada render sólo se intercalan
+# las tarjetas, los datos de los gráficos y los listados recientes.
+PAGE = Template("""
 <!DOCTYPE html>
 <html lang="es" class="dark">
 <head>
@@ -64,49 +68,49 @@ def generate_html(expenses, tasks, notes):
     <script src="https://unpkg.com/lucide@latest"></script>
     <style>
         @import url('https://fonts.googleapis.com/css2?family=Plus+Jakarta+Sans:wght@300;400;500;600;700;800&display=swap');
-        body {{ 
+        body { 
             font-family: 'Plus Jakarta Sans', sans-serif; 
             background: radial-gradient(circle at top right, #1e293b, #0f172a, #020617);
             overflow-x: hidden;
-        }}
-        .glass {{ 
+        }
+        .glass { 
             background: rgba(15, 23, 42, 0.6); 
             backdrop-filter: blur(16px); 
             border: 1px solid rgba(255, 255, 255, 0.08); 
             box-shadow: 0 8px 32px 0 rgba(0, 0, 0, 0.37);
-        }}
-        .card-hover:hover {{
+        }
+        .card-hover:hover {
             transform: translateY(-4px);
             border-color: rgba(255, 255, 255, 0.2);
             transition: all 0.3s cubic-bezier(0.4, 0, 0.2, 1);
-        }}
-        .text-gradient {{
+        }
+        .text-gradient {
             background: linear-gradient(to right, #60a5fa, #a855f7);
             -webkit-background-clip: text;
             -webkit-text-fill-color: transparent;
-        }}
-        ::-webkit-scrollbar {{ width: 6px; }}
-        ::-webkit-scrollbar-track {{ background: transparent; }}
-        ::-webkit-scrollbar-thumb {{ background: #334155; border-radius: 10px; }}
+        }
+        ::-webkit-scrollbar { width: 6px; }
+        ::-webkit-scrollbar-track { background: transparent; }
+        ::-webkit-scrollbar-thumb { background: #334155; border-radius: 10px; }
 
-        #chat-window {{
+        #chat-window {
             transform: translateX(100%);
             transition: transform 0.3s cubic-bezier(0.4, 0, 0.2, 1);
-        }}
-        #chat-window.open {{
+        }
+        #chat-window.open {
             transform: translateX(0);
-        }}
-        .spinner {{
+        }
+        .spinner {
             border: 2px solid rgba(255, 255, 255, 0.1);
             border-left-color: #a855f7;
             border-radius: 50%;
             width: 16px;
             height: 16px;
             animation: spin 1s linear infinite;
-        }}
-        @keyframes spin {{
-            to {{ transform: rotate(360deg); }}
-        }}
+        }
+        @keyframes spin {
+            to { transform: rotate(360deg); }
+        }
     </style>
 </head>
 <body class="text-slate-200 min-h-screen Selection:bg-purple-500/30">
@@ -117,7 +121,7 @@ def generate_html(expenses, tasks, notes):
                 <h1 class="text-4xl font-extrabold tracking-tight text-gradient">AI Life OS</h1>
                 <p class="text-slate-400 mt-2 flex items-center gap-2">
                     <i data-lucide="calendar" class="w-4 h-4"></i>
-                    Actualizado hoy a las {datetime.now().strftime('%H:%M')}
+                    Actualizado hoy a las <span id="updated-at">{{ updated_at }}</span>
                 </p>
             </div>
             <div class="flex gap-4">
@@ -128,41 +132,7 @@ def generate_html(expenses, tasks, notes):
             </div>
         </header>
 
-        <!-- Stats Grid -->
-        <div class="grid grid-cols-1 md:grid-cols-3 gap-6">
-            <div class="glass p-6 rounded-3xl card-hover relative overflow-hidden group">
-                <div class="absolute -right-4 -top-4 w-24 h-24 bg-blue-500/10 rounded-full blur-2xl group-hover:bg-blue-500/20 transition-all"></div>
-                <div class="flex items-center gap-4 mb-4">
-                    <div class="p-3 bg-blue-500/10 rounded-2xl text-blue-400">
-                        <i data-lucide="wallet"></i>
-                    </div>
-                    <p class="text-sm font-semibold text-slate-400 uppercase tracking-wider">Total Gastado</p>
-                </div>
-                <h3 class="text-3xl font-bold">${total_expenses:,.2f}</h3>
-            </div>
-
-            <div class="glass p-6 rounded-3xl card-hover relative overflow-hidden group">
-                <div class="absolute -right-4 -top-4 w-24 h-24 bg-purple-500/10 rounded-full blur-2xl group-hover:bg-purple-500/20 transition-all"></div>
-                <div class="flex items-center gap-4 mb-4">
-                    <div class="p-3 bg-purple-500/10 rounded-2xl text-purple-400">
-                        <i data-lucide="check-circle-2"></i>
-                    </div>
-                    <p class="text-sm font-semibold text-slate-400 uppercase tracking-wider">Tareas Pendientes</p>
-                </div>
-                <h3 class="text-3xl font-bold">{pending_tasks}</h3>
-            </div>
-
-            <div class="glass p-6 rounded-3xl card-hover relative overflow-hidden group">
-                <div class="absolute -right-4 -top-4 w-24 h-24 bg-indigo-500/10 rounded-full blur-2xl group-hover:bg-indigo-500/20 transition-all"></div>
-                <div class="flex items-center gap-4 mb-4">
-                    <div class="p-3 bg-indigo-500/10 rounded-2xl text-indigo-400">
-                        <i data-lucide="sticky-note"></i>
-                    </div>
-                    <p class="text-sm font-semibold text-slate-400 uppercase tracking-wider">Notas Guardadas</p>
-                </div>
-                <h3 class="text-3xl font-bold">{total_notes}</h3>
-            </div>
-        </div>
+        {{ stats|safe }}
 
         <!-- Charts Row -->
         <div class="grid grid-cols-1 lg:grid-cols-2 gap-6">
@@ -205,13 +175,8 @@ def generate_html(expenses, tasks, notes):
                                 <th class="pb-4 font-semibold text-right">Monto</th>
                             </tr>
                         </thead>
-                        <tbody class="divide-y divide-slate-800/50">
-                            {''.join([f'''
-                            <tr class="group hover:bg-slate-800/30 transition-colors">
-                                <td class="py-4 text-sm text-slate-400">{e.get("created_at")[:10] if e.get("created_at") else "N/A"}</td>
-                                <td class="py-4 font-medium">{e.get("description")}</td>
-                                <td class="py-4 text-right font-bold text-blue-400">${float(e.get("amount", 0)):,.2f}</td>
-                            </tr>''' for e in expenses[:10]])}
+                        <tbody id="recent-expenses" class="divide-y divide-slate-800/50">
+                            {{ expense_rows|safe }}
                         </tbody>
                     </table>
                 </div>
@@ -223,12 +188,8 @@ def generate_html(expenses, tasks, notes):
                     <i data-lucide="clock" class="text-orange-400"></i>
                     Tareas Pendientes
                 </h4>
-                <div class="space-y-4">
-                    {''.join([f'''
-                    <div class="flex items-center gap-4 p-4 rounded-2xl bg-slate-800/30 border border-slate-700/30">
-                        <div class="w-2 h-2 rounded-full bg-orange-400 shadow-[0_0_8px_rgba(251,146,60,0.5)]"></div>
-                        <p class="text-sm font-medium flex-grow truncate">{t.get("description")}</p>
-                    </div>''' for t in [t for t in tasks if t.get('status') == 'pending'][:5]]) or '<p class="text-slate-500 text-center py-8">No hay tareas pendientes</p>'}
+                <div id="pending-tasks" class="space-y-4">
+                    {{ pending_task_items|safe }}
                 </div>
             </div>
         </div>
@@ -298,15 +259,15 @@ def generate_html(expenses, tasks, notes):
         let currentFile = null;
         let currentFileType = null;
 
-        function toggleChat() {{
+        function toggleChat() {
             const win = document.getElementById('chat-window');
             win.classList.toggle('open');
-            if (win.classList.contains('open')) {{
+            if (win.classList.contains('open')) {
                 document.getElementById('chat-input').focus();
-            }}
-        }}
+            }
+        }
 
-        function handleFile(input, type) {{
+        function handleFile(input, type) {
             const file = input.files[0];
             if (!file) return;
 
@@ -319,17 +280,17 @@ def generate_html(expenses, tasks, notes):
             lucide.createIcons();
             
             document.getElementById('chat-input').focus();
-        }}
+        }
 
-        function clearAttachment() {{
+        function clearAttachment() {
             currentFile = null;
             currentFileType = null;
             document.getElementById('image-upload').value = '';
             document.getElementById('audio-upload').value = '';
             document.getElementById('attachment-preview').classList.add('hidden');
-        }}
+        }
 
-        async function sendMessage() {{
+        async function sendMessage() {
             const input = document.getElementById('chat-input');
             const msg = input.value.trim();
             const btn = document.getElementById('send-btn');
@@ -347,34 +308,100 @@ def generate_html(expenses, tasks, notes):
 
             const formData = new FormData();
             formData.append('message', msg || "Analiza este archivo");
-            if (currentFile) {{
+            if (DASHBOARD_DATA.user_id !== null) {
+                formData.append('user_id', DASHBOARD_DATA.user_id);
+            }
+            if (currentFile) {
                 formData.append(currentFileType, currentFile);
-            }}
+            }
 
             clearAttachment();
 
-            try {{
-                const response = await fetch('/api/chat', {{
-                    method: 'POST',
-                    body: formData
-                }});
-                
-                const data = await response.json();
-                addMessage(data.response, 'bot');
-                
-                if (data.category && data.category !== 'OTHER') {{
-                    setTimeout(() => location.reload(), 2500);
-                }}
-            }} catch (e) {{
+            try {
+                let data;
+                try {
+                    data = await streamChat(formData);
+                } catch (e) {
+                    // Sin streaming (proxy que bufferea, navegador viejo): respuesta completa
+                    const response = await fetch('/api/chat', {
+                        method: 'POST',
+                        body: formData
+                    });
+                    data = await response.json();
+                    addMessage(data.response, 'bot');
+                }
+
+                if (data.category && data.category !== 'OTHER') {
+                    refreshDashboard();
+                }
+            } catch (e) {
                 addMessage('Error: No pude conectar con el servidor.', 'bot');
-            }} finally {{
+            } finally {
                 btn.disabled = false;
                 icon.classList.remove('hidden');
                 spinner.classList.add('hidden');
-            }}
-        }}
-
-        function addMessage(text, side) {{
+            }
+        }
+
+        async function streamChat(formData) {
+            const response = await fetch('/api/chat/stream', {
+                method: 'POST',
+                body: formData
+            });
+            if (response.status === 413 || response.status === 415) {
+                // Adjunto rechazado (muy grande o formato desconocido): no tiene sentido reintentar
+                const data = await response.json();
+                addMessage(data.response, 'bot');
+                return data;
+            }
+            if (!response.ok || !response.body) throw new Error('stream no disponible');
+
+            const bubble = addMessage('…', 'bot');
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let text = '';
+            let result = { response: '', category: 'OTHER' };
+
+            while (true) {
+                let chunk;
+                try {
+                    chunk = await reader.read();
+                } catch (e) {
+                    // Cortado a mitad: el mensaje ya pudo haberse guardado, no se reenvía
+                    bubble.textContent = text || 'Error: se cortó la conexión con el servidor.';
+                    return result;
+                }
+                const { value, done } = chunk;
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                    const raw = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    let event = 'message', payload = '';
+                    for (const line of raw.split('\\n')) {
+                        if (line.startsWith('event: ')) event = line.slice(7);
+                        else if (line.startsWith('data: ')) payload += line.slice(6);
+                    }
+                    const data = payload ? JSON.parse(payload) : {};
+                    if (event === 'delta') {
+                        text += data.delta;
+                        bubble.textContent = text;
+                    } else if (event === 'category') {
+                        result.category = data.category;
+                    } else if (event === 'done' || event === 'error') {
+                        result = { response: data.response, category: event === 'done' ? data.category : 'OTHER' };
+                        bubble.textContent = data.response;
+                    }
+                    const container = document.getElementById('chat-messages');
+                    container.scrollTop = container.scrollHeight;
+                }
+            }
+            return result;
+        }
+
+        function addMessage(text, side) {
             const container = document.getElementById('chat-messages');
             const div = document.createElement('div');
             div.className = side === 'user' 
@@ -383,81 +410,401 @@ def generate_html(expenses, tasks, notes):
             div.textContent = text;
             container.appendChild(div);
             container.scrollTop = container.scrollHeight;
-        }}
+            return div;
+        }
+
+        const DASHBOARD_DATA = {{ dashboard_data|json }};
 
         Chart.defaults.color = '#94a3b8';
         Chart.defaults.font.family = 'Plus Jakarta Sans';
 
         const catCtx = document.getElementById('categoryChart').getContext('2d');
-        new Chart(catCtx, {{
+        const categoryChart = new Chart(catCtx, {
             type: 'doughnut',
-            data: {{
-                labels: {json.dumps(cat_labels)},
-                datasets: [{{
-                    data: {json.dumps(cat_values)},
+            data: {
+                labels: DASHBOARD_DATA.categories.labels,
+                datasets: [{
+                    data: DASHBOARD_DATA.categories.values,
                     backgroundColor: ['#3b82f6', '#a855f7', '#6366f1', '#10b981', '#f59e0b'],
                     borderWidth: 0,
                     spacing: 8
-                }}]
-            }},
-            options: {{
+                }]
+            },
+            options: {
                 maintainAspectRatio: false,
-                plugins: {{
-                    legend: {{ position: 'bottom', labels: {{ padding: 20, usePointStyle: true }} }}
-                }},
+                plugins: {
+                    legend: { position: 'bottom', labels: { padding: 20, usePointStyle: true } }
+                },
                 cutout: '70%'
-            }}
-        }});
+            }
+        });
 
         const trendCtx = document.getElementById('trendChart').getContext('2d');
-        new Chart(trendCtx, {{
+        const trendChart = new Chart(trendCtx, {
             type: 'line',
-            data: {{
-                labels: {json.dumps(sorted_dates)},
-                datasets: [{{
+            data: {
+                labels: DASHBOARD_DATA.daily.labels,
+                datasets: [{
                     label: 'Gastos Diarios',
-                    data: {json.dumps(daily_values)},
+                    data: DASHBOARD_DATA.daily.values,
                     borderColor: '#a855f7',
                     backgroundGradient: 'linear-gradient(180deg, rgba(168, 85, 247, 0.2) 0%, rgba(168, 85, 247, 0) 100%)',
                     fill: true,
                     tension: 0.4,
                     pointRadius: 4,
                     pointBackgroundColor: '#a855f7'
-                }}]
-            }},
-            options: {{
+                }]
+            },
+            options: {
                 maintainAspectRatio: false,
-                plugins: {{ legend: {{ display: false }} }},
-                scales: {{
-                    y: {{ grid: {{ color: 'rgba(255,255,255,0.05)' }}, border: {{ display: false }} }},
-                    x: {{ grid: {{ display: false }}, border: {{ display: false }} }}
-                }}
-            }}
-        }});
+                plugins: { legend: { display: false } },
+                scales: {
+                    y: { grid: { color: 'rgba(255,255,255,0.05)' }, border: { display: false } },
+                    x: { grid: { display: false }, border: { display: false } }
+                }
+            }
+        });
+
+        // Actualización incremental: /api/summary y /api/recent devuelven sólo lo que cambió
+        // desde el cursor que trajo la página, sin recargarla
+        let dashboardCursor = DASHBOARD_DATA.cursor;
+        // En /dashboard/{user_id} todo se pide filtrado por ese usuario
+        const userQuery = DASHBOARD_DATA.user_id !== null ? 'user_id=' + DASHBOARD_DATA.user_id : '';
+        let summaryEtag = null;
+        let refreshing = Promise.resolve();
+
+        function refreshDashboard() {
+            refreshing = refreshing.then(fetchDashboardUpdates).catch(() => {});
+            return refreshing;
+        }
+
+        async function fetchDashboardUpdates() {
+            const [summary, recent] = await Promise.all([
+                fetch('/api/summary?' + userQuery, { headers: summaryEtag ? { 'If-None-Match': summaryEtag } : {} }),
+                fetch('/api/recent?since=' + encodeURIComponent(dashboardCursor) + '&' + userQuery)
+            ]);
+            if (summary.ok) {
+                summaryEtag = summary.headers.get('ETag');
+                applySummary(await summary.json());
+            }
+            if (recent.ok) {
+                const data = await recent.json();
+                applyRecent(data);
+                dashboardCursor = data.cursor;
+            }
+            markUpdated();
+        }
+
+        function markUpdated() {
+            document.getElementById('updated-at').textContent =
+                new Date().toLocaleTimeString('es', { hour: '2-digit', minute: '2-digit', hour12: false });
+        }
+
+        // En vivo: cada escritura llega como evento `change` con el delta y el resumen.
+        // Si el cursor del evento no sigue al nuestro (reconexión, recarga del servidor) se pide todo.
+        function applyChange(change) {
+            if (change.since !== dashboardCursor) return fetchDashboardUpdates();
+            applySummary(change.summary);
+            applyRecent(change);
+            dashboardCursor = change.cursor;
+            markUpdated();
+        }
+
+        function resyncIfBehind(event) {
+            // Encadenado detrás de los `change` anteriores: compara con el cursor ya actualizado
+            const { cursor } = JSON.parse(event.data);
+            refreshing = refreshing.then(() => cursor !== dashboardCursor && fetchDashboardUpdates()).catch(() => {});
+        }
+
+        if (window.EventSource) {
+            const updates = new EventSource('/api/updates?' + userQuery);
+            updates.addEventListener('hello', resyncIfBehind);
+            updates.addEventListener('dashboard', resyncIfBehind);
+            updates.addEventListener('change', (event) => {
+                const change = JSON.parse(event.data);
+                refreshing = refreshing.then(() => applyChange(change)).catch(() => {});
+            });
+        }
+
+        function formatMoney(value) {
+            return Number(value || 0).toLocaleString('en-US', { minimumFractionDigits: 2, maximumFractionDigits: 2 });
+        }
+
+        function applySummary(summary) {
+            document.getElementById('stat-total-expenses').textContent = '$' + formatMoney(summary.total_expenses);
+            document.getElementById('stat-pending-tasks').textContent = summary.pending_tasks;
+            document.getElementById('stat-total-notes').textContent = summary.total_notes;
+            categoryChart.data.labels = summary.categories.labels;
+            categoryChart.data.datasets[0].data = summary.categories.values;
+            categoryChart.update();
+            trendChart.data.labels = summary.daily.labels;
+            trendChart.data.datasets[0].data = summary.daily.values;
+            trendChart.update();
+        }
+
+        function applyRecent(recent) {
+            patchList('recent-expenses', recent.expenses, recent.reset, 10, expenseRow);
+            const tasks = document.getElementById('pending-tasks');
+            if (recent.reset || recent.tasks.length) {
+                tasks.querySelectorAll('p.text-center').forEach(el => el.remove());
+            }
+            patchList('pending-tasks', recent.tasks, recent.reset, 5, taskItem);
+            if (!tasks.children.length) {
+                const empty = document.createElement('p');
+                empty.className = 'text-slate-500 text-center py-8';
+                empty.textContent = 'No hay tareas pendientes';
+                tasks.appendChild(empty);
+            }
+        }
+
+        function patchList(id, items, reset, limit, build) {
+            // Los ítems llegan del más nuevo al más viejo
+            const container = document.getElementById(id);
+            if (reset) container.replaceChildren();
+            for (const item of items.slice().reverse()) {
+                container.prepend(build(item));
+            }
+            while (container.children.length > limit) {
+                container.lastElementChild.remove();
+            }
+        }
+
+        function cell(tag, className, text) {
+            const el = document.createElement(tag);
+            el.className = className;
+            el.textContent = text;
+            return el;
+        }
+
+        function expenseRow(expense) {
+            const row = document.createElement('tr');
+            row.className = 'group hover:bg-slate-800/30 transition-colors';
+            row.append(
+                cell('td', 'py-4 text-sm text-slate-400', (expense.created_at || 'N/A').slice(0, 10)),
+                cell('td', 'py-4 font-medium', expense.description),
+                cell('td', 'py-4 text-right font-bold text-blue-400', '$' + formatMoney(expense.amount))
+            );
+            return row;
+        }
+
+        function taskItem(task) {
+            const item = document.createElement('div');
+            item.className = 'flex items-center gap-4 p-4 rounded-2xl bg-slate-800/30 border border-slate-700/30';
+            item.append(
+                cell('div', 'w-2 h-2 rounded-full bg-orange-400 shadow-[0_0_8px_rgba(251,146,60,0.5)]', ''),
+                cell('p', 'text-sm font-medium flex-grow truncate', task.description)
+            );
+            return item;
+        }
     </script>
 </body>
 </html>
-    """
-    return template
+""", name="dashboard")
+
+STAT_CARDS = Template("""
+        <div class="grid grid-cols-1 md:grid-cols-3 gap-6">
+            <div class="glass p-6 rounded-3xl card-hover relative overflow-hidden group">
+                <div class="absolute -right-4 -top-4 w-24 h-24 bg-blue-500/10 rounded-full blur-2xl group-hover:bg-blue-500/20 transition-all"></div>
+                <div class="flex items-center gap-4 mb-4">
+                    <div class="p-3 bg-blue-500/10 rounded-2xl text-blue-400">
+                        <i data-lucide="wallet"></i>
+                    </div>
+                    <p class="text-sm font-semibold text-slate-400 uppercase tracking-wider">Total Gastado</p>
+                </div>
+                <h3 id="stat-total-expenses" class="text-3xl font-bold">${{ total_expenses }}</h3>
+            </div>
+
+            <div class="glass p-6 rounded-3xl card-hover relative overflow-hidden group">
+                <div class="absolute -right-4 -top-4 w-24 h-24 bg-purple-500/10 rounded-full blur-2xl group-hover:bg-purple-500/20 transition-all"></div>
+                <div class="flex items-center gap-4 mb-4">
+                    <div class="p-3 bg-purple-500/10 rounded-2xl text-purple-400">
+                        <i data-lucide="check-circle-2"></i>
+                    </div>
+                    <p class="text-sm font-semibold text-slate-400 uppercase tracking-wider">Tareas Pendientes</p>
+                </div>
+                <h3 id="stat-pending-tasks" class="text-3xl font-bold">{{ pending_tasks }}</h3>
+            </div>
+
+            <div class="glass p-6 rounded-3xl card-hover relative overflow-hidden group">
+                <div class="absolute -right-4 -top-4 w-24 h-24 bg-indigo-500/10 rounded-full blur-2xl group-hover:bg-indigo-500/20 transition-all"></div>
+                <div class="flex items-center gap-4 mb-4">
+                    <div class="p-3 bg-indigo-500/10 rounded-2xl text-indigo-400">
+                        <i data-lucide="sticky-note"></i>
+                    </div>
+                    <p class="text-sm font-semibold text-slate-400 uppercase tracking-wider">Notas Guardadas</p>
+                </div>
+                <h3 id="stat-total-notes" class="text-3xl font-bold">{{ total_notes }}</h3>
+            </div>
+        </div>
+""", name="stat_cards")
+
+EXPENSE_ROW = Template("""
+                            <tr class="group hover:bg-slate-800/30 transition-colors">
+                                <td class="py-4 text-sm text-slate-400">{{ date }}</td>
+                                <td class="py-4 font-medium">{{ description }}</td>
+                                <td class="py-4 text-right font-bold text-blue-400">${{ amount }}</td>
+                            </tr>""", name="expense_row")
+
+TASK_ITEM = Template("""
+                    <div class="flex items-center gap-4 p-4 rounded-2xl bg-slate-800/30 border border-slate-700/30">
+                        <div class="w-2 h-2 rounded-full bg-orange-400 shadow-[0_0_8px_rgba(251,146,60,0.5)]"></div>
+                        <p class="text-sm font-medium flex-grow truncate">{{ description }}</p>
+                    </div>""", name="task_item")
+
+NO_TASKS = '<p class="text-slate-500 text-center py-8">No hay tareas pendientes</p>'
+
+def _money(value) -> str:
+    return f"{float(value or 0):,.2f}"
+
+def _expense_rows(expenses) -> str:
+    return "".join(EXPENSE_ROW.render(date=(e.get("created_at") or "N/A")[:10], description=e.get("description"),
+                                      amount=_money(e.get("amount", 0)))
+                   for e in expenses)
+
+def _task_items(tasks) -> str:
+    return "".join(TASK_ITEM.render(description=t.get("description")) for t in tasks) or NO_TASKS
+
+def generate_html(state: DashboardState, user_id: int = None):
+    """Generate the premium HTML content with Chart.js and refined aesthetics."""
+    start = time.perf_counter()
+    # Primero los listados: el cursor que queda en la página nunca es más nuevo que lo que muestra,
+    # así el primer /api/recent del cliente trae lo que haya entrado mientras tanto
+    snapshot = state.snapshot()
+    # Top 5 categories for the pie chart, last 7 days for the line chart (same payload as /api/summary)
+    summary = state.summary(top_n=5, days=7)
+
+    html = PAGE.render(
+        updated_at=datetime.now().strftime('%H:%M'),
+        stats=STAT_CARDS.render_cached(total_expenses=_money(summary["total_expenses"]),
+                                       pending_tasks=summary["pending_tasks"],
+                                       total_notes=summary["total_notes"]),
+        expense_rows=_expense_rows(snapshot["recent_expenses"][:10]),
+        pending_task_items=_task_items(snapshot["recent_pending_tasks"][:5]),
+        dashboard_data={"cursor": snapshot["cursor"], "user_id": user_id,
+                        "categories": summary["categories"], "daily": summary["daily"]},
+    )
+    RENDER_SECONDS.observe(time.perf_counter() - start)
+    return html
 
 async def generate_dashboard_file_async():
     """Main function to generate the dashboard HTML file asynchronously."""
     try:
-        print("Fetching data from Supabase (Async)...")
-        exp, tsk, nts = await fetch_supabase_data_async()
-        print(f"Found {len(exp)} expenses, {len(tsk)} tasks, and {len(nts)} notes.")
+        if dashboard_state.needs_reconcile() and not await reconcile_state_async():
+            # Supabase is down: keep serving the previous page (on a cold start, the dashboard.html that
+            # lifespan loaded from disk) instead of publishing and persisting one built from empty aggregates
+            print("Skipping dashboard generation: aggregates could not be reconciled")
+            return False
+        if not dashboard_state.loaded:
+            return False
+
+        if not coordinator.is_leader():
+            # With several workers only the leader renders; the rest serve its file (see _load_shared_page)
+            return True
         
-        html_content = generate_html(exp, tsk, nts)
+        html_content = generate_html(dashboard_state)
         
-        file_path = "dashboard.html"
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(html_content)
+        # Swap the in-memory page first (that is what readers see), then persist it atomically
+        previous = page_cache.current()
+        # gzip + brotli q9 take tens of ms of CPU: keep them off the event loop, like the per-user path
+        page = await asyncio.to_thread(page_cache.publish, html_content)
+        if page is not previous:
+            live_updates.broadcaster.publish("dashboard", {"generation": page.generation,
+                                                           "cursor": dashboard_state.cursor()})
+        file_path = page_cache.DASHBOARD_FILE
+        await asyncio.to_thread(page_cache.write_atomic, file_path, page.body)
+        if page is not previous:
+            await coordinator.publish("page", {"etag": page.etag})
         
-        print(f"Dashboard generated successfully: {os.path.abspath(file_path)}")
+        print(f"Dashboard generated successfully (generation {page.generation}): {os.path.abspath(file_path)}")
         return True
     except Exception as e:
         print(f"Error generating dashboard: {e}")
         return False
 
+@coordinator.subscribe("page")
+async def _load_shared_page(payload: dict):
+    """The leader wrote a new dashboard.html: serve it from disk instead of rendering our own."""
+    previous = page_cache.current()
+    page = await asyncio.to_thread(page_cache.load_from_disk, page_cache.DASHBOARD_FILE, True)
+    if page is not None and page is not previous:
+        live_updates.broadcaster.publish("dashboard", {"generation": page.generation,
+                                                       "cursor": dashboard_state.cursor()})
+
+_user_locks = {}
+
+async def user_state(user_id: int) -> DashboardState:
+    """Los agregados de un usuario, cargados (una sola vez aunque lleguen varios requests) si hace falta."""
+    state = user_states.get_or_create(user_id)
+    if state.needs_reconcile():
+        lock = _user_locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            if state.needs_reconcile():
+                await reconcile_state_async(user_id, target=state)
+        if not lock.locked():
+            _user_locks.pop(user_id, None)
+    return state
+
+async def user_dashboard_page(user_id: int) -> page_cache.RenderedPage:
+    """
+    Página de un usuario: de la caché LRU si nadie escribió desde el último render,
+    si no se renderiza sólo con sus agregados. database invalida la entrada del
+    usuario que escribe; las de los demás no se tocan.
+    """
+    page = page_cache.user_pages.get(user_id)
+    if page is not None:
+        return page
+    state = await user_state(user_id)
+    version = state.version
+    html_content = generate_html(state, user_id=user_id)
+    # La compresión es lo más caro del render: fuera del event loop
+    page = await asyncio.to_thread(page_cache.RenderedPage, html_content, version)
+    if state.loaded and state.version == version:
+        # Si entró una escritura mientras comprimíamos, esta página ya nace vieja: no se guarda
+        page_cache.user_pages.put(user_id, page)
+    return page
+
+def synthetic_state(expenses: int, categories: int, days: int = 365, seed: int = 1) -> DashboardState:
+    """Estado con un historial grande inventado, para medir el render sin Supabase."""
+    rng = random.Random(seed)
+    base = time.time()
+    def created_at(i, count):
+        return datetime.fromtimestamp(base - (count - i) / count * days * 86400).isoformat()
+    rows = [{"id": i, "description": f"Categoría <{i % categories}> & \"extra\"", "amount": round(rng.uniform(1, 500), 2),
+             "created_at": created_at(i, expenses)} for i in range(expenses)]
+    tasks = [{"id": i, "description": f"Tarea {i}", "status": "pending" if i % 3 else "done",
+              "created_at": created_at(i, expenses)} for i in range(expenses // 10)]
+    notes = [{"id": i, "content": f"Nota {i}", "created_at": created_at(i, expenses)} for i in range(expenses // 10)]
+    state = DashboardState()
+    state.load(rows[::-1], tasks[::-1], notes[::-1])
+    return state
+
+def render_benchmark(expenses: int, categories: int, iterations: int) -> dict:
+    """Render repetido como en producción: entre uno y otro entra un gasto nuevo."""
+    state = synthetic_state(expenses, categories)
+    generate_html(state)  # primera vez fuera de la medición
+    timings = []
+    for i in range(iterations):
+        state.record_expense({"description": f"Categoría <{i % categories}> & \"extra\"", "amount": 10.0,
+                              "created_at": datetime.now().isoformat()})
+        start = time.perf_counter()
+        html = generate_html(state)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    ms = lambda q: round(timings[min(len(timings) - 1, int(q * len(timings)))] * 1000, 3)
+    return {"expenses": expenses, "categories": len(state.category_totals), "iterations": iterations,
+            "html_bytes": len(html.encode("utf-8")), "p50_ms": ms(0.5), "p99_ms": ms(0.99), "max_ms": ms(1.0)}
+
 if __name__ == "__main__":
-    asyncio.run(generate_dashboard_file_async())
+    parser = argparse.ArgumentParser(description="Genera dashboard.html, o mide el render con --bench")
+    parser.add_argument("--bench", type=int, metavar="GASTOS", help="medir generate_html con este historial sintético")
+    parser.add_argument("--categories", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--max-ms", type=float, help="falla si el p99 del render (ms) lo supera")
+    args = parser.parse_args()
+    if args.bench is None:
+        asyncio.run(generate_dashboard_file_async())
+    else:
+        result = render_benchmark(args.bench, args.categories, args.iterations)
+        print(f"{result['expenses']} gastos, {result['categories']} categorías, {result['html_bytes']} bytes: "
+              f"p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, max {result['max_ms']} ms")
+        sys.exit(1 if args.max_ms is not None and result["p99_ms"] > args.max_ms else 0)
@@ -0,0 +1,139 @@
+"""
+Parser JSON incremental para las respuestas en streaming de los LLMs.
+
+Recibe el texto a medida que llega y avisa cuando un campo de primer nivel del
+objeto está completo (p. ej. "category" y "data"), sin esperar al cierre del
+objeto. También expone el contenido parcial de un campo string (el texto de
+"response" mientras se escribe). Cada carácter se procesa una sola vez.
+"""
+import json
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+class IncrementalJSONParser:
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.started = False      # ya vimos el '{' inicial (se ignoran fences ```json)
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.key = None           # clave de primer nivel cuyo valor estamos leyendo
+        self.reading_key = False
+        self.key_start = None
+        self.value_start = None
+        self.fields = {}
+
+    def feed(self, chunk: str):
+        """Agrega texto. Devuelve la lista de (clave, valor) de primer nivel que se completaron."""
+        self.text += chunk
+        completed = []
+        text = self.text
+        while self.pos < len(text) and not self.finished:
+            char = text[self.pos]
+            if not self.started:
+                if char == "{":
+                    self.started = True
+                    self.depth = 1
+                self.pos += 1
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.reading_key:
+                        self.key = json.loads(text[self.key_start:self.pos + 1])
+                        self.reading_key = False
+                    elif self.depth == 1 and self.value_start is not None:
+                        completed.append(self._finish_value(self.pos + 1))
+                self.pos += 1
+                continue
+
+            if char == '"':
+                self.in_string = True
+                if self.depth == 1 and self.key is None and self.value_start is None:
+                    self.reading_key = True
+                    self.key_start = self.pos
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 1 and self.value_start is not None:
+                    completed.append(self._finish_value(self.pos + 1))
+                elif self.depth == 0:
+                    if self.value_start is not None:
+                        completed.append(self._finish_value(self.pos))
+                    self.finished = True
+            elif char == ":" and self.depth == 1 and self.key is not None and self.value_start is None:
+                self.value_start = self.pos + 1
+            elif char == "," and self.depth == 1 and self.value_start is not None:
+                # Fin de un escalar sin comillas (número, true/false/null)
+                completed.append(self._finish_value(self.pos))
+            self.pos += 1
+        return [field for field in completed if field is not None]
+
+    def _finish_value(self, end: int):
+        raw = self.text[self.value_start:end].strip()
+        key = self.key
+        self.key = None
+        self.value_start = None
+        if not raw:
+            return None
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            return None
+        self.fields[key] = value
+        return key, value
+
+    def partial_string(self, key: str):
+        """Valor (parcial o completo) de un campo string de primer nivel, o None si todavía no empezó."""
+        if key in self.fields:
+            value = self.fields[key]
+            return value if isinstance(value, str) else None
+        if self.key != key or self.value_start is None or not self.in_string:
+            return None
+        raw = self.text[self.value_start:self.pos].lstrip()
+        if not raw.startswith('"'):
+            return None
+        return _decode_partial(raw[1:])
+
+def _decode_partial(raw: str) -> str:
+    """Decodifica un string JSON sin la comilla de cierre, ignorando un escape cortado al final."""
+    out = []
+    i = 0
+    while i < len(raw):
+        char = raw[i]
+        if char != "\\":
+            out.append(char)
+            i += 1
+            continue
+        if i + 1 >= len(raw):
+            break
+        code = raw[i + 1]
+        if code == "u":
+            if i + 6 > len(raw):
+                break
+            try:
+                code_point = int(raw[i + 2:i + 6], 16)
+            except ValueError:
+                code_point = None
+            i += 6
+            if code_point is not None and 0xD800 <= code_point <= 0xDBFF:
+                # Par sustituto (emoji): sólo lo emitimos cuando llegó la segunda mitad
+                if i + 6 > len(raw) or raw[i:i + 2] != "\\u":
+                    break
+                low = int(raw[i + 2:i + 6], 16)
+                code_point = 0x10000 + ((code_point - 0xD800) << 10) + (low - 0xDC00)
+                i += 6
+            if code_point is not None:
+                out.append(chr(code_point))
+        else:
+            out.append(_ESCAPES.get(code, code))
+            i += 2
+    return "".join(out)
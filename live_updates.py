@@ -0,0 +1,163 @@
+"""
+Avisos en vivo para los dashboards abiertos (Server-Sent Events).
+
+Cada cambio se serializa una sola vez y se encola en todas las conexiones, así
+el costo de un evento no depende de cuánto tarde cada cliente. Las colas son
+acotadas: un cliente que no las vacía a tiempo se desconecta (EventSource
+reconecta solo y se pone al día con /api/recent). Un único latido periódico
+mantiene vivas las conexiones detrás de proxies y detecta las que se cayeron.
+"""
+import os
+import json
+import asyncio
+import contextvars
+import logging
+
+import metrics
+from dashboard_state import state as dashboard_state, RECENT_FIELDS, recent_view
+
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "64"))
+LIVE_MAX_SUBSCRIBERS = int(os.getenv("LIVE_MAX_SUBSCRIBERS", "500"))
+LIVE_HEARTBEAT = float(os.getenv("LIVE_HEARTBEAT", "15"))
+LIVE_RETRY_MS = int(os.getenv("LIVE_RETRY_MS", "3000"))
+# Las conexiones se cierran solas pasado este tiempo (el cliente reconecta): uvicorn espera a que
+# terminen los responses abiertos antes de apagarse, y así ninguna lo retiene indefinidamente
+LIVE_MAX_CONNECTION_SECONDS = float(os.getenv("LIVE_MAX_CONNECTION_SECONDS", "300"))
+
+EVENTS = metrics.Counter("live_events_total", "Eventos publicados a los dashboards en vivo", ["event"])
+DROPPED = metrics.Counter("live_dropped_subscribers_total", "Conexiones cortadas por no consumir a tiempo")
+
+HEARTBEAT = ": ping\n\n"
+
+def encode(event: str, payload) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+class Subscriber:
+    __slots__ = ("queue", "topic")
+
+    def __init__(self, size: int, topic=None):
+        self.queue = asyncio.Queue(maxsize=size)
+        self.topic = topic  # None = dashboard global, si no el user_id del dashboard abierto
+
+class Broadcaster:
+    def __init__(self, queue_size: int = LIVE_QUEUE_SIZE, max_subscribers: int = LIVE_MAX_SUBSCRIBERS,
+                 heartbeat: float = LIVE_HEARTBEAT):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.heartbeat = heartbeat
+        self.subscribers = set()
+        self._topics = {}  # topic -> set de Subscriber
+        self._heartbeat_task = None
+        self.published = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.get_running_loop().create_task(
+                self._heartbeats(), context=contextvars.Context())
+
+    async def stop(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+        for subscriber in list(self.subscribers):
+            self._close(subscriber)
+
+    def accepting(self) -> bool:
+        return len(self.subscribers) < self.max_subscribers
+
+    def has_subscribers(self, topic=None) -> bool:
+        return bool(self._topics.get(topic))
+
+    def publish(self, event: str, payload, topic=None):
+        """Encola el evento en las conexiones del topic sin esperar a ninguna."""
+        EVENTS.inc(event=event)
+        self.published += 1
+        self._broadcast(encode(event, payload), self._topics.get(topic, ()))
+
+    def _broadcast(self, message: str, subscribers):
+        for subscriber in list(subscribers):
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                DROPPED.inc()
+                logging.warning("Dashboard en vivo: cliente lento desconectado")
+                self._close(subscriber)
+
+    def _close(self, subscriber: Subscriber):
+        """Vacía la cola y deja sólo la marca de fin: la conexión termina en su próxima lectura."""
+        self._remove(subscriber)
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+    def _remove(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        topic = self._topics.get(subscriber.topic)
+        if topic is not None:
+            topic.discard(subscriber)
+            if not topic:
+                del self._topics[subscriber.topic]
+
+    async def _heartbeats(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            self._broadcast(HEARTBEAT, self.subscribers)
+
+    async def stream(self, hello: dict, topic=None):
+        """Generador para StreamingResponse: el saludo con el cursor actual y después los eventos."""
+        # Se suscribe recién al empezar a transmitir: si la conexión se corta antes, no queda colgado
+        subscriber = Subscriber(self.queue_size, topic)
+        self.subscribers.add(subscriber)
+        self._topics.setdefault(topic, set()).add(subscriber)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + LIVE_MAX_CONNECTION_SECONDS
+        try:
+            yield f"retry: {LIVE_RETRY_MS}\n" + encode("hello", hello)
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    return
+                if message is None:
+                    return
+                yield message
+        finally:
+            self._remove(subscriber)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self.subscribers),
+            "topics": len(self._topics),
+            "max_subscribers": self.max_subscribers,
+            "queue_size": self.queue_size,
+            "heartbeat": self.heartbeat,
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+broadcaster = Broadcaster()
+
+def publish_change(since: str, state=dashboard_state, topic=None):
+    """
+    Evento `change` después de registrar filas en el estado del dashboard: el mismo
+    delta que /api/recent?since=<since> más el resumen de /api/summary, para que los
+    clientes no tengan que pedir nada. Un cliente cuyo cursor no es `since` se perdió
+    algo y se resincroniza por su cuenta.
+    """
+    if not broadcaster.has_subscribers(topic):
+        return
+    recent = state.recent_since(since)
+    for table in RECENT_FIELDS:
+        recent[table] = recent_view(table, recent[table])
+    broadcaster.publish("change", {"since": since, **recent, "summary": state.summary()}, topic=topic)
+
+@metrics.register_collector
+def _live_metrics():
+    return [("live_subscribers", "gauge", "Dashboards conectados a /api/updates",
+             [({}, len(broadcaster.subscribers))])]
@@ -1,19 +1,35 @@
 import os
+import re
+import hmac
+import time
 import asyncio
 import logging
 import json
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException, File, UploadFile, Form
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from threading import Lock
 from typing import Optional
 
+import coordination
 import database
+import export
 import generate_dashboard
-from ai import analyze_message
+import live_updates
+import media
+import metrics
+import tracing
+import page_cache
+import rate_limit
+import structured_output
+from dashboard_scheduler import RegenerationScheduler
+from dashboard_state import state as dashboard_state, user_states, RECENT_FIELDS, recent_view
+import response_cache
+import ai
+from ai import analyze_message, clean_json_response
+from incremental_json import IncrementalJSONParser
 
 # Load environment variables
 load_dotenv()
@@ -28,60 +44,352 @@ logging.basicConfig(
     ]
 )
 
-# Global lock to prevent concurrent dashboard generations
-dashboard_lock = Lock()
+# Single background worker that coalesces dashboard regenerations
+dashboard_scheduler = RegenerationScheduler(generate_dashboard.generate_dashboard_file_async)
 
 # Allowed users from env (will use the first one as default for web if not specified)
 ALLOWED_USERS = [int(i.strip()) for i in os.getenv("ALLOWED_USER_IDS", "").split(",") if i.strip()]
 DEFAULT_USER_ID = ALLOWED_USERS[0] if ALLOWED_USERS else 0
+# Exportar sin user_id (todos los usuarios) exige este token en "Authorization: Bearer ..."; vacío = deshabilitado
+EXPORT_ADMIN_TOKEN = os.getenv("EXPORT_ADMIN_TOKEN", "")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Trigger initial dashboard generation
+    # Startup: serve the last persisted page while the first generation runs
+    page_cache.load_from_disk()
+    # With several workers only the elected leader replays the WAL and renders dashboard.html
+    coordination.coordinator.on_elected(database.start_background)
+    await coordination.coordinator.start()
+    # Trigger initial dashboard generation
     logging.info("Triggering initial dashboard generation on startup...")
     try:
         await generate_dashboard.generate_dashboard_file_async()
         logging.info("Initial dashboard generation complete.")
     except Exception as e:
         logging.error(f"Failed initial dashboard generation: {e}")
+    dashboard_scheduler.start()
+    # If the leader dies, whoever takes over regenerates right away
+    coordination.coordinator.on_elected(dashboard_scheduler.notify)
+    live_updates.broadcaster.start()
+    tracing.exporter.start()
     yield
+    # Shutdown: render the last pending writes before exiting
+    try:
+        await dashboard_scheduler.flush(timeout=10)
+    except asyncio.TimeoutError:
+        logging.warning("Dashboard regeneration still pending at shutdown")
+    await dashboard_scheduler.stop()
+    await live_updates.broadcaster.stop()
+    # Before coordinator.stop(): while we still hold leadership no other worker replays the shared WAL
+    await database.close()
+    await coordination.coordinator.stop()
+    media.close()
+    await tracing.exporter.close()
 
 app = FastAPI(lifespan=lifespan)
 
+HTTP_REQUEST_SECONDS = metrics.Histogram("http_request_seconds", "Duración de los requests HTTP por ruta",
+                                         ["method", "route", "status"])
+CHAT_JSON_DECODE_FAILURES = metrics.Counter("chat_json_decode_failures_total",
+                                            "Respuestas de la IA que no se pudieron decodificar como JSON", ["endpoint"])
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # La plantilla de la ruta ("/api/export/{table}"), no la URL, para no explotar las series
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method,
+                                     route=getattr(route, "path", "unmatched"), status=status)
+
+@coordination.coordinator.subscribe("write")
+def _regenerate_for_remote_write(payload: dict):
+    """Otro worker guardó filas: el líder es el que tiene que regenerar dashboard.html."""
+    if coordination.coordinator.is_leader():
+        dashboard_scheduler.notify()
+
+# Va después del middleware de métricas: el último agregado es el más externo y cubre todo el request
+app.add_middleware(tracing.TraceMiddleware)
+
+@metrics.register_collector
+def _app_metrics():
+    """Contadores que ya llevan el scheduler, los buffers de escritura y la caché."""
+    scheduler = dashboard_scheduler.stats()
+    buffers = {table: buffer.stats() for table, buffer in database.write_buffers.items()}
+    cache = response_cache.cache.stats()
+    user_pages = page_cache.user_pages.stats()
+    coordinator = coordination.coordinator.stats()
+    return [
+        ("dashboard_notifications_total", "counter", "Avisos de escritura recibidos por el scheduler",
+         [({}, scheduler["notifications"])]),
+        ("dashboard_runs_total", "counter", "Regeneraciones ejecutadas", [({}, scheduler["runs"])]),
+        ("dashboard_coalesced_total", "counter", "Avisos absorbidos por una regeneración ya agendada",
+         [({}, scheduler["coalesced"])]),
+        ("dashboard_failures_total", "counter", "Regeneraciones fallidas", [({}, scheduler["failures"])]),
+        ("dashboard_queue_depth", "gauge", "Avisos pendientes de regenerar", [({}, scheduler["queue_depth"])]),
+        ("db_write_buffer_pending", "gauge", "Filas esperando el próximo insert masivo",
+         [({"table": t}, b["pending"]) for t, b in buffers.items()]),
+        ("db_write_buffer_rows_total", "counter", "Filas escritas por los buffers write-behind",
+         [({"table": t}, b["rows_written"]) for t, b in buffers.items()]),
+        ("db_write_buffer_flushes_total", "counter", "Inserts masivos hechos por los buffers write-behind",
+         [({"table": t}, b["flushes"]) for t, b in buffers.items()]),
+        ("ai_cache_hits_total", "counter", "Aciertos de la caché de respuestas", [({}, cache["hits"])]),
+        ("ai_cache_misses_total", "counter", "Fallos de la caché de respuestas", [({}, cache["misses"])]),
+        ("ai_cache_entries", "gauge", "Entradas en la caché de respuestas", [({}, cache["entries"])]),
+        ("coordination_leader", "gauge", "1 si este worker es el líder", [({}, int(coordinator["leader"]))]),
+        ("coordination_events_received_total", "counter", "Eventos de otros workers aplicados",
+         [({}, coordinator["received"])]),
+        ("dashboard_user_pages_bytes", "gauge", "Memoria de las páginas por usuario en caché",
+         [({}, user_pages["bytes"])]),
+        ("dashboard_user_pages_hits_total", "counter", "Páginas por usuario servidas desde la caché",
+         [({}, user_pages["hits"])]),
+        ("dashboard_user_pages_misses_total", "counter", "Páginas por usuario que hubo que renderizar",
+         [({}, user_pages["misses"])]),
+        ("dashboard_user_pages_evictions_total", "counter", "Páginas por usuario expulsadas por el tope de memoria",
+         [({}, user_pages["evictions"])]),
+    ]
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match", "")
+    return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+def _page_response(request: Request, page):
+    """Sirve una página pre-renderizada con ETag/304 y la compresión que acepte el cliente."""
+    headers = {
+        "ETag": page.etag,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+        "X-Dashboard-Generation": str(page.generation),
+    }
+    if _etag_matches(request, page.etag):
+        return Response(status_code=304, headers=headers)
+    body, encoding = page.encoded(request.headers.get("accept-encoding", ""))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="text/html; charset=utf-8", headers=headers)
+
 @app.get("/", response_class=HTMLResponse)
-async def get_dashboard():
-    if not os.path.exists("dashboard.html"):
+async def get_dashboard(request: Request):
+    # Comprimir la página leída del disco es CPU: fuera del event loop, como en _load_shared_page
+    page = page_cache.current() or await asyncio.to_thread(page_cache.load_from_disk)
+    if page is None:
         return "El dashboard se está generando. Por favor, refresca en unos segundos..."
-    return FileResponse("dashboard.html")
+    return _page_response(request, page)
 
 @app.get("/dashboard", response_class=HTMLResponse)
-async def get_dashboard_alias():
-    return await get_dashboard()
+async def get_dashboard_alias(request: Request):
+    return await get_dashboard(request)
+
+async def _state_for(user_id: Optional[int]):
+    """El estado global, o el del usuario (cargándolo si hace falta) si viene user_id."""
+    if user_id is None:
+        return dashboard_state
+    if ALLOWED_USERS and user_id not in ALLOWED_USERS:
+        raise HTTPException(status_code=404, detail="Usuario desconocido")
+    return await generate_dashboard.user_state(user_id)
+
+@app.get("/dashboard/{user_id}", response_class=HTMLResponse)
+async def get_user_dashboard(request: Request, user_id: int):
+    """Dashboard con los datos de un solo usuario, servido desde la caché LRU de páginas."""
+    await _state_for(user_id)
+    return _page_response(request, await generate_dashboard.user_dashboard_page(user_id))
+
+def _state_response(request: Request, content: dict):
+    """JSON del estado del dashboard con el cursor como ETag: 304 si el cliente ya tiene esta versión."""
+    headers = {"ETag": f'"{content["cursor"]}"', "Cache-Control": "no-cache"}
+    if _etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=content, headers=headers)
+
+@app.get("/api/summary")
+async def get_summary(request: Request, user_id: Optional[int] = None):
+    """Totales y datos de los gráficos, directo de los agregados en memoria."""
+    state = await _state_for(user_id)
+    return _state_response(request, state.summary())
+
+@app.get("/api/recent")
+async def get_recent(request: Request, since: Optional[str] = None, user_id: Optional[int] = None):
+    """Gastos, tareas pendientes y notas nuevos desde `since` (el cursor de la respuesta anterior)."""
+    state = await _state_for(user_id)
+    recent = state.recent_since(since)
+    for table in RECENT_FIELDS:
+        recent[table] = recent_view(table, recent[table])
+    return _state_response(request, recent)
+
+@app.get("/api/updates")
+async def get_updates(user_id: Optional[int] = None):
+    """
+    SSE con los cambios del dashboard: `hello` con el cursor actual al conectar, `change`
+    con cada escritura (delta + resumen) y `dashboard` cuando se publica una página nueva.
+    """
+    state = await _state_for(user_id)
+    if not live_updates.broadcaster.accepting():
+        return JSONResponse(status_code=503, content={"detail": "Demasiadas conexiones en vivo"},
+                            headers={"Retry-After": "30"})
+    return StreamingResponse(live_updates.broadcaster.stream({"cursor": state.cursor()}, topic=user_id),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _is_admin(request: Request) -> bool:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    return bool(EXPORT_ADMIN_TOKEN) and scheme.lower() == "bearer" and hmac.compare_digest(token, EXPORT_ADMIN_TOKEN)
+
+@app.get("/api/export/{table}")
+async def export_table(request: Request, table: str, format: str = "csv", user_id: Optional[int] = None,
+                       date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """
+    Exporta la historia completa en streaming (CSV, NDJSON o Parquet), filtrable por usuario y fechas.
+    Un usuario exporta sólo lo suyo; la historia de todos requiere el token de administración.
+    """
+    if user_id is None and not _is_admin(request):
+        raise HTTPException(status_code=401, detail="Indica user_id o un token de administración",
+                            headers={"WWW-Authenticate": "Bearer"})
+    if user_id is not None and ALLOWED_USERS and user_id not in ALLOWED_USERS:
+        raise HTTPException(status_code=404, detail="Usuario desconocido")
+    if table not in export.EXPORT_COLUMNS:
+        raise HTTPException(status_code=404, detail=f"Tabla desconocida: {table}")
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado: {format} (csv, ndjson, parquet)")
+    if format == "parquet" and export.pyarrow is None:
+        raise HTTPException(status_code=501, detail="Exportar a Parquet requiere instalar pyarrow")
+    # Antes del 200: una vez que arranca el streaming ya no se puede responder con un error
+    try:
+        date_from = export.parse_date(date_from, "date_from") if date_from else None
+        date_to = export.parse_date(date_to, "date_to") if date_to else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_type, extension = export.FORMATS[format]
+    return StreamingResponse(
+        export.stream(table, format, user_id=user_id, date_from=date_from, date_to=date_to),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{table}.{extension}"'},
+    )
+
+@app.get("/api/dashboard/status")
+async def get_dashboard_status():
+    """Métricas del planificador de regeneraciones (cola, tiempos de render, agrupadas) y de la caché por usuario."""
+    return {**dashboard_scheduler.stats(), "user_pages": page_cache.user_pages.stats(),
+            "user_states": len(user_states)}
+
+@app.get("/api/db/writes")
+async def get_write_stats():
+    """Estado de los buffers write-behind por tabla y del write-ahead log (profundidad, lag de replay)."""
+    return await database.write_stats()
+
+@app.get("/api/providers")
+async def get_providers():
+    """Estado de salud de los proveedores de IA (orden actual, circuit breakers, latencias)."""
+    return ai.get_provider_status()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Todas las métricas en formato de exposición de Prometheus."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/tracing")
+async def get_tracing_stats():
+    """Contadores del sampler de trazas (terminadas, guardadas, exportadas, umbral de la cola lenta)."""
+    return tracing.exporter.stats()
+
+@app.get("/api/coordination")
+async def get_coordination_status():
+    """Este worker: si es el líder y cuántos eventos mandó/recibió por el bus entre workers."""
+    return coordination.coordinator.stats()
+
+@app.get("/api/updates/status")
+async def get_updates_status():
+    return live_updates.broadcaster.stats()
+
+@app.get("/api/cache")
+async def get_cache_stats():
+    """Contadores de la caché de respuestas de la IA."""
+    return response_cache.cache.stats()
+
+async def read_media(image: Optional[UploadFile], audio: Optional[UploadFile]) -> dict:
+    """Adjuntos acotados, con su tipo real y ya reducidos; MediaError si no se aceptan."""
+    kwargs = {}
+    if image:
+        logging.info(f"Received image: {image.filename}")
+        kwargs["image_data"], kwargs["image_mime"] = await media.ingest_image(image)
+    if audio:
+        logging.info(f"Received audio: {audio.filename}")
+        kwargs["audio_data"], kwargs["audio_mime"] = await media.ingest_audio(audio)
+    return kwargs
+
+def build_entry(user_id: int, category: str, data, message: str):
+    """
+    (tabla, fila) a guardar para lo que clasificó la IA, o None si no hay nada que guardar.
+
+    `data` puede venir ya validado (structured_output) o crudo del parser incremental:
+    los alias y montos como texto se normalizan igual en los dos casos.
+    """
+    data = structured_output.parse_data(category, data if data is not None else {})
+    if isinstance(data, structured_output.ExpenseData):
+        return "expenses", {"user_id": user_id, "amount": data.amount, "description": data.description,
+                            "currency": data.currency}
+
+    elif isinstance(data, structured_output.TaskData):
+        return "tasks", {"user_id": user_id, "description": data.description, "deadline": data.deadline,
+                         "status": "pending"}
+
+    elif isinstance(data, structured_output.NoteData):
+        return "notes", {"user_id": user_id, "content": data.content or message}
+    return None
+
+async def save_entry(user_id: int, category: str, data: dict, message: str):
+    """Guarda lo que clasificó la IA y agenda la regeneración del dashboard."""
+    with tracing.span("chat.save_entry", category=category):
+        entry = build_entry(user_id, category, data, message)
+        if entry:
+            await database.add_entry(*entry)
+
+        # Regenerate Dashboard in a non-blocking way (coalesced by the scheduler)
+        dashboard_scheduler.notify()
+
+def busy_message(retry_after: int) -> str:
+    return f"Estoy atendiendo muchos mensajes a la vez. Intenta de nuevo en {retry_after} segundos."
+
+def admission_user(user_id: Optional[int], request: Request):
+    """
+    A quién se le cuenta el mensaje en la cola de admisión: el usuario si es uno de ALLOWED_USERS,
+    si no la IP. El user_id lo manda el cliente: si alcanzara cualquiera, rotándolo se evitaría el tope.
+    """
+    if user_id is not None and user_id in ALLOWED_USERS:
+        return user_id
+    return rate_limit.Anonymous(request.client.host if request.client else "desconocido")
+
+def overloaded_response(e: rate_limit.Overloaded) -> JSONResponse:
+    """429 con Retry-After: la cola de admisión está llena o los proveedores no tienen cuota."""
+    return JSONResponse(status_code=429, content={"response": busy_message(e.retry_after), "category": "OTHER"},
+                        headers={"Retry-After": str(e.retry_after)})
 
 @app.post("/api/chat")
 async def chat_endpoint(
+    request: Request,
     message: str = Form(...),
-    user_id: int = Form(DEFAULT_USER_ID),
+    user_id: Optional[int] = Form(None),
     image: Optional[UploadFile] = File(None),
     audio: Optional[UploadFile] = File(None)
 ):
+    admitted_as = admission_user(user_id, request)
+    user_id = DEFAULT_USER_ID if user_id is None else user_id
     logging.info(f"Received message from web user {user_id}: {message[:50]}...")
     
-    image_data = None
-    if image:
-        logging.info(f"Received image: {image.filename}")
-        image_data = await image.read()
-    
-    audio_data = None
-    if audio:
-        logging.info(f"Received audio: {audio.filename}")
-        audio_data = await audio.read()
-    
+    try:
+        media_kwargs = await read_media(image, audio)
+    except media.MediaError as e:
+        return JSONResponse(status_code=e.status_code, content={"response": e.message, "category": "OTHER"})
+
     try:
         logging.info("Calling analyze_message...")
         try:
             response_text = await asyncio.wait_for(
-                analyze_message(message, image_data, audio_data),
+                analyze_message(message, **media_kwargs, user_id=admitted_as),
                 timeout=45.0
             )
         except asyncio.TimeoutError:
@@ -90,53 +398,177 @@ async def chat_endpoint(
             
         logging.info(f"analyze_message returned: {response_text[:100]}...")
         
-        # Cleanup of code blocks if AI returns markdown json
-        clean_response = response_text.replace("```json", "").replace("```", "").strip()
-        
-        try:
-            ai_data = json.loads(clean_response)
-            category = ai_data.get("category")
-            data = ai_data.get("data", {})
-            confirmation = ai_data.get("response", "Hecho.")
-
-            if category == "EXPENSE":
-                amount = (data.get("amount") or data.get("monto") or data.get("value") or 0)
-                description = (data.get("description") or data.get("descripcion") or "No description")
-                currency = (data.get("currency") or data.get("moneda") or "USD")
-                await database.add_expense(user_id=user_id, amount=float(amount), description=description, currency=currency)
-
-            elif category == "TASK":
-                description = (data.get("description") or data.get("descripcion") or "No description")
-                deadline = (data.get("when") or data.get("fecha") or data.get("deadline"))
-                await database.add_task(user_id=user_id, description=description, deadline=deadline)
-
-            elif category == "NOTE":
-                content = (data.get("content") or data.get("contenido") or message)
-                await database.add_note(user_id=user_id, content=content)
-            
-            # Regenerate Dashboard in a non-blocking way
-            async def run_dashboard_async():
-                if dashboard_lock.acquire(blocking=False):
-                    try:
-                        logging.info("Starting background dashboard regeneration...")
-                        await generate_dashboard.generate_dashboard_file_async()
-                    except Exception as e:
-                        logging.error(f"Error regenerating dashboard: {e}")
-                    finally:
-                        dashboard_lock.release()
-            
-            asyncio.create_task(run_dashboard_async())
-            
-            return {"response": confirmation, "category": category}
-
-        except json.JSONDecodeError:
+        # Validate against the typed models, repairing common JSON mistakes locally
+        with tracing.span("chat.parse_json"):
+            parsed = structured_output.parse(response_text)
+        if parsed is None:
+            clean_response = clean_json_response(response_text)
             logging.warning(f"Failed to decode AI response as JSON: {clean_response}")
+            CHAT_JSON_DECODE_FAILURES.inc(endpoint="chat")
             return {"response": clean_response, "category": "OTHER"}
 
+        await save_entry(user_id, parsed.category, parsed.data, message)
+        return {"response": parsed.response, "category": parsed.category}
+
+    except rate_limit.Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         logging.error(f"Error in chat_endpoint: {e}", exc_info=True)
         return {"response": f"Hubo un error interno: {str(e)}", "category": "OTHER"}
 
+BATCH_MAX_MESSAGES = int(os.getenv("BATCH_MAX_MESSAGES", "200"))
+
+class BatchRequest(BaseModel):
+    messages: list[str] = []
+    # Alternativa: una lista pegada tal cual ("café 3, taxi 12, recordar pagar luz")
+    text: Optional[str] = None
+    user_id: Optional[int] = None
+
+def split_batch_text(text: str) -> list:
+    """Separa por saltos de línea, ';' o comas que no sean decimales ("3,5")."""
+    return [part.strip() for part in re.split(r"[\n;]+|,(?!\d)", text) if part.strip()]
+
+@app.post("/api/chat/batch")
+async def chat_batch_endpoint(request: BatchRequest, http_request: Request):
+    """Clasifica muchos mensajes con pocos requests al LLM y los guarda con un insert masivo por tabla."""
+    admitted_as = admission_user(request.user_id, http_request)
+    user_id = DEFAULT_USER_ID if request.user_id is None else request.user_id
+    messages = [m.strip() for m in request.messages if m.strip()]
+    if request.text:
+        messages += split_batch_text(request.text)
+    if not messages:
+        raise HTTPException(status_code=400, detail="No hay mensajes para procesar")
+    if len(messages) > BATCH_MAX_MESSAGES:
+        raise HTTPException(status_code=413, detail=f"Máximo {BATCH_MAX_MESSAGES} mensajes por lote")
+    logging.info(f"Received batch of {len(messages)} messages from web user {user_id}")
+
+    try:
+        responses = await asyncio.wait_for(ai.analyze_batch(messages, user_id=admitted_as), timeout=45.0)
+    except rate_limit.Overloaded as e:
+        raise HTTPException(status_code=429, detail=busy_message(e.retry_after),
+                            headers={"Retry-After": str(e.retry_after)})
+    except asyncio.TimeoutError:
+        logging.error("AI batch analysis timed out after 45 seconds")
+        raise HTTPException(status_code=504, detail="La IA tardó demasiado en responder. Intenta de nuevo.")
+
+    results = []
+    entries = []
+    for message, response_text in zip(messages, responses):
+        parsed = structured_output.parse(response_text)
+        if parsed is None:
+            clean_response = clean_json_response(response_text)
+            logging.warning(f"Failed to decode AI response as JSON: {clean_response}")
+            CHAT_JSON_DECODE_FAILURES.inc(endpoint="batch")
+            results.append({"message": message, "response": clean_response, "category": "OTHER"})
+            continue
+        entry = build_entry(user_id, parsed.category, parsed.data, message)
+        if entry:
+            entries.append(entry)
+        results.append({"message": message, "response": parsed.response, "category": parsed.category})
+
+    if entries:
+        with tracing.span("chat.save_entries", count=len(entries)):
+            await database.add_entries(entries)
+            dashboard_scheduler.notify()
+    return {"results": results, "saved": len(entries)}
+
+def sse_event(event: str, payload) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.post("/api/chat/stream")
+async def chat_stream_endpoint(
+    request: Request,
+    message: str = Form(...),
+    user_id: Optional[int] = Form(None),
+    image: Optional[UploadFile] = File(None),
+    audio: Optional[UploadFile] = File(None)
+):
+    """
+    Variante de /api/chat por Server-Sent Events.
+
+    Eventos: `status`, `category`, `delta` (texto de "response" a medida que llega),
+    `saved`, `done` y `error`. El guardado en la base arranca apenas el parser
+    incremental completa "category" y "data", mientras el modelo sigue escribiendo.
+    """
+    admitted_as = admission_user(user_id, request)
+    user_id = DEFAULT_USER_ID if user_id is None else user_id
+    logging.info(f"Received streaming message from web user {user_id}: {message[:50]}...")
+    try:
+        media_kwargs = await read_media(image, audio)
+    except media.MediaError as e:
+        return JSONResponse(status_code=e.status_code, content={"response": e.message, "category": "OTHER"})
+
+    async def events():
+        yield sse_event("status", {"stage": "thinking"})
+        parser = IncrementalJSONParser()
+        save_task = None
+        sent = 0
+        text = ""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 45.0
+        stream = ai.stream_analyze_message(message, **media_kwargs, user_id=admitted_as)
+        try:
+            while True:
+                # El límite se aplica a cada espera del modelo, no a lo que tarda el cliente en leer
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=max(0.0, deadline - loop.time()))
+                except StopAsyncIteration:
+                    break
+                text += chunk
+                for key, value in parser.feed(chunk):
+                    if key == "category":
+                        yield sse_event("category", {"category": structured_output.normalize_category(value)})
+                fields = parser.fields
+                if save_task is None and "category" in fields and "data" in fields:
+                    save_task = asyncio.create_task(
+                        save_entry(user_id, fields["category"], fields["data"], message))
+                partial = parser.partial_string("response") or ""
+                if len(partial) > sent:
+                    yield sse_event("delta", {"delta": partial[sent:]})
+                    sent = len(partial)
+        except rate_limit.Overloaded as e:
+            # El stream ya empezó (200): el aviso y el Retry-After van en el evento
+            yield sse_event("error", {"response": busy_message(e.retry_after), "retry_after": e.retry_after})
+            return
+        except asyncio.TimeoutError:
+            logging.error("AI streaming timed out after 45 seconds")
+            if save_task is None:
+                yield sse_event("error", {"response": "Lo siento, la IA tardó demasiado en responder. Intenta de nuevo."})
+                return
+        except Exception as e:
+            logging.error(f"Error in chat_stream_endpoint: {e}", exc_info=True)
+            if save_task is None:
+                yield sse_event("error", {"response": f"Hubo un error interno: {str(e)}"})
+                return
+        finally:
+            await stream.aclose()
+
+        if save_task is None:
+            # El parser no encontró los campos (JSON inválido, incompleto o con otras claves): mismo criterio que /api/chat
+            parsed = structured_output.parse(text)
+            if parsed is None:
+                clean_response = clean_json_response(text)
+                logging.warning(f"Failed to decode AI response as JSON: {clean_response}")
+                CHAT_JSON_DECODE_FAILURES.inc(endpoint="stream")
+                yield sse_event("done", {"response": clean_response, "category": "OTHER"})
+                return
+            parser.fields.update(category=parsed.category, data=parsed.data, response=parsed.response)
+            save_task = asyncio.create_task(save_entry(user_id, parsed.category, parsed.data, message))
+
+        category = structured_output.normalize_category(parser.fields.get("category"))
+        confirmation = parser.fields.get("response") or "Hecho."
+        try:
+            await save_task
+            yield sse_event("saved", {"category": category})
+        except Exception as e:
+            logging.error(f"Error saving streamed entry: {e}", exc_info=True)
+            yield sse_event("error", {"response": f"Hubo un error interno: {str(e)}"})
+            return
+        yield sse_event("done", {"response": confirmation, "category": category})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
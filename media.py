@@ -0,0 +1,332 @@
+"""
+Ingesta de imágenes y audios antes de mandarlos a Gemini.
+
+Starlette ya vuelca cada upload a un archivo temporal (en memoria hasta 1 MB,
+después a disco), así que no lo copiamos de nuevo: sólo se controla el tamaño
+y se procesa desde ahí. El tipo real se detecta por los bytes (no por la
+extensión ni el Content-Type del navegador). Las imágenes se reducen a la
+resolución que el modelo usa y se re-encodean a JPEG; los WAV se recortan y
+pasan a mono 16 kHz. Los audios comprimidos no se decodifican (no hay ffmpeg):
+se lee su duración del encabezado y se rechazan si pasan de
+MEDIA_AUDIO_MAX_SECONDS; si el formato no la trae, se acota por tamaño
+suponiendo MEDIA_AUDIO_MAX_BITRATE. Ese trabajo de CPU corre en un pool de procesos para no
+frenar el event loop; los archivos de más de MEDIA_SPOOL_THRESHOLD se procesan
+en un hilo leyendo directo del temporal de Starlette, así un audio de 20 MB no
+se copia entero a memoria para pasarlo a otro proceso.
+"""
+import io
+import os
+import wave
+import array
+import asyncio
+import logging
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+MEDIA_MAX_IMAGE_BYTES = int(os.getenv("MEDIA_MAX_IMAGE_BYTES", str(15 * 1024 * 1024)))
+MEDIA_MAX_AUDIO_BYTES = int(os.getenv("MEDIA_MAX_AUDIO_BYTES", str(20 * 1024 * 1024)))
+# Hasta este tamaño el upload se copia a memoria y se procesa en el pool de procesos; más grande, en un hilo
+MEDIA_SPOOL_THRESHOLD = int(os.getenv("MEDIA_SPOOL_THRESHOLD", str(1024 * 1024)))
+# Gemini parte las imágenes en tiles de 768px: más resolución sólo agrega bytes
+MEDIA_IMAGE_MAX_SIDE = int(os.getenv("MEDIA_IMAGE_MAX_SIDE", "1536"))
+MEDIA_JPEG_QUALITY = int(os.getenv("MEDIA_JPEG_QUALITY", "85"))
+MEDIA_AUDIO_MAX_SECONDS = float(os.getenv("MEDIA_AUDIO_MAX_SECONDS", "120"))
+MEDIA_AUDIO_SAMPLE_RATE = int(os.getenv("MEDIA_AUDIO_SAMPLE_RATE", "16000"))
+# Bits por segundo que suponemos para un audio comprimido cuya duración no se puede leer (webm de MediaRecorder)
+MEDIA_AUDIO_MAX_BITRATE = int(os.getenv("MEDIA_AUDIO_MAX_BITRATE", "256000"))
+# 0 = procesar en un hilo en vez de un pool de procesos
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "2"))
+
+IMAGE_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+_pool = None
+
+class MediaError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+class AudioTooLong(ValueError):
+    """El audio pasa de MEDIA_AUDIO_MAX_SECONDS (se levanta en el pool de procesos: tiene que ser picklable)."""
+
+def sniff_audio_mime(head: bytes):
+    """Tipo de audio según la firma de los primeros bytes, o None si no se reconoce."""
+    if head.startswith(b"OggS"):
+        return "audio/ogg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "audio/wav"
+    if head.startswith(b"fLaC"):
+        return "audio/flac"
+    if head.startswith(b"ID3") or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return "audio/mpeg"
+    if head[4:8] == b"ftyp":
+        return "audio/mp4"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "audio/webm"
+    return None
+
+def _upload_size(upload) -> int:
+    if upload.size is not None:
+        return upload.size
+    # UploadFile armado a mano (sin pasar por el parser de Starlette): lo medimos
+    upload.file.seek(0, io.SEEK_END)
+    return upload.file.tell()
+
+async def upload_source(upload, limit: int):
+    """
+    Controla que el upload no pase de `limit` bytes y lo devuelve listo para procesar:
+    bytes si es chico (van al pool de procesos) o el archivo temporal del upload si es grande.
+    """
+    size = _upload_size(upload)
+    if size > limit:
+        raise MediaError(413, f"El archivo supera el máximo de {limit // (1024 * 1024)} MB")
+    await upload.seek(0)
+    if size <= MEDIA_SPOOL_THRESHOLD:
+        return await upload.read()
+    return upload.file
+
+def _open_source(source):
+    # El archivo del upload lo cierra Starlette al terminar el request
+    if isinstance(source, bytes):
+        return io.BytesIO(source)
+    source.seek(0)
+    return nullcontext(source)
+
+def process_image(source, max_side: int = MEDIA_IMAGE_MAX_SIDE, quality: int = MEDIA_JPEG_QUALITY):
+    """(bytes, mime) listos para el modelo: orientación EXIF aplicada, lado mayor <= max_side, JPEG."""
+    with _open_source(source) as f:
+        try:
+            image = Image.open(f)
+            mime = IMAGE_FORMATS.get(image.format)
+            if mime is None:
+                raise ValueError(f"formato de imagen no soportado: {image.format}")
+            # Para JPEG decodifica directo a una escala reducida (mucho menos CPU y memoria)
+            image.draft("RGB", (max_side, max_side))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+        except (OSError, Image.DecompressionBombError) as e:
+            logging.warning(f"Imagen rechazada: {e}")
+            raise ValueError("imagen inválida o en un formato no soportado")
+
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=quality, optimize=True)
+        encoded = out.getvalue()
+
+        # Si el original ya era un JPEG chico, re-encodearlo no ahorra nada
+        f.seek(0, io.SEEK_END)
+        if mime == "image/jpeg" and f.tell() <= len(encoded):
+            f.seek(0)
+            return f.read(), mime
+    return encoded, "image/jpeg"
+
+def _to_mono_16k(frames: bytes, channels: int, rate: int, target_rate: int) -> bytes:
+    """PCM de 16 bits: promedia los canales y re-muestrea por interpolación lineal."""
+    samples = array.array("h", frames)
+    if channels > 1:
+        samples = array.array("h", (sum(samples[i:i + channels]) // channels
+                                    for i in range(0, len(samples) - channels + 1, channels)))
+    if rate > target_rate and rate % target_rate == 0:
+        samples = samples[::rate // target_rate]
+    elif rate > target_rate and samples:
+        step = rate / target_rate
+        count = int(len(samples) / step)
+        last = len(samples) - 1
+        resampled = array.array("h", bytes(2 * count))
+        for i in range(count):
+            position = i * step
+            index = int(position)
+            frac = position - index
+            nxt = samples[min(index + 1, last)]
+            resampled[i] = int(samples[index] + (nxt - samples[index]) * frac)
+        samples = resampled
+    return samples.tobytes()
+
+MP3_BITRATES = {3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),  # MPEG-1, kbps
+                0: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)}  # MPEG-2 y 2.5
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+def _ogg_duration(f, size: int):
+    # Granule position de la última página / sample rate del encabezado (Opus siempre cuenta a 48 kHz)
+    head = f.read(512)
+    packet = head[27 + head[26]:] if len(head) > 27 else b""
+    if packet.startswith(b"OpusHead"):
+        rate = 48000
+    elif packet.startswith(b"\x01vorbis"):
+        rate = int.from_bytes(packet[12:16], "little")
+    else:
+        return None
+    f.seek(max(0, size - 65536))
+    tail = f.read()
+    page = tail.rfind(b"OggS")
+    if page < 0 or len(tail) < page + 14 or not rate:
+        return None
+    granule = int.from_bytes(tail[page + 6:page + 14], "little", signed=True)
+    return granule / rate if granule > 0 else None
+
+def _flac_duration(f, size: int):
+    info = f.read(42)[8:]  # STREAMINFO siempre es el primer bloque de metadata
+    if len(info) < 18:
+        return None
+    fields = int.from_bytes(info[10:18], "big")
+    rate, samples = fields >> 44, fields & ((1 << 36) - 1)
+    return samples / rate if rate and samples else None
+
+def _mp3_duration(f, size: int):
+    head = f.read(10)
+    start = 0
+    if head.startswith(b"ID3") and len(head) == 10:
+        start = 10 + sum(b << (7 * (3 - i)) for i, b in enumerate(head[6:10]))  # tamaño synchsafe
+    f.seek(start)
+    data = f.read(4096)
+    sync = next((i for i in range(len(data) - 3) if data[i] == 0xFF and data[i + 1] & 0xE0 == 0xE0), None)
+    if sync is None:
+        return None
+    version, layer = (data[sync + 1] >> 3) & 3, (data[sync + 1] >> 1) & 3
+    bitrate_index, rate_index = data[sync + 2] >> 4, (data[sync + 2] >> 2) & 3
+    if version == 1 or layer != 1 or rate_index == 3 or bitrate_index in (0, 15):
+        return None  # sólo Layer III con bitrate y sample rate válidos
+    rate = MP3_SAMPLE_RATES[version][rate_index]
+    samples_per_frame = 1152 if version == 3 else 576
+    mono = data[sync + 3] >> 6 == 3
+    xing = sync + 4 + ((17 if mono else 32) if version == 3 else (9 if mono else 17))
+    if data[xing:xing + 4] in (b"Xing", b"Info") and int.from_bytes(data[xing + 4:xing + 8], "big") & 1:
+        # VBR: el encabezado Xing trae la cantidad de frames
+        return int.from_bytes(data[xing + 8:xing + 12], "big") * samples_per_frame / rate
+    return (size - start - sync) * 8 / (MP3_BITRATES[3 if version == 3 else 0][bitrate_index] * 1000)
+
+def _mp4_duration(f, size: int):
+    # moov puede ir antes o después de mdat: se recorren las cajas saltando su contenido hasta moov/mvhd
+    offset, end = 0, size
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(16)
+        box_size, kind, header_size = int.from_bytes(header[:4], "big"), header[4:8], 8
+        if box_size == 1:
+            box_size, header_size = int.from_bytes(header[8:16], "big"), 16
+        elif box_size == 0:
+            box_size = end - offset
+        if box_size < header_size:
+            return None
+        if kind == b"moov":
+            offset, end = offset + header_size, offset + box_size
+            continue
+        if kind == b"mvhd":
+            f.seek(offset + header_size)
+            body = f.read(32)
+            if body[:1] == b"\x01":
+                timescale, duration = int.from_bytes(body[20:24], "big"), int.from_bytes(body[24:32], "big")
+            else:
+                timescale, duration = int.from_bytes(body[12:16], "big"), int.from_bytes(body[16:20], "big")
+            return duration / timescale if timescale else None
+        offset += box_size
+    return None
+
+DURATION_READERS = {"audio/ogg": _ogg_duration, "audio/flac": _flac_duration, "audio/mpeg": _mp3_duration,
+                    "audio/mp4": _mp4_duration}
+
+def audio_duration(f, mime: str):
+    """Duración en segundos según el encabezado del contenedor, o None si no se puede saber sin decodificar."""
+    reader = DURATION_READERS.get(mime)
+    if reader is None:
+        return None
+    f.seek(0, io.SEEK_END)
+    size = f.tell()
+    f.seek(0)
+    try:
+        return reader(f, size)
+    except (IndexError, KeyError, ZeroDivisionError):
+        return None  # encabezado roto: lo acota el tamaño
+    finally:
+        f.seek(0)
+
+def _check_compressed_audio(f, mime: str, max_seconds: float):
+    duration = audio_duration(f, mime)
+    if duration is None:
+        f.seek(0, io.SEEK_END)
+        size = f.tell()
+        f.seek(0)
+        if size > max_seconds * MEDIA_AUDIO_MAX_BITRATE / 8:
+            raise AudioTooLong(f"El audio supera el máximo de {max_seconds:.0f} segundos")
+    elif duration > max_seconds:
+        raise AudioTooLong(f"El audio dura {duration:.0f} s y el máximo es {max_seconds:.0f} s")
+
+def process_audio(source, max_seconds: float = MEDIA_AUDIO_MAX_SECONDS,
+                  sample_rate: int = MEDIA_AUDIO_SAMPLE_RATE):
+    """
+    (bytes, mime) listos para el modelo. Los WAV PCM de 16 bits se recortan a max_seconds
+    y se pasan a mono `sample_rate`. Los formatos comprimidos (ogg/opus, mp3, m4a...) no se
+    recortan: se mandan tal cual si duran hasta max_seconds y si no se rechazan (AudioTooLong).
+    """
+    with _open_source(source) as f:
+        mime = sniff_audio_mime(f.read(16))
+        if mime is None:
+            raise ValueError("formato de audio no soportado")
+        f.seek(0)
+        if mime != "audio/wav":
+            _check_compressed_audio(f, mime, max_seconds)
+            return f.read(), mime
+        try:
+            with wave.open(f, "rb") as wav:
+                channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+                frames = wav.readframes(min(wav.getnframes(), int(max_seconds * rate)))
+        except (wave.Error, EOFError) as e:
+            raise ValueError(f"WAV inválido: {e}")
+
+    if width == 2:
+        frames = _to_mono_16k(frames, channels, rate, sample_rate)
+        channels, rate = 1, min(rate, sample_rate)
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(width)
+        wav.setframerate(rate)
+        wav.writeframes(frames)
+    return out.getvalue(), "audio/wav"
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=MEDIA_WORKERS)
+    return _pool
+
+async def _run(func, source):
+    try:
+        if MEDIA_WORKERS <= 0 or not isinstance(source, bytes):
+            # Un archivo abierto no se puede pasar a otro proceso: se procesa en un hilo
+            return await asyncio.to_thread(func, source)
+        return await asyncio.get_running_loop().run_in_executor(_get_pool(), func, source)
+    except AudioTooLong as e:
+        raise MediaError(413, str(e))
+    except ValueError as e:
+        raise MediaError(415, str(e))
+
+async def ingest_image(upload):
+    """UploadFile -> (bytes, mime) reducido; MediaError 413/415 si es muy grande o no es una imagen."""
+    source = await upload_source(upload, MEDIA_MAX_IMAGE_BYTES)
+    data, mime = await _run(process_image, source)
+    logging.info(f"Imagen {upload.filename}: {upload.size or '?'} -> {len(data)} bytes ({mime})")
+    return data, mime
+
+async def ingest_audio(upload):
+    """UploadFile -> (bytes, mime); MediaError 413/415 si es muy grande, muy largo o no es un audio."""
+    source = await upload_source(upload, MEDIA_MAX_AUDIO_BYTES)
+    data, mime = await _run(process_audio, source)
+    logging.info(f"Audio {upload.filename}: {upload.size or '?'} -> {len(data)} bytes ({mime})")
+    return data, mime
+
+def close():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
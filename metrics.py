@@ -0,0 +1,148 @@
+"""
+Métricas en formato de exposición de Prometheus (texto), sin dependencias.
+
+Los módulos registran contadores e histogramas al importarse y los actualizan
+en el camino caliente (una suma bajo un lock). Lo que ya se lleva en otro lado
+(el scheduler del dashboard, el proceso) se publica con colectores: funciones
+que devuelven las muestras al momento de cada scrape de GET /metrics.
+"""
+import asyncio
+import threading
+
+import psutil
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics = []
+_collectors = []
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}  # labels -> [conteos por bucket..., suma, total]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += state[i]
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+def register_collector(func):
+    """func() -> [(nombre, tipo, ayuda, [(labels: dict, valor), ...]), ...], evaluado en cada scrape."""
+    _collectors.append(func)
+    return func
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    for collector in _collectors:
+        for name, kind, help, samples in collector():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if value is not None:
+                    lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+def _process_samples():
+    """RSS, CPU e hilos del proceso y saturación del thread pool por defecto del event loop."""
+    process = psutil.Process()
+    with process.oneshot():
+        memory = process.memory_info()
+        cpu = process.cpu_times()
+        threads = process.num_threads()
+        fds = process.num_fds() if hasattr(process, "num_fds") else None
+    samples = [
+        ("process_resident_memory_bytes", "gauge", "Memoria residente (RSS)", [({}, memory.rss)]),
+        ("process_virtual_memory_bytes", "gauge", "Memoria virtual", [({}, memory.vms)]),
+        ("process_cpu_seconds_total", "counter", "Tiempo de CPU de usuario y sistema",
+         [({}, round(cpu.user + cpu.system, 3))]),
+        ("process_threads", "gauge", "Hilos del proceso", [({}, threads)]),
+        ("process_open_fds", "gauge", "Descriptores de archivo abiertos", [({}, fds)]),
+    ]
+    try:
+        executor = asyncio.get_running_loop()._default_executor
+    except RuntimeError:
+        executor = None
+    if executor is not None:
+        # asyncio.to_thread usa este pool: cola > 0 con todos los hilos ocupados = saturado
+        samples += [
+            ("threadpool_max_workers", "gauge", "Tamaño máximo del thread pool por defecto",
+             [({}, executor._max_workers)]),
+            ("threadpool_threads", "gauge", "Hilos creados en el thread pool por defecto",
+             [({}, len(executor._threads))]),
+            ("threadpool_queue_depth", "gauge", "Tareas esperando un hilo libre en el thread pool por defecto",
+             [({}, executor._work_queue.qsize())]),
+        ]
+    return samples
+
+register_collector(_process_samples)
@@ -0,0 +1,165 @@
+"""
+Página del dashboard ya renderizada, en memoria.
+
+Cada regeneración construye un `RenderedPage` inmutable (HTML, gzip, brotli,
+ETag y número de generación) y lo publica con un simple reemplazo de
+referencia, así los lectores nunca ven una página a medio escribir. El disco
+sólo se usa como persistencia, escribiendo a un temporal y renombrando.
+"""
+import os
+import gzip
+import time
+import hashlib
+import logging
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él servimos gzip
+    brotli = None
+
+DASHBOARD_FILE = os.getenv("DASHBOARD_FILE", "dashboard.html")
+# Tope de memoria de las páginas por usuario (HTML + gzip + brotli de todas las entradas)
+DASHBOARD_USER_CACHE_BYTES = int(os.getenv("DASHBOARD_USER_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+# "unchanged" = regeneración que produjo exactamente la misma página (se descarta)
+PUBLISHES = metrics.Counter("dashboard_publish_total", "Páginas del dashboard publicadas o descartadas por iguales",
+                            ["result"])
+
+class RenderedPage:
+    """Una versión del dashboard, pre-comprimida. No se modifica después de creada."""
+
+    __slots__ = ("body", "gzip", "brotli", "etag", "generation", "created_at")
+
+    def __init__(self, html: str, generation: int):
+        self.body = html.encode("utf-8")
+        self.gzip = gzip.compress(self.body, compresslevel=6)
+        self.brotli = brotli.compress(self.body, quality=9) if brotli else None
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+        self.generation = generation
+        self.created_at = time.time()
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + len(self.gzip) + (len(self.brotli) if self.brotli else 0)
+
+    def encoded(self, accept_encoding: str):
+        """Devuelve (bytes, content-encoding) según lo que acepta el cliente."""
+        accepted = {part.split(";")[0].strip() for part in (accept_encoding or "").lower().split(",")}
+        if self.brotli is not None and "br" in accepted:
+            return self.brotli, "br"
+        if "gzip" in accepted:
+            return self.gzip, "gzip"
+        return self.body, None
+
+_current = None
+_generation = 0
+_publish_lock = Lock()
+
+def current():
+    """La última página publicada (o None si todavía no se generó ninguna)."""
+    return _current
+
+def publish(html: str) -> RenderedPage:
+    """Construye la nueva versión y la intercambia atómicamente por la actual.
+
+    Comprime la página (CPU): desde código async llamarla con asyncio.to_thread.
+    """
+    global _current, _generation
+    with _publish_lock:
+        page = RenderedPage(html, _generation + 1)
+        if _current is not None and page.etag == _current.etag:
+            # Mismo contenido: no cambiamos de generación para no invalidar cachés de clientes
+            PUBLISHES.inc(result="unchanged")
+            return _current
+        _generation = page.generation
+        _current = page
+        PUBLISHES.inc(result="published")
+        return page
+
+def write_atomic(path: str, data: bytes):
+    """Escribe a un temporal en el mismo directorio y lo renombra encima del destino."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".dashboard-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def load_from_disk(path: str = DASHBOARD_FILE, force: bool = False):
+    """
+    Al arrancar, publica la última página persistida para no servir un dashboard vacío.
+    Con force=True la relee aunque ya haya una: es lo que hacen los workers que no
+    renderizan cuando el líder avisa que escribió una página nueva (ver coordination).
+    """
+    if (_current is not None and not force) or not os.path.exists(path):
+        return _current
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return publish(f.read())
+    except OSError as e:
+        logging.error(f"No se pudo leer {path}: {e}")
+        return None
+
+class PageLRU:
+    """Páginas renderizadas por clave (usuario), acotadas por bytes; se expulsa la menos usada."""
+
+    def __init__(self, max_bytes: int = DASHBOARD_USER_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._pages = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def put(self, key, page: RenderedPage):
+        if page.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._pages.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._pages[key] = page
+            self._bytes += page.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._pages.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            page = self._pages.pop(key, None)
+            if page is not None:
+                self._bytes -= page.size
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {"entries": len(self._pages), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "invalidations": self.invalidations}
+
+user_pages = PageLRU()
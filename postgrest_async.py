@@ -0,0 +1,144 @@
+"""
+Cliente PostgREST (la API REST de Supabase) nativamente asíncrono.
+
+Usa un único `httpx.AsyncClient` compartido con keep-alive y un pool de
+conexiones acotado, así las consultas no ocupan hilos del thread pool ni
+bloquean el event loop. `configure()` permite apuntarlo a otro servidor o a
+un transport en proceso (por ejemplo `fake_postgrest.app`).
+"""
+import os
+import time
+import httpx
+from dotenv import load_dotenv
+
+import metrics
+import tracing
+
+load_dotenv()
+
+DB_POOL_MAX_CONNECTIONS = int(os.getenv("DB_POOL_MAX_CONNECTIONS", "20"))
+DB_POOL_MAX_KEEPALIVE = int(os.getenv("DB_POOL_MAX_KEEPALIVE", "10"))
+DB_POOL_KEEPALIVE_EXPIRY = float(os.getenv("DB_POOL_KEEPALIVE_EXPIRY", "30"))
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "10"))
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+
+_settings = {
+    "base_url": (os.getenv("SUPABASE_URL") or "").rstrip("/"),
+    "api_key": os.getenv("SUPABASE_KEY") or "",
+    "transport": None,
+}
+_client = None
+
+DB_REQUEST_SECONDS = metrics.Histogram("db_request_seconds", "Duración de los requests a PostgREST/Supabase",
+                                       ["operation", "table", "status"])
+
+class PostgrestError(Exception):
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"PostgREST {status_code}: {body[:300]}")
+        self.status_code = status_code
+        self.body = body
+
+def configure(base_url: str = None, api_key: str = None, transport=None):
+    """Cambia el destino (p. ej. el servidor falso local). Cierra el cliente actual en el próximo uso."""
+    global _client
+    if base_url is not None:
+        _settings["base_url"] = base_url.rstrip("/")
+    if api_key is not None:
+        _settings["api_key"] = api_key
+    _settings["transport"] = transport
+    _client = None
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=f"{_settings['base_url']}/rest/v1",
+            headers={
+                "apikey": _settings["api_key"],
+                "Authorization": f"Bearer {_settings['api_key']}",
+            },
+            limits=httpx.Limits(
+                max_connections=DB_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=DB_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=DB_POOL_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(DB_TIMEOUT, connect=DB_CONNECT_TIMEOUT),
+            transport=_settings["transport"],
+        )
+    return _client
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _filter_params(filters) -> list:
+    """
+    [("user_id", "eq", 1), ("created_at", "gte", "2024-01-01")] -> [("user_id", "eq.1"), ...]
+    Con op None el valor va tal cual, para árboles lógicos: ("or", None, "(a.gt.1,b.eq.2)").
+    """
+    return [(column, value if op is None else f"{op}.{value}") for column, op, value in (filters or [])]
+
+def quote(value) -> str:
+    """Valor entre comillas para usarlo dentro de or=(...) (fechas con ':' '.' '+')."""
+    return '"' + str(value).replace('"', '\\"') + '"'
+
+async def _request(operation: str, table: str, method: str, url: str, **kwargs) -> httpx.Response:
+    start = time.perf_counter()
+    status = "error"
+    with tracing.span("db.request", tracing.KIND_CLIENT, operation=operation, table=table) as span:
+        try:
+            response = await get_client().request(method, url, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            if span is not None:
+                span.set(**{"http.status_code": status})
+            DB_REQUEST_SECONDS.observe(time.perf_counter() - start, operation=operation, table=table, status=status)
+
+def _check(response: httpx.Response):
+    if response.status_code >= 400:
+        raise PostgrestError(response.status_code, response.text)
+
+async def insert(table: str, rows, returning: bool = True, on_conflict: str = None, ignore_duplicates: bool = False):
+    """Insert de una o varias filas en un solo request. Devuelve las filas insertadas."""
+    prefer = ["return=representation" if returning else "return=minimal"]
+    params = {}
+    if on_conflict:
+        params["on_conflict"] = on_conflict
+        prefer.append("resolution=ignore-duplicates" if ignore_duplicates else "resolution=merge-duplicates")
+    response = await _request("insert", table, "POST", f"/{table}", json=rows, params=params,
+                              headers={"Prefer": ",".join(prefer)})
+    _check(response)
+    return response.json() if returning and response.content else []
+
+async def select(table: str, columns: str = "*", filters=None, order: str = None, desc: bool = False,
+                 limit: int = None, offset: int = None) -> list:
+    params = [("select", columns)] + _filter_params(filters)
+    if order:
+        # order="created_at,id" ordena por varias columnas en la misma dirección
+        direction = "desc" if desc else "asc"
+        params.append(("order", ",".join(f"{column.strip()}.{direction}" for column in order.split(","))))
+    if limit is not None:
+        params.append(("limit", str(limit)))
+    if offset:
+        params.append(("offset", str(offset)))
+    response = await _request("select", table, "GET", f"/{table}", params=params)
+    _check(response)
+    return response.json()
+
+async def count(table: str, filters=None) -> int:
+    """Conteo exacto sin transferir filas (Prefer: count=exact + Range 0-0)."""
+    params = [("select", "*")] + _filter_params(filters)
+    response = await _request("count", table, "GET", f"/{table}", params=params,
+                              headers={"Prefer": "count=exact", "Range-Unit": "items", "Range": "0-0"})
+    _check(response)
+    content_range = response.headers.get("content-range", "*/0")
+    total = content_range.split("/")[-1]
+    return int(total) if total.isdigit() else 0
+
+async def rpc(function: str, params: dict = None):
+    response = await _request("rpc", function, "POST", f"/rpc/{function}", json=params or {})
+    _check(response)
+    return response.json() if response.content else None
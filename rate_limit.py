@@ -0,0 +1,219 @@
+"""
+Límites de uso de los proveedores LLM y control de admisión de /api/chat.
+
+- TokenBucket / ProviderLimiter: la cuota de cada proveedor (requests y tokens
+  por minuto) como baldes que se rellenan de forma continua. Un proveedor sin
+  saldo no se llama: se salta como si tuviera el circuito abierto, en lugar de
+  recibir el 429 y arrastrar la cascada de fallbacks.
+- AdmissionQueue: cuántos mensajes pueden estar esperando a los proveedores a
+  la vez. Los que exceden ese número esperan en una cola acotada que se atiende
+  por turnos entre usuarios (un usuario con 50 mensajes no deja esperando al
+  que manda uno); si la cola está llena se rechaza enseguida con Overloaded y
+  un retry_after estimado, para que el cliente reintente en vez de esperar al
+  timeout. Los mensajes web sin user_id, o con uno que no está en
+  ALLOWED_USER_IDS (lo elige el cliente), se identifican por la IP del cliente
+  (Anonymous): tienen su propio turno pero no el tope por usuario, porque
+  detrás de una IP puede haber muchas personas (NAT, proxies).
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+import metrics
+
+AI_MAX_ACTIVE = int(os.getenv("AI_MAX_ACTIVE", "8"))
+AI_MAX_QUEUED = int(os.getenv("AI_MAX_QUEUED", "64"))
+AI_MAX_QUEUED_PER_USER = int(os.getenv("AI_MAX_QUEUED_PER_USER", "8"))
+
+ADMISSION_REJECTED = metrics.Counter("ai_admission_rejected_total", "Mensajes rechazados por cola de admisión llena",
+                                     ["reason"])
+ADMISSION_WAIT_SECONDS = metrics.Histogram("ai_admission_wait_seconds", "Espera en la cola de admisión hasta ser atendido")
+
+class Overloaded(Exception):
+    """No hay lugar (o cuota) para atender el mensaje ahora; reintentar en `retry_after` segundos."""
+
+    def __init__(self, retry_after: float, reason: str = "queue_full"):
+        super().__init__(f"{reason}: reintentar en {retry_after:.0f}s")
+        self.retry_after = max(1, int(retry_after + 0.999))
+        self.reason = reason
+
+class Anonymous(str):
+    """Identidad de un mensaje sin user_id (la IP del cliente): ordena los turnos pero no tiene tope propio."""
+
+    def __repr__(self):
+        return f"Anonymous({str(self)!r})"
+
+class TokenBucket:
+    """Balde de `per_minute` unidades por minuto; `burst` es el máximo acumulable (por defecto, un minuto)."""
+
+    def __init__(self, per_minute: float, burst: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float = 1) -> float:
+        """Segundos hasta que haya `amount` disponibles (0 = ya)."""
+        self._refill(time.monotonic())
+        # Un pedido más grande que el balde entero se deja pasar con el balde lleno, si no nunca pasaría
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate) if self.rate > 0 else (0.0 if missing <= 0 else float("inf"))
+
+    def take(self, amount: float = 1):
+        self._refill(time.monotonic())
+        self.tokens -= amount
+
+    def drain(self):
+        """El proveedor respondió 429: nuestra estimación se quedó corta, no volver a llamarlo hasta rellenar."""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0.0)
+
+class ProviderLimiter:
+    """Cuota de un proveedor: requests por minuto y tokens por minuto (0 = sin límite)."""
+
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.throttled = 0
+
+    def _buckets(self, tokens: int):
+        return [(bucket, amount) for bucket, amount in ((self.requests, 1), (self.tokens, tokens)) if bucket]
+
+    def delay(self, tokens: int) -> float:
+        return max((bucket.delay(amount) for bucket, amount in self._buckets(tokens)), default=0.0)
+
+    def try_acquire(self, tokens: int) -> bool:
+        """Descuenta un request y `tokens` si alcanzan ambos saldos; si no, no descuenta nada."""
+        if self.delay(tokens) > 0:
+            self.throttled += 1
+            return False
+        for bucket, amount in self._buckets(tokens):
+            bucket.take(amount)
+        return True
+
+    def drain(self):
+        for bucket, _ in self._buckets(0):
+            bucket.drain()
+
+    def snapshot(self) -> dict:
+        return {
+            "requests_available": round(self.requests.tokens, 1) if self.requests else None,
+            "tokens_available": round(self.tokens.tokens) if self.tokens else None,
+            "throttled": self.throttled,
+        }
+
+class AdmissionQueue:
+    def __init__(self, max_active: int = AI_MAX_ACTIVE, max_queued: int = AI_MAX_QUEUED,
+                 max_queued_per_user: int = AI_MAX_QUEUED_PER_USER):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.active = 0
+        self._waiting = OrderedDict()  # usuario -> deque de futures; el orden es el turno
+        self.queued = 0
+        self.ewma_service = None  # segundos que un mensaje ocupa su lugar, para estimar Retry-After
+        self.admitted = 0
+        self.rejected = 0
+
+    def retry_after(self) -> float:
+        service = self.ewma_service or 5.0
+        return service * (self.queued + 1) / max(1, self.max_active)
+
+    def check(self, user=None):
+        """Lanza Overloaded si un mensaje de `user` sería rechazado ahora (sin encolarlo)."""
+        if self.active < self.max_active and not self.queued:
+            return
+        if self.queued >= self.max_queued:
+            reason = "queue_full"
+        elif not isinstance(user, Anonymous) and len(self._waiting.get(user, ())) >= self.max_queued_per_user:
+            reason = "user_queue_full"
+        else:
+            return
+        self.rejected += 1
+        ADMISSION_REJECTED.inc(reason=reason)
+        logging.warning(f"Admisión rechazada para {user} ({reason}, {self.queued} en cola)")
+        raise Overloaded(self.retry_after(), reason)
+
+    async def acquire(self, user=None):
+        self.check(user)
+        if self.active < self.max_active and not self.queued:
+            self.active += 1
+            self.admitted += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user, deque()).append(future)
+        self.queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # se le había cedido el lugar justo antes de cancelarse
+            else:
+                self._discard(user, future)
+            raise
+        self.admitted += 1
+
+    def _discard(self, user, future):
+        waiters = self._waiting.get(user)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            self.queued -= 1
+            if not waiters:
+                del self._waiting[user]
+
+    def release(self):
+        """Cede el lugar al próximo usuario en turno (y a ese usuario lo manda al final)."""
+        while self._waiting:
+            user, waiters = next(iter(self._waiting.items()))
+            future = waiters.popleft()
+            self.queued -= 1
+            if waiters:
+                self._waiting.move_to_end(user)
+            else:
+                del self._waiting[user]
+            if not future.done():
+                future.set_result(None)  # el lugar pasa directo: active no cambia
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, user=None):
+        start = time.monotonic()
+        await self.acquire(user)
+        admitted = time.monotonic()
+        ADMISSION_WAIT_SECONDS.observe(admitted - start)
+        try:
+            yield
+        finally:
+            service = time.monotonic() - admitted
+            self.ewma_service = service if self.ewma_service is None else 0.2 * service + 0.8 * self.ewma_service
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "max_active": self.max_active,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "max_queued_per_user": self.max_queued_per_user,
+            "users_waiting": len(self._waiting),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "ewma_service": round(self.ewma_service, 3) if self.ewma_service is not None else None,
+        }
+
+admission = AdmissionQueue()
+
+@metrics.register_collector
+def _admission_metrics():
+    return [
+        ("ai_admission_active", "gauge", "Mensajes esperando respuesta de los proveedores", [({}, admission.active)]),
+        ("ai_admission_queued", "gauge", "Mensajes en la cola de admisión", [({}, admission.queued)]),
+    ]
@@ -0,0 +1,130 @@
+"""
+Caché de respuestas de `ai.analyze_message`.
+
+La clave combina el texto normalizado, un hash de la imagen/audio, la versión
+del prompt (hash de SYSTEM_INSTRUCTION), así un cambio de prompt invalida todo,
+y la fecha del día: "mañana" o "el viernes" se resuelven a otra fecha mañana.
+En memoria es un LRU con TTL y tope de bytes; opcionalmente se respalda en
+SQLite (AI_CACHE_DB) para sobrevivir reinicios.
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+import sqlite3
+from collections import OrderedDict
+from datetime import date
+from threading import Lock
+
+from fast_path import normalize
+
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "true").lower() == "true"
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "86400"))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "5000"))
+AI_CACHE_MAX_BYTES = int(os.getenv("AI_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+AI_CACHE_DB = os.getenv("AI_CACHE_DB", "")  # vacío = sólo memoria
+
+def _digest(data) -> str:
+    if data is None:
+        return "-"
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+def make_key(text: str, prompt: str, image_data: bytes = None, audio_data: bytes = None, today: date = None) -> str:
+    normalized = re.sub(r"\s+", " ", normalize(text or ""))
+    day = (today or date.today()).isoformat()
+    return _digest("|".join([normalized, _digest(image_data), _digest(audio_data), _digest(prompt), day]))
+
+class ResponseCache:
+    """LRU con TTL y tope de memoria, con respaldo opcional en SQLite."""
+
+    def __init__(self, ttl: float = AI_CACHE_TTL, max_entries: int = AI_CACHE_MAX_ENTRIES,
+                 max_bytes: int = AI_CACHE_MAX_BYTES, db_path: str = AI_CACHE_DB):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.lock = Lock()
+        self.db = None
+        if db_path:
+            try:
+                self.db = sqlite3.connect(db_path, check_same_thread=False)
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute("PRAGMA synchronous=NORMAL")
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS ai_cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+                self.db.execute("DELETE FROM ai_cache WHERE expires_at < ?", (time.time(),))
+                self.db.commit()
+            except sqlite3.Error as e:
+                logging.error(f"No se pudo abrir la caché en disco {db_path}: {e}")
+                self.db = None
+
+    def _store(self, key: str, value: str, expires_at: float):
+        if key in self.entries:
+            self.size_bytes -= len(self.entries.pop(key)[1])
+        self.entries[key] = (expires_at, value)
+        self.size_bytes += len(value)
+        while self.entries and (len(self.entries) > self.max_entries or self.size_bytes > self.max_bytes):
+            _, (_, old) = self.entries.popitem(last=False)
+            self.size_bytes -= len(old)
+            self.evictions += 1
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                expires_at, value = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self.size_bytes -= len(self.entries.pop(key)[1])
+
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT value, expires_at FROM ai_cache WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+                if row:
+                    self._store(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: str):
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self._store(key, value, expires_at)
+            if self.db is not None:
+                try:
+                    self.db.execute("INSERT OR REPLACE INTO ai_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                                    (key, value, expires_at))
+                    self.db.commit()
+                except sqlite3.Error as e:
+                    logging.error(f"Error escribiendo la caché en disco: {e}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": AI_CACHE_ENABLED,
+                "entries": len(self.entries),
+                "bytes": self.size_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "persistent": self.db is not None,
+            }
+
+cache = ResponseCache()
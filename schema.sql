@@ -0,0 +1,55 @@
+-- Cambios de esquema en Supabase que usa la API.
+-- Ejecutar en el SQL editor de Supabase (es idempotente).
+
+-- Clave de idempotencia del write-ahead log local (write_ahead_log.py):
+-- el replayer inserta con on_conflict=idempotency_key, así un reintento no duplica filas.
+alter table expenses add column if not exists idempotency_key text;
+alter table tasks add column if not exists idempotency_key text;
+alter table notes add column if not exists idempotency_key text;
+create unique index if not exists expenses_idempotency_key_idx on expenses (idempotency_key);
+create unique index if not exists tasks_idempotency_key_idx on tasks (idempotency_key);
+create unique index if not exists notes_idempotency_key_idx on notes (idempotency_key);
+
+-- Agregados del dashboard calculados en el servidor (aggregates.py).
+-- Una sola llamada RPC devuelve totales exactos, top-N categorías, la serie diaria
+-- de una ventana arbitraria y los conteos, sin transferir filas.
+create or replace function dashboard_aggregates(p_user_id bigint default null, p_top_n int default 5, p_days int default 7)
+returns json
+language sql
+stable
+as $$
+  select json_build_object(
+    'total_expenses', (select coalesce(sum(amount), 0) from expenses
+                       where p_user_id is null or user_id = p_user_id),
+    'expense_count', (select count(*) from expenses
+                      where p_user_id is null or user_id = p_user_id),
+    'pending_tasks', (select count(*) from tasks
+                      where status = 'pending' and (p_user_id is null or user_id = p_user_id)),
+    'total_notes', (select count(*) from notes
+                    where p_user_id is null or user_id = p_user_id),
+    'top_categories', coalesce((
+      select json_agg(json_build_object('description', description, 'total', total) order by total desc)
+      from (
+        select coalesce(description, 'Otros') as description, sum(amount) as total
+        from expenses
+        where p_user_id is null or user_id = p_user_id
+        group by 1
+        order by 2 desc
+        limit p_top_n
+      ) c), '[]'::json),
+    'daily', coalesce((
+      select json_agg(json_build_object('day', day, 'total', total) order by day)
+      from (
+        select (created_at at time zone 'utc')::date as day, sum(amount) as total
+        from expenses
+        where (p_user_id is null or user_id = p_user_id)
+          and created_at >= (now() at time zone 'utc')::date - (p_days - 1)
+        group by 1
+      ) d), '[]'::json)
+  );
+$$;
+
+-- Índices para que los agregados y los listados recientes no recorran las tablas enteras
+create index if not exists expenses_user_created_idx on expenses (user_id, created_at desc);
+create index if not exists tasks_user_status_created_idx on tasks (user_id, status, created_at desc);
+create index if not exists notes_user_created_idx on notes (user_id, created_at desc);
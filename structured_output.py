@@ -0,0 +1,367 @@
+"""
+Respuestas estructuradas de los LLMs: un modelo tipado por categoría, el JSON
+Schema que se pide a los proveedores que lo soportan y una reparación local
+para lo que llega mal formado.
+
+`parse(texto)` devuelve un ChatResponse validado o None. Antes de darse por
+vencido arregla lo que los modelos rompen seguido, sin otra vuelta al LLM:
+
+- fences ```json, texto antes o después del objeto
+- comas colgando antes de `}` o `]`, saltos de línea crudos dentro de strings
+- objetos truncados: se descarta la última clave si su valor quedó a medias
+  ("amount": 12 puede ser el principio de 120) y se cierra lo abierto; si así
+  falta un campo obligatorio (REQUIRED_FIELDS) la respuesta no vale y se le
+  pide a otro proveedor
+- claves en español o inglés ("monto", "descripción", "fecha"...) y categorías
+  traducidas ("GASTO"), o los campos de data sueltos al primer nivel
+- montos como texto ("1.500,50", "$ 2 mil") y monedas por nombre ("pesos");
+  fechas ilegibles quedan como null
+
+Cada reparación se cuenta por tipo en ai_json_repairs_total y cada respuesta
+según terminó (valid, repaired, failed) en ai_structured_output_total.
+"""
+import re
+import json
+import unicodedata
+from datetime import date
+from typing import Optional, Union
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+import fast_path
+import metrics
+
+CATEGORIES = ("EXPENSE", "TASK", "NOTE", "PLANNING", "OTHER")
+
+STRUCTURED_OUTPUTS = metrics.Counter("ai_structured_output_total",
+                                     "Respuestas de los proveedores según su JSON (valid, repaired, failed)", ["outcome"])
+REPAIRS = metrics.Counter("ai_json_repairs_total", "Reparaciones locales aplicadas a respuestas JSON", ["kind"])
+
+# --- Modelos ---
+
+class _Data(BaseModel):
+    # Los modelos chicos a veces mandan la descripción o la fecha como número
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+class ExpenseData(_Data):
+    amount: float = 0.0
+    description: str = "No description"
+    currency: str = "USD"
+
+class TaskData(_Data):
+    description: str = "No description"
+    deadline: Optional[str] = None
+
+    @field_validator("deadline", mode="before")
+    @classmethod
+    def _deadline(cls, value):
+        """AAAA-MM-DD; lo que no se entiende ("pronto", "2024-03-") queda sin fecha en vez de romper el insert."""
+        if value is None:
+            return None
+        text = str(value).strip()
+        try:
+            return date.fromisoformat(text[:10]).isoformat()
+        except ValueError:
+            return fast_path.parse_date(fast_path.normalize(text))[0]
+
+class NoteData(_Data):
+    content: Optional[str] = None  # sin contenido se guarda el mensaje original
+
+class PlanningData(_Data):
+    goal: Optional[str] = None
+    steps: list[str] = []
+
+class OtherData(_Data):
+    pass
+
+DATA_MODELS = {"EXPENSE": ExpenseData, "TASK": TaskData, "NOTE": NoteData, "PLANNING": PlanningData, "OTHER": OtherData}
+# Campos sin los que no se guarda nada: si una respuesta truncada los perdió, mejor otra vuelta al LLM que un default
+REQUIRED_FIELDS = {"EXPENSE": {"amount", "description", "currency"}, "TASK": {"description"}}
+
+class ChatResponse(BaseModel):
+    category: str
+    data: Union[ExpenseData, TaskData, NoteData, PlanningData, OtherData]
+    response: str = "Hecho."
+    repairs: list[str] = Field(default_factory=list, exclude=True)
+
+    def to_json(self) -> str:
+        return json.dumps(self.model_dump(), ensure_ascii=False)
+
+# --- JSON Schema para los proveedores ---
+
+def _nullable(schema: dict) -> dict:
+    schema = {key: value for key, value in schema.items() if key not in ("default", "title")}
+    if {"type": "null"} in schema.get("anyOf", ()):
+        return schema
+    return {"anyOf": [schema, {"type": "null"}]}
+
+def response_schema() -> dict:
+    """
+    Schema estricto (todas las claves requeridas, sin extras) de {category, data, response}.
+
+    `data` junta los campos de todas las categorías como anulables: los modos
+    estrictos de OpenAI y Gemini no aceptan uniones discriminadas por un campo
+    hermano, y la categoría decide después qué modelo valida.
+    """
+    properties = {}
+    for model in DATA_MODELS.values():
+        for name, schema in model.model_json_schema().get("properties", {}).items():
+            properties.setdefault(name, _nullable(schema))
+    return {
+        "type": "object",
+        "properties": {
+            "category": {"type": "string", "enum": list(CATEGORIES)},
+            "data": {"type": "object", "properties": properties, "required": list(properties),
+                     "additionalProperties": False},
+            "response": {"type": "string"},
+        },
+        "required": ["category", "data", "response"],
+        "additionalProperties": False,
+    }
+
+# --- Alias ---
+# Con varias claves para el mismo campo gana la canónica y después el alias que aparece antes en la tabla
+# ({"precio": 10, "total": 30} -> amount 30)
+
+TOP_ALIASES = {
+    "categoria": "category", "tipo": "category", "type": "category", "clase": "category",
+    "datos": "data", "detalles": "data", "details": "data", "info": "data",
+    "respuesta": "response", "mensaje": "response", "message": "response", "reply": "response",
+    "confirmacion": "response", "confirmation": "response",
+}
+DATA_ALIASES = {
+    "monto": "amount", "importe": "amount", "total": "amount", "costo": "amount", "cost": "amount",
+    "precio": "amount", "price": "amount", "valor": "amount", "value": "amount",
+    "descripcion": "description", "concepto": "description", "detalle": "description", "desc": "description",
+    "item": "description", "titulo": "description", "title": "description",
+    "moneda": "currency", "divisa": "currency",
+    "fecha": "deadline", "fecha_limite": "deadline", "vencimiento": "deadline", "when": "deadline",
+    "due": "deadline", "due_date": "deadline", "cuando": "deadline", "date": "deadline",
+    "contenido": "content", "texto": "content", "text": "content", "nota": "content", "note": "content",
+    "meta": "goal", "objetivo": "goal", "proyecto": "goal", "project": "goal",
+    "pasos": "steps", "tareas": "steps", "tasks": "steps", "subtareas": "steps",
+}
+CATEGORY_ALIASES = {
+    "GASTO": "EXPENSE", "GASTOS": "EXPENSE", "EXPENSES": "EXPENSE", "COMPRA": "EXPENSE",
+    "TAREA": "TASK", "TAREAS": "TASK", "TASKS": "TASK", "TODO": "TASK", "RECORDATORIO": "TASK", "REMINDER": "TASK",
+    "NOTA": "NOTE", "NOTAS": "NOTE", "NOTES": "NOTE",
+    "PLAN": "PLANNING", "PLANIFICACION": "PLANNING", "PLANEACION": "PLANNING", "PROYECTO": "PLANNING",
+    "PROJECT": "PLANNING", "META": "PLANNING", "GOAL": "PLANNING",
+    "OTRO": "OTHER", "OTROS": "OTHER", "OTRA": "OTHER", "SALUDO": "OTHER",
+}
+_DATA_FIELDS = {name for model in DATA_MODELS.values() for name in model.model_fields}
+
+def _key(key) -> str:
+    """'Descripción ' -> 'descripcion': minúsculas, sin tildes, espacios y guiones como '_'."""
+    key = unicodedata.normalize("NFKD", str(key).strip().lower())
+    return re.sub(r"[\s\-]+", "_", "".join(c for c in key if not unicodedata.combining(c)))
+
+def _rename(obj: dict, aliases: dict, repairs: list) -> dict:
+    out = {}
+    ranks = {}
+    priority = {alias: rank for rank, alias in enumerate(aliases, start=1)}
+    for key, value in obj.items():
+        name = _key(key)
+        canonical = aliases.get(name, name)
+        if canonical != key:
+            repairs.append("key_alias")
+        rank = 0 if canonical == name else priority[name]
+        if canonical not in out or rank < ranks[canonical]:
+            out[canonical] = value
+            ranks[canonical] = rank
+    return out
+
+def normalize_category(category, repairs: list = None) -> str:
+    """Categoría canónica; las desconocidas quedan como OTHER (la respuesta al usuario se conserva igual)."""
+    repairs = repairs if repairs is not None else []
+    raw = str(category or "").strip()
+    name = _key(raw).upper()
+    if name in CATEGORIES:
+        if name != raw:
+            repairs.append("category_alias")
+        return name
+    repairs.append("category_alias" if name in CATEGORY_ALIASES else "unknown_category")
+    return CATEGORY_ALIASES.get(name, "OTHER")
+
+def _amount(value, repairs: list):
+    if isinstance(value, str):
+        amount, _ = fast_path.parse_amount(fast_path.normalize(value))
+        if amount is None:
+            raise ValueError(f"monto ilegible: {value!r}")
+        repairs.append("numeric_string")
+        return amount
+    return value
+
+def parse_data(category: str, data, repairs: list = None):
+    """`data` de una categoría como su modelo (alias, montos y monedas normalizados), o None si no valida."""
+    repairs = repairs if repairs is not None else []
+    model = DATA_MODELS.get(normalize_category(category, repairs))
+    if isinstance(data, model or ()):
+        return data
+    if model is None or not isinstance(data, dict):
+        return None
+    # null es "no vino": que se aplique el default del modelo
+    data = {key: value for key, value in _rename(data, DATA_ALIASES, repairs).items() if value is not None}
+    try:
+        if "amount" in data and model is ExpenseData:
+            data["amount"] = _amount(data["amount"], repairs)
+        currency = data.get("currency")
+        if isinstance(currency, str) and not re.fullmatch(r"[A-Za-z]{3}", currency.strip()):
+            data["currency"] = fast_path.parse_currency(fast_path.normalize(currency))
+            repairs.append("currency")
+        elif isinstance(currency, str):
+            data["currency"] = currency.strip().upper()
+        if isinstance(data.get("steps"), str):
+            data["steps"] = [step.strip() for step in re.split(r"\n|;", data["steps"]) if step.strip()]
+        return model.model_validate(data)
+    except (ValidationError, ValueError):
+        return None
+
+# --- Reparación del texto ---
+
+_FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_STRING = r'"(?:[^"\\]|\\.)*"'
+# Un valor al final de un texto truncado sólo está completo si se cerró: un número puede seguir ("12" -> "120")
+_CLOSED_VALUE = rf"(?:{_STRING}|true|false|null|[\[{{].*[\]}}])"
+_COMPLETE_MEMBER = {
+    "}": re.compile(rf"(?:{_STRING}\s*:\s*{_CLOSED_VALUE})?", re.DOTALL),
+    "]": re.compile(rf"{_CLOSED_VALUE}?", re.DOTALL),
+}
+
+def repair_json(text: str, repairs: list):
+    """
+    Objeto JSON de `text`, arreglando lo que se pueda en una pasada. Agrega a
+    `repairs` el tipo de cada arreglo; lanza ValueError si no hay objeto.
+    """
+    stripped = _FENCE.sub("", text or "").strip()
+    start = stripped.find("{")
+    if start < 0:
+        raise ValueError("no hay un objeto JSON")
+    if start > 0:
+        repairs.append("surrounding_text")
+    body = stripped[start:]
+    try:
+        obj, end = json.JSONDecoder().raw_decode(body)
+        if body[end:].strip():
+            repairs.append("surrounding_text")
+        return obj
+    except json.JSONDecodeError:
+        pass
+
+    out = []
+    stack = []
+    members = []  # por cada contenedor abierto, dónde empieza en `out` su último miembro
+    in_string = escape = False
+    consumed = len(body)
+    for position, char in enumerate(body):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            elif char in "\n\r\t":
+                repairs.append("control_character")
+                char = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}[char]
+            out.append(char)
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            out.append(char)
+            members.append(len(out))
+            continue
+        elif char == "," and stack:
+            out.append(char)
+            members[-1] = len(out)
+            continue
+        elif char in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+                repairs.append("trailing_comma")
+            if stack:
+                char = stack.pop()
+                members.pop()
+            out.append(char)
+            if not stack:
+                consumed = position + 1
+                break
+            continue
+        out.append(char)
+
+    if body[consumed:].strip():
+        repairs.append("surrounding_text")
+    if in_string or stack:
+        repairs.append("truncated")
+        # El último miembro a medias (string abierto, número que podía seguir, clave sin valor) se descarta
+        # entero: cerrarlo guardaría "amount": 1 de un 150 o una fecha "2024-03-"
+        if in_string or not _COMPLETE_MEMBER[stack[-1]].fullmatch("".join(out[members[-1]:]).strip()):
+            del out[members[-1]:]
+            repairs.append("truncated_value")
+        while out and (out[-1].isspace() or out[-1] == ","):
+            out.pop()
+        out.extend(reversed(stack))
+    repaired = "".join(out)
+    try:
+        return json.loads(repaired)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON irreparable: {e}") from None
+
+# --- Punto de entrada ---
+
+def from_object(obj, repairs: list = None) -> Optional[ChatResponse]:
+    """ChatResponse de un dict ya decodificado, o None si no se puede validar."""
+    repairs = repairs if repairs is not None else []
+    if not isinstance(obj, dict):
+        return None
+    obj = _rename(obj, TOP_ALIASES, repairs)
+    if "category" not in obj:
+        return None
+    if "data" not in obj:
+        # Campos de data sueltos al primer nivel: {"category": "EXPENSE", "amount": 5, ...}
+        loose = {key: obj[key] for key in list(obj)
+                 if key not in ("category", "response") and DATA_ALIASES.get(_key(key), _key(key)) in _DATA_FIELDS}
+        if loose:
+            repairs.append("flattened_data")
+        obj["data"] = loose
+    category = normalize_category(obj["category"], repairs)
+    data = parse_data(category, obj["data"] or {}, repairs)
+    if data is None:
+        return None
+    if "truncated" in repairs and not REQUIRED_FIELDS.get(category, set()) <= data.model_fields_set:
+        return None  # la respuesta se cortó antes de un campo obligatorio: no inventarle un default
+    response = obj.get("response")
+    return ChatResponse(category=category, data=data,
+                        response=response if isinstance(response, str) and response.strip() else "Hecho.",
+                        repairs=repairs)
+
+def parse(text: str) -> Optional[ChatResponse]:
+    """ChatResponse validado de la respuesta de un modelo (reparada si hizo falta), o None."""
+    repairs = []
+    try:
+        obj = repair_json(text, repairs)
+    except ValueError:
+        return None
+    return from_object(obj, repairs)
+
+def record(result: Optional[ChatResponse]):
+    """Cuenta una respuesta de proveedor ya procesada por parse/from_object."""
+    if result is None:
+        STRUCTURED_OUTPUTS.inc(outcome="failed")
+        return
+    STRUCTURED_OUTPUTS.inc(outcome="repaired" if result.repairs else "valid")
+    for kind in set(result.repairs):
+        REPAIRS.inc(kind=kind)
+
+def stats() -> dict:
+    counts = {outcome: STRUCTURED_OUTPUTS.value(outcome=outcome) for outcome in ("valid", "repaired", "failed")}
+    total = sum(counts.values())
+    return {
+        **counts,
+        "repair_rate": round(counts["repaired"] / total, 4) if total else None,
+        "failure_rate": round(counts["failed"] / total, 4) if total else None,
+    }
@@ -0,0 +1,76 @@
+"""
+Plantillas precompiladas para el dashboard, sin dependencias.
+
+Una plantilla es texto con marcas `{{ nombre }}` o `{{ nombre|filtro }}`. Se
+compila una sola vez (al importar el módulo que la define): el texto estático
+se parte en fragmentos ya minificados y renderizar es sólo intercalar los
+valores con un join. Los valores se escapan como HTML por defecto; `json` los
+serializa para un <script> y `safe` inserta HTML ya renderizado por otra
+plantilla.
+"""
+import re
+import json
+from html import escape
+
+_TAG = re.compile(r"\{\{\s*([A-Za-z_]\w*)\s*(?:\|\s*(\w+)\s*)?\}\}")
+_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+_NEWLINE_RUN = re.compile(r"[ \t\r\f\v]*\n\s*")
+
+def _escape(value) -> str:
+    return escape(str(value), quote=True)
+
+def _script_json(value) -> str:
+    """JSON que no puede cerrar el <script> ni abrir un comentario HTML."""
+    return (json.dumps(value, ensure_ascii=False)
+            .replace("<", "\\u003c").replace(">", "\\u003e").replace("&", "\\u0026")
+            .replace("\u2028", "\\u2028").replace("\u2029", "\\u2029"))
+
+FILTERS = {"e": _escape, "json": _script_json, "safe": str}
+
+def minify(text: str) -> str:
+    """Quita comentarios HTML e indentación: cada tramo de espacios con saltos de línea queda en un '\\n'.
+
+    No toca los espacios dentro de una línea (el texto entre etiquetas se ve
+    igual) y conserva los saltos, así el JS sigue funcionando con sus
+    comentarios `//` y la inserción automática de punto y coma.
+    """
+    return _NEWLINE_RUN.sub("\n", _COMMENT.sub("", text))
+
+class TemplateError(Exception):
+    pass
+
+class Template:
+    """Plantilla compilada: fragmentos estáticos minificados + (nombre, filtro) de cada marca."""
+
+    def __init__(self, source: str, name: str = "template", minified: bool = True):
+        self.name = name
+        pieces = _TAG.split(source)
+        static = pieces[0::3]
+        if minified:
+            static = [minify(piece) for piece in static]
+        self._head = static[0]
+        self._slots = []
+        for slot_name, filter_name, tail in zip(pieces[1::3], pieces[2::3], static[1:]):
+            if (filter_name or "e") not in FILTERS:
+                raise TemplateError(f"{name}: filtro desconocido '{filter_name}'")
+            self._slots.append((slot_name, FILTERS[filter_name or "e"], tail))
+        self._last = None  # (contexto, salida) del último render_cached
+
+    def render(self, **context) -> str:
+        out = [self._head]
+        try:
+            for slot_name, apply, tail in self._slots:
+                out.append(apply(context[slot_name]))
+                out.append(tail)
+        except KeyError as e:
+            raise TemplateError(f"{self.name}: falta el valor {e}") from None
+        return "".join(out)
+
+    def render_cached(self, **context) -> str:
+        """Como render, pero reutiliza la salida anterior si el contexto no cambió."""
+        last = self._last
+        if last is not None and last[0] == context:
+            return last[1]
+        output = self.render(**context)
+        self._last = (context, output)
+        return output
@@ -0,0 +1,86 @@
+from dashboard_state import DashboardState, BOOT_ID
+
+def history():
+    """Filas en orden de llegada: gastos de varias categorías y días, tareas hechas y pendientes, notas."""
+    expenses = [{"id": n, "amount": 10 + n, "description": ("super", "taxi", "cine")[n % 3],
+                 "created_at": f"2024-03-{1 + n % 5:02d}T10:00:00+00:00"} for n in range(20)]
+    tasks = [{"id": n, "description": f"tarea {n}", "status": "done" if n % 4 == 0 else "pending",
+              "created_at": f"2024-03-{1 + n % 5:02d}T11:00:00+00:00"} for n in range(12)]
+    notes = [{"id": n, "content": f"nota {n}", "created_at": "2024-03-01T12:00:00+00:00"} for n in range(15)]
+    return expenses, tasks, notes
+
+def view(state):
+    snapshot = state.snapshot()
+    del snapshot["version"], snapshot["cursor"]
+    return snapshot, state.top_categories(5), state.daily_series(7)
+
+def test_incremental_updates_match_a_full_load():
+    expenses, tasks, notes = history()
+    incremental = DashboardState()
+    incremental.load([], [], [])
+    for e in expenses:
+        incremental.record_expense(e)
+    for t in tasks:
+        incremental.record_task(t)
+    for n in notes:
+        incremental.record_note(n)
+
+    loaded = DashboardState()
+    loaded.load(expenses[::-1], tasks[::-1], notes[::-1])  # load recibe las filas de la más nueva a la más vieja
+    assert view(incremental) == view(loaded)
+    assert incremental.pending_tasks == 9 and incremental.expense_count == 20
+
+def test_top_categories_follow_new_expenses():
+    state = DashboardState()
+    state.load([], [], [])
+    state.record_expense({"amount": 10, "description": "super"})
+    state.record_expense({"amount": 5, "description": "taxi"})
+    assert state.top_categories(1) == [("super", 10)]
+    state.record_expense({"amount": 20, "description": "taxi"})
+    assert state.top_categories(1) == [("taxi", 25)]
+
+def test_reload_applies_unsaved_rows_on_top():
+    expenses, tasks, notes = history()
+    expected = DashboardState()
+    expected.load(expenses[::-1], tasks[::-1], notes[::-1])
+
+    # Supabase sólo tiene las primeras 15; las últimas 5 siguen en el WAL
+    saved = DashboardState()
+    saved.load(expenses[:15][::-1], tasks[::-1], notes[::-1])
+    summary = saved.snapshot()
+    aggregates = {"total_expenses": summary["total_expenses"], "expense_count": summary["expense_count"],
+                  "pending_tasks": summary["pending_tasks"], "total_notes": summary["total_notes"],
+                  "top_categories": saved.top_categories(50), "daily": dict(saved.daily_totals)}
+    state = DashboardState()
+    state.load_aggregates(aggregates, summary["recent_expenses"], summary["recent_pending_tasks"],
+                          summary["recent_notes"], unsaved=[("expenses", e) for e in expenses[15:]])
+    assert view(state) == view(expected)
+
+def test_writes_since_survive_a_reload():
+    state = DashboardState()
+    state.load([], [], [])
+    since = state.version
+    state.record_note({"content": "a"})
+    state.load([], [], [])
+    state.record_task({"description": "b"})
+    assert state.writes_since(since) == [("notes", {"content": "a"}), ("tasks", {"description": "b"})]
+
+def test_recent_since_returns_only_the_delta():
+    state = DashboardState()
+    state.load([], [], [])
+    state.record_note({"content": "a"})
+    cursor = state.cursor()
+    state.record_note({"content": "b"})
+    delta = state.recent_since(cursor)
+    assert not delta["reset"] and delta["notes"] == [{"content": "b"}] and delta["expenses"] == []
+
+    assert state.recent_since(f"{BOOT_ID}x.{state.version}")["reset"]  # cursor de otro proceso
+    state.load([], [], [])
+    assert state.recent_since(cursor)["reset"]  # anterior a la recarga
+
+if __name__ == "__main__":
+    test_incremental_updates_match_a_full_load()
+    test_top_categories_follow_new_expenses()
+    test_reload_applies_unsaved_rows_on_top()
+    test_writes_since_survive_a_reload()
+    test_recent_since_returns_only_the_delta()
@@ -0,0 +1,72 @@
+import asyncio
+import csv
+import io
+
+import httpx
+
+import export
+import fake_postgrest
+import postgrest_async
+
+class RecordingTransport(httpx.ASGITransport):
+    """El PostgREST falso, anotando cada URL pedida."""
+
+    def __init__(self):
+        super().__init__(app=fake_postgrest.app)
+        self.urls = []
+
+    async def handle_async_request(self, request):
+        self.urls.append(str(request.url))
+        return await super().handle_async_request(request)
+
+def run(scenario):
+    """Corre scenario(transport) contra expenses cargadas en el PostgREST falso."""
+    fake_postgrest.reset()
+    # Varias filas por created_at (los empates caen en los bordes de página) e ids que no siguen a la fecha
+    fake_postgrest.tables["expenses"].extend(
+        {"id": 100 - n, "user_id": 1 + n % 2, "amount": n, "currency": "ARS", "description": f"gasto {n}",
+         "created_at": f"2024-03-{1 + n // 4:02d}T10:00:00+00:00"} for n in range(22))
+    transport = RecordingTransport()
+    postgrest_async.configure(base_url="http://fake-postgrest", api_key="test", transport=transport)
+
+    async def main():
+        try:
+            return await scenario(transport)
+        finally:
+            await postgrest_async.close()
+    return asyncio.run(main())
+
+async def exported(**query):
+    return [row async for page in export.iter_pages("expenses", **query) for row in page]
+
+def test_keyset_pages_cover_every_row_once():
+    async def scenario(transport):
+        return await exported(page_size=3), transport.urls
+
+    rows, urls = run(scenario)
+    keys = [(row["created_at"], row["id"]) for row in rows]
+    assert len(rows) == 22 and keys == sorted(keys) and len(set(keys)) == 22
+    assert len(urls) == 8  # 7 páginas llenas y la última corta
+    assert not any("offset" in url for url in urls)
+
+def test_filters_apply_on_every_page():
+    async def scenario(transport):
+        return (await exported(user_id=2, page_size=2),
+                await exported(date_from="2024-03-02", date_to="2024-03-03", page_size=2))
+
+    by_user, by_date = run(scenario)
+    assert sorted(row["amount"] for row in by_user) == [n for n in range(22) if n % 2 == 1]
+    assert sorted(row["amount"] for row in by_date) == list(range(4, 12))  # date_to sin hora es inclusivo
+
+def test_csv_stream():
+    async def scenario(transport):
+        return b"".join([chunk async for chunk in export.stream("expenses", "csv", user_id=1)])
+
+    rows = list(csv.DictReader(io.StringIO(run(scenario).decode("utf-8"))))
+    assert sorted(int(row["amount"]) for row in rows) == [n for n in range(22) if n % 2 == 0]
+    assert list(rows[0]) == export.EXPORT_COLUMNS["expenses"]
+
+if __name__ == "__main__":
+    test_keyset_pages_cover_every_row_once()
+    test_filters_apply_on_every_page()
+    test_csv_stream()
@@ -0,0 +1,65 @@
+from datetime import date
+from fast_path import classify, FAST_PATH_THRESHOLD
+
+TODAY = date(2024, 3, 11)  # lunes
+
+# Corpus etiquetado: (mensaje, categoría esperada, data esperada parcial).
+# Categoría None = el mensaje debe ir al LLM (no hay respuesta local segura).
+CORPUS = [
+    ("Gasté 500 en pizza", "EXPENSE", {"amount": 500.0, "description": "pizza"}),
+    ("gaste 1.500,50 pesos en el super", "EXPENSE", {"amount": 1500.5, "currency": "ARS", "description": "super"}),
+    ("Pagué 20 dólares de netflix", "EXPENSE", {"amount": 20.0, "currency": "USD", "description": "netflix"}),
+    ("compre cafe por 3,5 euros", "EXPENSE", {"amount": 3.5, "currency": "EUR"}),
+    ("Me costó 2 mil el taxi", "EXPENSE", {"amount": 2000.0}),
+    ("gasté $12 en almuerzo", "EXPENSE", {"amount": 12.0, "description": "almuerzo"}),
+    ("ayer gasté 45 en nafta", "EXPENSE", {"amount": 45.0, "description": "nafta"}),
+    ("pagué la luz 3.500", "EXPENSE", {"amount": 3500.0, "description": "luz"}),
+    ("Compré zapatillas en 80 usd", "EXPENSE", {"amount": 80.0, "currency": "USD"}),
+    ("gasto 15 en farmacia", "EXPENSE", {"amount": 15.0, "description": "farmacia"}),
+    ("comprar leche mañana", "TASK", {"when": "2024-03-12"}),
+    ("Tengo que llamar a mamá el viernes", "TASK", {"description": "Llamar a mamá el viernes", "when": "2024-03-15"}),
+    ("recordarme pagar el alquiler el 5/4", "TASK", {"when": "2024-04-05"}),
+    ("Llamar al dentista", "TASK", {"description": "Llamar al dentista"}),
+    ("hay que renovar el pasaporte", "TASK", {}),
+    ("pagar la tarjeta 15 de marzo", "TASK", {"when": "2024-03-15"}),
+    ("Enviar el informe hoy", "TASK", {"when": "2024-03-11"}),
+    ("Nota: el wifi del depto es casa1234", "NOTE", {"content": "el wifi del depto es casa1234"}),
+    ("idea: app para dividir gastos", "NOTE", {"content": "app para dividir gastos"}),
+    ("Hola", "OTHER", {}),
+    ("¿Cuánto gasté este mes?", None, {}),
+    ("Quiero aprender a tocar la guitarra este año", None, {}),
+    ("Me siento cansado últimamente", None, {}),
+    ("Organizar el viaje a Europa: vuelos, hoteles y trenes", None, {}),
+    ("500", None, {}),
+    ("compré 2 entradas por 40 dólares", None, {}),
+    ("pagué 3 cuotas de 1500", None, {}),
+    ("compré 3 kilos de carne a 9000", None, {}),
+    ("gasté 500 en pizza y 200 en cerveza", None, {}),
+]
+
+def test():
+    handled = correct = 0
+    mistakes = []
+    for text, expected, expected_data in CORPUS:
+        result = classify(text, today=TODAY)
+        if result["confidence"] < FAST_PATH_THRESHOLD:
+            if expected is not None:
+                print(f"  LLM  {text!r} (esperado {expected}, confianza {result['confidence']})")
+            continue
+        handled += 1
+        data_ok = all(result["data"].get(k) == v for k, v in expected_data.items())
+        if result["category"] == expected and data_ok:
+            correct += 1
+        else:
+            mistakes.append((text, expected, result))
+
+    coverable = sum(1 for _, expected, _ in CORPUS if expected is not None)
+    print(f"Hit rate: {handled}/{len(CORPUS)} resueltos localmente ({handled / len(CORPUS):.0%}), "
+          f"{handled}/{coverable} de los resolubles")
+    print(f"Precisión: {correct}/{handled}")
+    for text, expected, result in mistakes:
+        print(f"  MAL  {text!r}: esperado {expected}, obtenido {result}")
+    assert not mistakes
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,43 @@
+import json
+
+from incremental_json import IncrementalJSONParser
+
+# Respuestas como las streamea el modelo: fences, llaves y comillas escapadas dentro de strings, emojis en \u
+REPLY = ('```json\n{"category": "EXPENSE", "data": {"amount": 12.5, "description": "pizza {grande}",'
+         ' "tags": ["a", "b"]}, "response": "Anotado \\"pizza\\" \\ud83c\\udf55\\nlisto", "confidence": 0.9,'
+         ' "done": true}\n```')
+EXPECTED = json.loads(REPLY[len("```json\n"):-len("\n```")])
+
+def feed_in(chunks):
+    """Alimenta el parser con `chunks`; devuelve los campos completados y cada valor parcial de "response"."""
+    parser = IncrementalJSONParser()
+    completed, partials = [], []
+    for chunk in chunks:
+        completed += parser.feed(chunk)
+        partials.append(parser.partial_string("response"))
+    return parser, completed, partials
+
+def test_every_split_gives_the_same_fields():
+    for cut in range(1, len(REPLY)):
+        parser, completed, _ = feed_in([REPLY[:cut], REPLY[cut:]])
+        assert completed == list(EXPECTED.items()), cut
+        assert parser.finished and parser.fields == EXPECTED
+
+def test_fields_complete_before_the_object_closes():
+    parser = IncrementalJSONParser()
+    head = REPLY[:REPLY.index('"response"')]
+    assert [key for key, _ in parser.feed(head)] == ["category", "data"]
+    assert not parser.finished
+
+def test_partial_response_only_grows():
+    _, _, partials = feed_in(list(REPLY))  # un carácter por chunk, cortando cada escape a la mitad
+    seen = [p for p in partials if p is not None]
+    assert seen[-1] == EXPECTED["response"]
+    for before, after in zip(seen, seen[1:]):
+        assert after.startswith(before), (before, after)
+    assert "\ud83c" not in "".join(seen)  # medio par sustituto nunca se emite
+
+if __name__ == "__main__":
+    test_every_split_gives_the_same_fields()
+    test_fields_complete_before_the_object_closes()
+    test_partial_response_only_grows()
@@ -0,0 +1,75 @@
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+
+import page_cache
+
+def fresh():
+    """Vacía la página publicada (estado de módulo) para que cada test arranque de cero."""
+    page_cache._current = None
+
+def test_etag_follows_the_content():
+    fresh()
+    first = page_cache.publish("<p>uno</p>")
+    assert page_cache.current() is first
+    assert page_cache.publish("<p>uno</p>") is first  # misma página: no cambia ni la generación ni el ETag
+    second = page_cache.publish("<p>dos</p>")
+    assert second.etag != first.etag and second.generation == first.generation + 1
+    assert page_cache.current() is second
+
+def test_encoded_follows_accept_encoding():
+    fresh()
+    page = page_cache.publish("<p>" + "hola " * 200 + "</p>")
+    body, encoding = page.encoded("gzip, deflate")
+    assert encoding == "gzip" and gzip.decompress(body) == page.body
+    assert page.encoded("") == (page.body, None)
+    if page_cache.brotli is not None:
+        assert page.encoded("gzip, br;q=1.0")[1] == "br"
+
+def test_readers_never_see_a_half_published_page():
+    fresh()
+    pages = [f"<p>{n}</p>" * 500 for n in range(50)]
+    torn = []
+    start = page_cache._generation
+
+    def reader(stop):
+        while not stop.is_set():
+            page = page_cache.current()
+            if page is not None and ('"' + hashlib.sha256(page.body).hexdigest()[:32] + '"' != page.etag
+                                     or gzip.decompress(page.gzip) != page.body):
+                torn.append(page)
+
+    stop = threading.Event()
+    readers = [threading.Thread(target=reader, args=(stop,)) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    writers = [threading.Thread(target=lambda html=html: page_cache.publish(html)) for html in pages]
+    for thread in writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    stop.set()
+    for thread in readers:
+        thread.join()
+    assert not torn
+    assert page_cache.current().generation == start + len(pages)  # ninguna publicación se pisó con otra
+
+def test_write_atomic_and_load_from_disk():
+    fresh()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "dashboard.html")
+        page_cache.write_atomic(path, "<p>del disco</p>".encode("utf-8"))
+        assert os.listdir(directory) == ["dashboard.html"]  # el temporal se renombró, no quedó suelto
+        page = page_cache.load_from_disk(path)
+        assert page.body == "<p>del disco</p>".encode("utf-8")
+        assert page_cache.load_from_disk(path) is page  # ya hay una publicada: no se relee
+        page_cache.write_atomic(path, "<p>nueva</p>".encode("utf-8"))
+        assert page_cache.load_from_disk(path, force=True).body == "<p>nueva</p>".encode("utf-8")
+
+if __name__ == "__main__":
+    test_etag_follows_the_content()
+    test_encoded_follows_accept_encoding()
+    test_readers_never_see_a_half_published_page()
+    test_write_atomic_and_load_from_disk()
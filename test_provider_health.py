@@ -0,0 +1,65 @@
+import time
+
+import ai
+from ai import ProviderHealth
+
+class RateLimited(Exception):
+    status_code = 429
+
+def fail(health, times=1):
+    for _ in range(times):
+        health.record_failure(ConnectionError("caída"), 0.1)
+
+def providers(*health):
+    """Reemplaza la cadena de proveedores por `health`; devuelve la original para restaurarla."""
+    original = dict(ai.PROVIDERS)
+    ai.PROVIDERS.clear()
+    ai.PROVIDERS.update({h.name: h for h in health})
+    return original
+
+def restore(original):
+    ai.PROVIDERS.clear()
+    ai.PROVIDERS.update(original)
+
+def test_opens_after_consecutive_failures_and_closes_on_success():
+    health = ProviderHealth("a", None, 1)
+    fail(health, ai.AI_CIRCUIT_FAILURE_THRESHOLD - 1)
+    assert not health.is_open()
+    fail(health)
+    assert health.is_open() and health.circuit_openings == 1
+    health.record_success(0.1)
+    assert not health.is_open() and health.consecutive_failures == 0 and health.circuit_openings == 0
+
+def test_cooldown_grows_while_it_keeps_failing():
+    health = ProviderHealth("a", None, 1)
+    fail(health, ai.AI_CIRCUIT_FAILURE_THRESHOLD)
+    cooldowns = [health.open_until - time.monotonic()]
+    for _ in range(2):
+        fail(health)  # la prueba half-open vuelve a fallar
+        cooldowns.append(health.open_until - time.monotonic())
+    assert cooldowns[0] < cooldowns[1] < cooldowns[2] <= ai.AI_CIRCUIT_MAX_COOLDOWN
+
+def test_rate_limit_opens_immediately():
+    health = ProviderHealth("a", None, 1)
+    health.record_failure(RateLimited("429"), 0.1)
+    assert health.is_open() and health.rate_limited == 1
+
+def test_ordered_providers_skip_open_circuits():
+    first, second = ProviderHealth("a", None, 1), ProviderHealth("b", None, 2)
+    original = providers(first, second)
+    try:
+        assert [name for name, _ in ai.ordered_providers()] == ["a", "b"]
+        first.record_failure(RateLimited("429"), 0.1)
+        assert [name for name, _ in ai.ordered_providers()] == ["b"]
+        second.record_failure(RateLimited("429"), 0.1)
+        second.open_until = first.open_until + 60
+        # Todos abiertos: se prueba el que antes se vuelve a cerrar (half-open)
+        assert [name for name, _ in ai.ordered_providers()] == ["a"]
+    finally:
+        restore(original)
+
+if __name__ == "__main__":
+    test_opens_after_consecutive_failures_and_closes_on_success()
+    test_cooldown_grows_while_it_keeps_failing()
+    test_rate_limit_opens_immediately()
+    test_ordered_providers_skip_open_circuits()
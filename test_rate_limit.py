@@ -0,0 +1,61 @@
+import asyncio
+
+from rate_limit import AdmissionQueue, Anonymous, Overloaded
+
+async def serve(queue, users):
+    """Manda un mensaje por cada usuario de `users` (en ese orden) con un solo lugar activo; devuelve el orden de atención."""
+    served = []
+    gate = asyncio.Event()
+
+    async def message(user):
+        async with queue.slot(user):
+            served.append(user)
+            await gate.wait()
+
+    tasks = []
+    for user in users:
+        tasks.append(asyncio.create_task(message(user)))
+        await asyncio.sleep(0)  # que se encolen en el orden dado
+    gate.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return served, [task.exception() for task in tasks]
+
+def test_users_take_turns():
+    queue = AdmissionQueue(max_active=1, max_queued=20, max_queued_per_user=10)
+    served, _ = asyncio.run(serve(queue, ["a", "a", "a", "a", "b", "c"]))
+    # El primero de "a" ya estaba activo; después se alternan: "a" no deja esperando a "b" ni a "c"
+    assert served == ["a", "a", "b", "c", "a", "a"]
+    assert queue.active == 0 and queue.queued == 0
+
+def test_per_user_cap_does_not_apply_to_anonymous():
+    queue = AdmissionQueue(max_active=1, max_queued=10, max_queued_per_user=2)
+    _, errors = asyncio.run(serve(queue, ["a"] * 4 + [Anonymous("10.0.0.1")] * 4))
+    rejected = [i for i, error in enumerate(errors) if isinstance(error, Overloaded)]
+    assert rejected == [3]  # "a" tiene uno activo y dos en cola; la IP no tiene tope propio
+    assert errors[3].reason == "user_queue_full" and errors[3].retry_after >= 1
+
+def test_full_queue_rejects_everyone():
+    queue = AdmissionQueue(max_active=1, max_queued=3, max_queued_per_user=10)
+    _, errors = asyncio.run(serve(queue, ["a", "b", "c", "d", "e"]))
+    assert [type(error).__name__ if error else None for error in errors] == [None, None, None, None, "Overloaded"]
+    assert errors[4].reason == "queue_full"
+
+def test_cancelled_waiter_gives_back_its_place():
+    async def scenario():
+        queue = AdmissionQueue(max_active=1, max_queued=10, max_queued_per_user=10)
+        await queue.acquire("a")
+        waiting = asyncio.create_task(queue.acquire("b"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        queued = queue.queued
+        queue.release()
+        return queued, queue.active
+
+    assert asyncio.run(scenario()) == (0, 0)
+
+if __name__ == "__main__":
+    test_users_take_turns()
+    test_per_user_cap_does_not_apply_to_anonymous()
+    test_full_queue_rejects_everyone()
+    test_cancelled_waiter_gives_back_its_place()
@@ -0,0 +1,72 @@
+from structured_output import parse, parse_data
+
+# Respuestas rotas como las mandan los modelos: (texto, categoría esperada, data esperada parcial).
+# Categoría None = no se puede confiar en la respuesta y hay que pedírsela a otro proveedor.
+CORPUS = [
+    # Fences, texto alrededor, comas colgando
+    ('```json\n{"category": "EXPENSE", "data": {"amount": 500, "description": "pizza", "currency": "ARS"},'
+     ' "response": "Anotado"}\n```', "EXPENSE", {"amount": 500.0, "currency": "ARS"}),
+    ('Claro! {"category": "NOTE", "data": {"content": "wifi casa1234",}, "response": "Listo",} Saludos',
+     "NOTE", {"content": "wifi casa1234"}),
+    ('{"category": "TASK", "data": {"description": "Llamar\na mamá"}, "response": "Ok"}',
+     "TASK", {"description": "Llamar\na mamá"}),
+    # Truncadas: el último valor a medias se descarta, no se cierra
+    ('{"category": "EXPENSE", "data": {"amount": 1', None, {}),
+    ('{"category": "EXPENSE", "data": {"amount": 12.', None, {}),
+    ('{"category": "EXPENSE", "data": {"amount": 150, "description": "super", "currency": "AR', None, {}),
+    ('{"category": "EXPENSE", "data": {"amount": 150, "description": "super", "curr', None, {}),
+    ('{"category": "EXPENSE", "data": {"amount": 150, "description": "super", "currency": "ARS"}, "response": "Anot',
+     "EXPENSE", {"amount": 150.0, "description": "super", "currency": "ARS"}),
+    ('{"category": "TASK", "data": {"description": "pagar la luz", "deadline": "2024-03-',
+     "TASK", {"description": "pagar la luz", "deadline": None}),
+    ('{"category": "TASK", "data": {"description": "pagar la l', None, {}),
+    ('{"category": "PLANNING", "data": {"goal": "viaje", "steps": ["vuelos", "hotel", "tre',
+     "PLANNING", {"goal": "viaje", "steps": ["vuelos", "hotel"]}),
+    ('{"category": "NOTE", "data": {"content": "idea"}, "response": "Listo", "extra": tr',
+     "NOTE", {"content": "idea"}),
+    ('{"categ', None, {}),
+    # Alias: la clave canónica y los alias fuertes le ganan a los débiles
+    ('{"categoria": "GASTO", "datos": {"descripcion": "entradas", "cantidad": 2, "monto": 40, "moneda": "usd"}}',
+     "EXPENSE", {"amount": 40.0, "description": "entradas", "currency": "USD"}),
+    ('{"category": "EXPENSE", "data": {"precio": 10, "total": 30, "description": "3 cafés", "currency": "EUR"}}',
+     "EXPENSE", {"amount": 30.0}),
+    ('{"category": "EXPENSE", "data": {"valor": 5, "amount": 7, "description": "taxi"}}',
+     "EXPENSE", {"amount": 7.0}),
+    ('{"category": "EXPENSE", "amount": "1.500,50", "description": "super", "currency": "pesos"}',
+     "EXPENSE", {"amount": 1500.5, "currency": "ARS"}),
+    # Fechas: ISO o algo que fast_path entienda; lo demás queda sin fecha
+    ('{"category": "TASK", "data": {"description": "dentista", "deadline": "pronto"}}',
+     "TASK", {"deadline": None}),
+    ('{"category": "TASK", "data": {"description": "dentista", "deadline": "2024-02-30"}}',
+     "TASK", {"deadline": None}),
+    ('{"category": "TASK", "data": {"description": "dentista", "deadline": "2024-03-15T10:00:00Z"}}',
+     "TASK", {"deadline": "2024-03-15"}),
+    ('{"category": "TASK", "data": {"description": "dentista", "fecha": "15/03/2024"}}',
+     "TASK", {"deadline": "2024-03-15"}),
+    ("Lo siento, no entendí", None, {}),
+]
+
+def test():
+    mistakes = []
+    for text, expected, expected_data in CORPUS:
+        result = parse(text)
+        if expected is None:
+            if result is not None:
+                mistakes.append((text, expected, result))
+            continue
+        data = result.data.model_dump() if result is not None else {}
+        if result is None or result.category != expected or any(data.get(k) != v for k, v in expected_data.items()):
+            mistakes.append((text, expected, result))
+    for text, expected, result in mistakes:
+        print(f"  MAL  {text!r}: esperado {expected}, obtenido {result!r}")
+    assert not mistakes
+
+def test_parse_data():
+    # El mismo criterio para la data cruda del parser incremental (/api/chat/stream)
+    assert parse_data("GASTO", {"cantidad": 2, "importe": "40"}).amount == 40.0
+    assert parse_data("TASK", {"description": "x", "deadline": 20240315}).deadline == "2024-03-15"
+    assert parse_data("TASK", {"description": "x", "deadline": ["2024"]}).deadline is None
+
+if __name__ == "__main__":
+    test()
+    test_parse_data()
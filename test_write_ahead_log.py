@@ -0,0 +1,141 @@
+import asyncio
+import os
+import tempfile
+
+import write_ahead_log
+from write_ahead_log import WriteAheadLog, Replayer
+
+class Rejected(Exception):
+    status_code = 400
+
+class FakeSupabase:
+    """Insert idempotente por clave, como on_conflict=idempotency_key; `fail` decide qué intentos fallan."""
+
+    def __init__(self, fail=None):
+        self.rows = {}
+        self.calls = []
+        self.fail = fail or (lambda row, attempt: None)
+
+    async def insert(self, table, row, key):
+        self.calls.append(row["n"])
+        await asyncio.sleep(0.001 * (row["n"] % 3))  # que terminen desordenadas si se mandan en paralelo
+        error = self.fail(row, self.calls.count(row["n"]))
+        if error == "timeout_after_write":
+            self.rows.setdefault(key, row)
+            raise asyncio.TimeoutError("timeout esperando la respuesta")
+        if error:
+            raise error
+        self.rows.setdefault(key, row)
+
+def run(scenario):
+    """Corre scenario(wal) contra un WAL en un directorio temporal, sin backoff entre reintentos."""
+    retry_base = write_ahead_log.WAL_RETRY_BASE
+    write_ahead_log.WAL_RETRY_BASE = 0
+    with tempfile.TemporaryDirectory() as directory:
+        wal = WriteAheadLog(os.path.join(directory, "wal.db"), sync="off")
+        try:
+            return asyncio.run(scenario(wal))
+        finally:
+            wal.close()
+            write_ahead_log.WAL_RETRY_BASE = retry_base
+
+async def replay_all(replayer, rounds=20):
+    for _ in range(rounds):
+        await replayer.replay_once()
+        if not (await replayer.wal.stats())["queue_depth"]:
+            return
+
+def test_per_user_order():
+    async def scenario(wal):
+        supabase = FakeSupabase()
+        await wal.append_many("notes", [{"user_id": 1 + n % 2, "n": n} for n in range(10)])
+        await replay_all(Replayer(wal, supabase.insert))
+        return supabase
+
+    supabase = run(scenario)
+    for user in (1, 2):
+        stored = [row["n"] for row in supabase.rows.values() if row["user_id"] == user]
+        assert stored == sorted(stored) and len(stored) == 5, stored
+
+def test_failure_holds_back_the_rest_of_the_user():
+    async def scenario(wal):
+        supabase = FakeSupabase(fail=lambda row, attempt: ConnectionError("caída") if row["n"] == 0 and attempt < 3 else None)
+        await wal.append_many("notes", [{"user_id": 1, "n": n} for n in range(3)] + [{"user_id": 2, "n": 3}])
+        replayer = Replayer(wal, supabase.insert)
+        await replayer.replay_once()
+        first_round = list(supabase.calls)
+        await replay_all(replayer)
+        return supabase, replayer, first_round
+
+    supabase, replayer, first_round = run(scenario)
+    assert sorted(first_round) == [0, 3]  # el 1 y el 2 esperan al 0; el otro usuario no
+    assert [row["n"] for row in supabase.rows.values() if row["user_id"] == 1] == [0, 1, 2]
+    assert replayer.failures == 2 and replayer.replayed == 4
+
+def test_blocked_user_does_not_starve_the_rest():
+    async def scenario(wal):
+        supabase = FakeSupabase(fail=lambda row, attempt: ConnectionError("caída") if row["n"] == 0 else None)
+        await wal.append_many("notes", [{"user_id": 1, "n": n} for n in range(300)] + [{"user_id": 2, "n": 300}])
+        replayer = Replayer(wal, supabase.insert, batch=50)
+        write_ahead_log.WAL_RETRY_BASE = 60  # el 0 queda en backoff y retiene al resto del usuario 1
+        await replayer.replay_once()
+        await replayer.replay_once()
+        return supabase
+
+    supabase = run(scenario)
+    assert [row["n"] for row in supabase.rows.values()] == [300]
+    assert supabase.calls.count(0) == 1
+
+def test_idempotent_resend():
+    async def scenario(wal):
+        supabase = FakeSupabase(fail=lambda row, attempt: "timeout_after_write" if attempt == 1 else None)
+        await wal.append("expenses", {"user_id": 1, "n": 0})
+        await replay_all(Replayer(wal, supabase.insert))
+        return supabase, await wal.stats()
+
+    supabase, stats = run(scenario)
+    assert supabase.calls == [0, 0]  # se reenvió después del timeout...
+    assert len(supabase.rows) == 1  # ...pero con la misma clave, así que quedó una sola fila
+    assert stats["queue_depth"] == 0
+
+def test_dead_letter():
+    async def scenario(wal):
+        supabase = FakeSupabase(fail=lambda row, attempt: Rejected("columna inválida") if row["n"] == 0
+                                else ConnectionError("caída") if row["n"] == 2 else None)
+        await wal.append_many("tasks", [{"user_id": 1, "n": 0}, {"user_id": 1, "n": 1}, {"user_id": 2, "n": 2}])
+        replayer = Replayer(wal, supabase.insert)
+        await replay_all(replayer, rounds=write_ahead_log.WAL_MAX_ATTEMPTS + 5)
+        return supabase, replayer, await wal.stats(), await wal.dead_letters()
+
+    supabase, replayer, stats, dead = run(scenario)
+    assert supabase.calls.count(0) == 1  # un 4xx no se reintenta...
+    assert [row["n"] for row in supabase.rows.values()] == [1]  # ...ni retiene al resto del usuario
+    assert supabase.calls.count(2) == write_ahead_log.WAL_MAX_ATTEMPTS
+    assert stats["queue_depth"] == 0 and stats["dead_letter"] == 2 and replayer.dead_lettered == 2
+    assert sorted(entry["row"]["n"] for entry in dead) == [0, 2]
+
+def test_reconcile_sees_unreplayed_rows_once():
+    async def scenario(wal):
+        supabase = FakeSupabase()
+        await wal.append_many("notes", [{"user_id": 1, "n": 0}, {"user_id": 2, "n": 1}])
+        replayer = Replayer(wal, supabase.insert)
+        async with wal.replay_lock():  # la reconciliación consultando Supabase
+            replay = asyncio.create_task(replayer.replay_once())
+            await asyncio.sleep(0.05)
+            during = dict(supabase.rows), await wal.unsaved(), await wal.unsaved(user_id=2)
+        await replay
+        return during, supabase, await wal.unsaved()
+
+    (stored, unsaved, of_user), supabase, after = run(scenario)
+    assert stored == {}  # el replay esperó a que terminara la consulta
+    assert [entry["row"]["n"] for entry in unsaved] == [0, 1] and unsaved[0]["created_at"]
+    assert [entry["row"]["n"] for entry in of_user] == [1]
+    assert len(supabase.rows) == 2 and after == []
+
+if __name__ == "__main__":
+    test_per_user_order()
+    test_failure_holds_back_the_rest_of_the_user()
+    test_blocked_user_does_not_starve_the_rest()
+    test_idempotent_resend()
+    test_dead_letter()
+    test_reconcile_sees_unreplayed_rows_once()
@@ -0,0 +1,69 @@
+import asyncio
+
+from write_behind import WriteBehindBuffer
+
+class Rejected(Exception):
+    status_code = 400
+
+class Unavailable(Exception):
+    status_code = 503
+
+class FakeTable:
+    """insert_rows que rechaza el lote entero si alguna fila es mala, como PostgREST; `error` dice con qué."""
+
+    def __init__(self, error=Rejected):
+        self.batches = []
+        self.error = error
+
+    async def insert(self, rows):
+        self.batches.append([row["n"] for row in rows])
+        if any(row.get("bad") for row in rows):
+            raise self.error("fila inválida")
+        return [{**row, "id": row["n"]} for row in rows]
+
+async def submit_all(buffer, rows):
+    return await asyncio.gather(*(buffer.submit(row) for row in rows), return_exceptions=True)
+
+def test_concurrent_inserts_share_a_batch():
+    async def scenario():
+        table = FakeTable()
+        buffer = WriteBehindBuffer("notes", table.insert, max_batch=10, flush_interval=0.01)
+        results = await submit_all(buffer, [{"n": n} for n in range(25)])
+        await buffer.close()
+        return table, results
+
+    table, results = asyncio.run(scenario())
+    assert [len(batch) for batch in table.batches] == [10, 10, 5]
+    assert [row["id"] for row in results] == list(range(25))  # cada llamador recibe su propia fila
+
+def test_rejected_batch_is_split_to_isolate_the_bad_row():
+    async def scenario():
+        table = FakeTable(error=Rejected)
+        buffer = WriteBehindBuffer("notes", table.insert, max_batch=5, flush_interval=0.01)
+        results = await submit_all(buffer, [{"n": n, "bad": n == 2} for n in range(5)])
+        await buffer.close()
+        return table, buffer, results
+
+    table, buffer, results = asyncio.run(scenario())
+    assert table.batches == [[0, 1, 2, 3, 4], [0], [1], [2], [3], [4]]
+    assert isinstance(results[2], Rejected)
+    assert [row["id"] for i, row in enumerate(results) if i != 2] == [0, 1, 3, 4]
+    assert buffer.failures == 1 and buffer.rows_written == 4
+
+def test_unavailable_database_fails_the_batch_without_splitting():
+    async def scenario():
+        table = FakeTable(error=Unavailable)
+        buffer = WriteBehindBuffer("notes", table.insert, max_batch=5, flush_interval=0.01)
+        results = await submit_all(buffer, [{"n": n, "bad": n == 2} for n in range(5)])
+        await buffer.close()
+        return table, buffer, results
+
+    table, buffer, results = asyncio.run(scenario())
+    assert table.batches == [[0, 1, 2, 3, 4]]  # fila por fila no arreglaría un 5xx y multiplicaría la carga
+    assert all(isinstance(result, Unavailable) for result in results)
+    assert buffer.failures == 5
+
+if __name__ == "__main__":
+    test_concurrent_inserts_share_a_batch()
+    test_rejected_batch_is_split_to_isolate_the_bad_row()
+    test_unavailable_database_fails_the_batch_without_splitting()
@@ -0,0 +1,347 @@
+"""
+Trazas por request, livianas y sin dependencias.
+
+Cada request HTTP abre una traza (TraceMiddleware) y el código marca tramos con
+`span("nombre", atributo=valor)` o el decorador `traced`. El span actual viaja
+en un contextvar, así las tareas creadas dentro del request (los proveedores
+que corren en paralelo) cuelgan solas del span correcto.
+
+Al cerrar la traza un sampler decide si se guarda: siempre los errores y la
+cola lenta (más de TRACE_SLOW_THRESHOLD o por encima del p99 reciente), y el
+resto con probabilidad TRACE_SAMPLE_RATE. Lo guardado se exporta en segundo
+plano como JSON de OTLP (el mismo formato que acepta un OpenTelemetry
+Collector en /v1/traces): una línea por lote en TRACE_FILE, o un POST a
+TRACE_OTLP_ENDPOINT si está configurado.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import functools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_SLOW_THRESHOLD = float(os.getenv("TRACE_SLOW_THRESHOLD", "2.0"))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")  # p. ej. http://localhost:4318/v1/traces
+TRACE_EXPORT_INTERVAL = float(os.getenv("TRACE_EXPORT_INTERVAL", "2.0"))
+TRACE_MAX_PENDING = int(os.getenv("TRACE_MAX_PENDING", "1000"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))
+SERVICE_NAME = os.getenv("SERVICE_NAME", "secondb")
+
+# Tipos de span de OTLP
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+_current_span = ContextVar("current_span", default=None)
+
+class Trace:
+    __slots__ = ("trace_id", "spans", "finished", "dropped")
+
+    def __init__(self, trace_id: str = None):
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.spans = []
+        self.finished = False
+        self.dropped = 0
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "events", "links", "status", "status_message")
+
+    def __init__(self, trace: Trace, name: str, parent_id: str = None, kind: int = KIND_INTERNAL,
+                 attributes: dict = None, links: list = None):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.links = links or []
+        self.status = STATUS_UNSET
+        self.status_message = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add_event(self, name: str, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    @property
+    def duration(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        trace = self.trace
+        if trace.finished:
+            return  # terminó después que su raíz (p. ej. una tarea cancelada): la traza ya salió
+        if len(trace.spans) < TRACE_MAX_SPANS:
+            trace.spans.append(self)
+        else:
+            trace.dropped += 1
+
+def current_span():
+    return _current_span.get()
+
+def current_context():
+    """(trace_id, span_id) del span actual, para enlazarlo desde trabajo diferido."""
+    span = _current_span.get()
+    return (span.trace.trace_id, span.span_id) if span else None
+
+@contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, **attributes):
+    """Tramo hijo del span actual. Fuera de una traza no hace nada (y casi no cuesta)."""
+    parent = _current_span.get()
+    if parent is None or not TRACING_ENABLED:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, kind, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+        if child.status == STATUS_UNSET:
+            child.status = STATUS_OK
+    except asyncio.CancelledError:
+        child.set(cancelled=True)
+        raise
+    except BaseException as e:
+        child.status = STATUS_ERROR
+        child.status_message = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+@contextmanager
+def start_trace(name: str, kind: int = KIND_INTERNAL, trace_id: str = None, parent_id: str = None,
+                links: list = None, **attributes):
+    """Abre una traza nueva (o continúa una remota con trace_id/parent_id) y la exporta al cerrarla."""
+    if not TRACING_ENABLED:
+        yield None
+        return
+    root = Span(Trace(trace_id), name, parent_id, kind, attributes, links)
+    token = _current_span.set(root)
+    try:
+        yield root
+        if root.status == STATUS_UNSET:
+            root.status = STATUS_OK
+    except BaseException as e:
+        root.status = STATUS_ERROR
+        root.status_message = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        _current_span.reset(token)
+        root.end()
+        root.trace.finished = True
+        exporter.finish(root)
+
+def start_span(name: str, kind: int = KIND_INTERNAL, **attributes):
+    """
+    Span hijo del actual que NO pasa a ser el actual; se cierra con end_span.
+    Para tramos que cruzan yields de un generador, donde un contextvar no sirve.
+    """
+    parent = _current_span.get()
+    if parent is None or not TRACING_ENABLED:
+        return None
+    return Span(parent.trace, name, parent.span_id, kind, attributes)
+
+def end_span(s, error: BaseException = None, **attributes):
+    if s is None:
+        return
+    s.set(**attributes)
+    if error is not None:
+        s.status = STATUS_ERROR
+        s.status_message = f"{type(error).__name__}: {error}"[:300]
+    elif s.status == STATUS_UNSET:
+        s.status = STATUS_OK
+    s.end()
+
+def add_event(name: str, **attributes):
+    s = _current_span.get()
+    if s is not None:
+        s.add_event(name, **attributes)
+
+def traced(name: str, kind: int = KIND_INTERNAL):
+    """Decorador para corutinas: envuelve cada llamada en un span."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name, kind):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- Sampler y exportación ---
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+def _otlp_span(s: Span) -> dict:
+    data = {
+        "traceId": s.trace.trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": s.kind,
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns),
+        "attributes": [_attribute(k, v) for k, v in s.attributes.items() if v is not None],
+        "status": {"code": s.status, **({"message": s.status_message} if s.status_message else {})},
+    }
+    if s.parent_id:
+        data["parentSpanId"] = s.parent_id
+    if s.events:
+        data["events"] = [{"timeUnixNano": str(t), "name": n, "attributes": [_attribute(k, v) for k, v in a.items()]}
+                          for t, n, a in s.events]
+    if s.links:
+        data["links"] = [{"traceId": trace_id, "spanId": span_id} for trace_id, span_id in s.links]
+    return data
+
+def to_otlp(traces: list) -> dict:
+    """Lote de trazas -> ExportTraceServiceRequest en JSON."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+        "scopeSpans": [{"scope": {"name": "tracing"},
+                        "spans": [_otlp_span(s) for trace in traces for s in trace.spans]}],
+    }]}
+
+class Exporter:
+    """Decide qué trazas se guardan y las exporta en lotes desde una tarea en segundo plano."""
+
+    def __init__(self):
+        self.pending = deque(maxlen=TRACE_MAX_PENDING)
+        self.recent = deque(maxlen=1000)  # duraciones recientes, para el p99 del sampler
+        self.finished = 0
+        self.sampled = 0
+        self.exported = 0
+        self.failures = 0
+        self._worker = None
+        self._client = None
+
+    def _tail_threshold(self) -> float:
+        if len(self.recent) < 100:
+            return TRACE_SLOW_THRESHOLD
+        ordered = sorted(self.recent)
+        return min(TRACE_SLOW_THRESHOLD, ordered[int(len(ordered) * 0.99)])
+
+    def should_keep(self, root: Span) -> bool:
+        duration = root.duration
+        keep = (root.status == STATUS_ERROR
+                or duration >= self._tail_threshold()
+                or random.random() < TRACE_SAMPLE_RATE)
+        self.recent.append(duration)
+        return keep
+
+    def finish(self, root: Span):
+        self.finished += 1
+        if not self.should_keep(root):
+            return
+        self.sampled += 1
+        if root.duration >= TRACE_SLOW_THRESHOLD:
+            logging.warning(f"Request lento ({root.duration:.2f}s): {root.name} trace_id={root.trace.trace_id}")
+        self.pending.append(root.trace)
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run(), context=contextvars.Context())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(TRACE_EXPORT_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch = list(self.pending)
+        self.pending.clear()
+        payload = to_otlp(batch)
+        try:
+            if TRACE_OTLP_ENDPOINT:
+                if self._client is None:
+                    self._client = httpx.AsyncClient(timeout=5)
+                response = await self._client.post(TRACE_OTLP_ENDPOINT, json=payload)
+                response.raise_for_status()
+            elif TRACE_FILE:
+                await asyncio.to_thread(self._append_file, json.dumps(payload, ensure_ascii=False))
+            self.exported += len(batch)
+        except Exception as e:
+            self.failures += 1
+            logging.error(f"No se pudieron exportar {len(batch)} trazas: {e}")
+
+    def _append_file(self, line: str):
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await self.flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {"enabled": TRACING_ENABLED, "finished": self.finished, "sampled": self.sampled,
+                "exported": self.exported, "pending": len(self.pending), "failures": self.failures,
+                "tail_threshold_seconds": round(self._tail_threshold(), 3)}
+
+exporter = Exporter()
+
+def _parse_traceparent(header: str):
+    """W3C traceparent "00-<trace_id>-<span_id>-<flags>" -> (trace_id, span_id) o (None, None)."""
+    parts = (header or "").split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        return parts[1], parts[2]
+    return None, None
+
+class TraceMiddleware:
+    """Middleware ASGI: una traza por request HTTP, que cubre también el cuerpo en streaming."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or [])
+        trace_id, parent_id = _parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        with start_trace(f"{scope['method']} {scope['path']}", KIND_SERVER, trace_id, parent_id,
+                         **{"http.method": scope["method"], "http.target": scope["path"]}) as root:
+            async def send_with_trace_id(message):
+                if message["type"] == "http.response.start":
+                    root.set(**{"http.status_code": message["status"]})
+                    if message["status"] >= 500:
+                        root.status = STATUS_ERROR
+                    message = {**message, "headers": list(message.get("headers") or [])
+                               + [(b"x-trace-id", root.trace.trace_id.encode())]}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            finally:
+                route = scope.get("route")
+                if route is not None:
+                    root.name = f"{scope['method']} {route.path}"
+                    root.set(**{"http.route": route.path})
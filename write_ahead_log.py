@@ -0,0 +1,337 @@
+"""
+Write-ahead log local (SQLite) para los inserts hacia Supabase.
+
+Cada insert se agrega primero al log y se confirma en disco; recién después
+un replayer en segundo plano lo manda a Supabase con reintentos y backoff.
+Cada entrada lleva una clave de idempotencia, así un reintento después de un
+timeout no duplica la fila. Las entradas de un mismo usuario se reproducen en
+orden, una detrás de otra: si una falla, las siguientes de ese usuario esperan
+a que pase. Una entrada que Supabase rechaza (4xx) o que agota WAL_MAX_ATTEMPTS
+intentos pasa a la tabla wal_dead_letter para revisarla a mano, así no retiene
+para siempre al resto del usuario.
+
+WAL_SYNC controla la política de fsync (PRAGMA synchronous de SQLite):
+  full   -> fsync en cada append (no se pierde nada ante un corte de luz)
+  normal -> fsync en los checkpoints (puede perder los últimos ms ante un corte)
+  off    -> sin fsync (sólo sobrevive a un crash del proceso)
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import sqlite3
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+WAL_PATH = os.getenv("WAL_PATH", "write_ahead_log.db")
+WAL_SYNC = os.getenv("WAL_SYNC", "full").lower()
+WAL_REPLAY_BATCH = int(os.getenv("WAL_REPLAY_BATCH", "200"))
+WAL_REPLAY_PER_USER = int(os.getenv("WAL_REPLAY_PER_USER", "20"))  # por ronda, para que nadie acapare la tanda
+WAL_REPLAY_INTERVAL = float(os.getenv("WAL_REPLAY_INTERVAL", "1.0"))
+WAL_RETRY_BASE = float(os.getenv("WAL_RETRY_BASE", "1.0"))
+WAL_RETRY_MAX = float(os.getenv("WAL_RETRY_MAX", "300"))
+WAL_MAX_ATTEMPTS = int(os.getenv("WAL_MAX_ATTEMPTS", "20"))
+
+SYNC_MODES = {"full": "FULL", "normal": "NORMAL", "off": "OFF"}
+
+def is_rejected(error: Exception) -> bool:
+    """Supabase rechazó la fila (4xx): reintentarla no la va a arreglar. 408 y 429 sí son transitorios."""
+    status = getattr(error, "status_code", None)
+    return status is not None and 400 <= status < 500 and status not in (408, 429)
+
+class WriteAheadLog:
+    """Log append-only en SQLite. Todo el acceso pasa por un único hilo dedicado."""
+
+    def __init__(self, path: str = WAL_PATH, sync: str = WAL_SYNC):
+        self.path = path
+        self.sync = SYNC_MODES.get(sync, "FULL")
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="wal")
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(f"PRAGMA synchronous={self.sync}")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS wal (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    table_name TEXT NOT NULL,
+                    user_id TEXT,
+                    idempotency_key TEXT NOT NULL UNIQUE,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    last_error TEXT
+                )""")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS wal_dead_letter (
+                    seq INTEGER PRIMARY KEY,
+                    table_name TEXT NOT NULL,
+                    user_id TEXT,
+                    idempotency_key TEXT NOT NULL UNIQUE,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    last_error TEXT,
+                    failed_at REAL NOT NULL
+                )""")
+            self._db.commit()
+        return self._db
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _append(self, table: str, row: dict, key: str):
+        db = self._connect()
+        cursor = db.execute(
+            "INSERT INTO wal (table_name, user_id, idempotency_key, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+            (table, str(row.get("user_id")), key, json.dumps(row), time.time()))
+        db.commit()
+        return cursor.lastrowid
+
+    async def append(self, table: str, row: dict) -> str:
+        """Persiste la entrada y devuelve su clave de idempotencia cuando ya es durable."""
+        key = str(uuid.uuid4())
+        await self._run(self._append, table, row, key)
+        return key
+
+    def _append_many(self, table: str, rows: list, keys: list):
+        db = self._connect()
+        now = time.time()
+        db.executemany(
+            "INSERT INTO wal (table_name, user_id, idempotency_key, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(table, str(row.get("user_id")), key, json.dumps(row), now) for row, key in zip(rows, keys)])
+        db.commit()
+
+    async def append_many(self, table: str, rows: list) -> list:
+        """Como append pero para varias filas en una sola transacción (un solo fsync)."""
+        keys = [str(uuid.uuid4()) for _ in rows]
+        await self._run(self._append_many, table, rows, keys)
+        return keys
+
+    def _pending(self, limit: int):
+        return self._connect().execute(
+            "SELECT seq, table_name, user_id, idempotency_key, payload, attempts, next_attempt_at "
+            "FROM wal ORDER BY seq LIMIT ?", (limit,)).fetchall()
+
+    async def pending(self, limit: int = WAL_REPLAY_BATCH):
+        rows = await self._run(self._pending, limit)
+        return [{"seq": r[0], "table": r[1], "user_id": r[2], "key": r[3], "row": json.loads(r[4]),
+                 "attempts": r[5], "next_attempt_at": r[6]} for r in rows]
+
+    def _unsaved(self, user_id):
+        if user_id is None:
+            return self._connect().execute(
+                "SELECT table_name, idempotency_key, payload, created_at FROM wal ORDER BY seq").fetchall()
+        return self._connect().execute(
+            "SELECT table_name, idempotency_key, payload, created_at FROM wal WHERE user_id = ? ORDER BY seq",
+            (str(user_id),)).fetchall()
+
+    async def unsaved(self, user_id=None) -> list:
+        """Todo lo que todavía no llegó a Supabase (de un usuario o de todos), en orden de llegada."""
+        rows = await self._run(self._unsaved, user_id)
+        return [{"table": r[0], "key": r[1], "row": json.loads(r[2]),
+                 "created_at": datetime.fromtimestamp(r[3], timezone.utc).isoformat()} for r in rows]
+
+    def _lock_replay(self):
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    @asynccontextmanager
+    async def replay_lock(self):
+        """
+        Excluye a los replays de todos los workers que comparten el WAL. La reconciliación del
+        dashboard lo toma mientras consulta Supabase y lee lo pendiente, así ninguna entrada
+        pasa de un lado al otro en el medio (no se pierde ni se cuenta dos veces).
+        """
+        acquire = asyncio.ensure_future(asyncio.to_thread(self._lock_replay))
+        try:
+            fd = await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            # El hilo sigue esperando el flock: si lo consigue, lo soltamos
+            acquire.add_done_callback(lambda task: task.cancelled() or task.exception() or os.close(task.result()))
+            raise
+        try:
+            yield
+        finally:
+            os.close(fd)  # cerrar el descriptor libera el flock
+
+    def _ready(self, now: float, limit: int, per_user: int):
+        # Sólo la primera entrada de un usuario puede estar en backoff (las siguientes la esperan): los usuarios
+        # bloqueados se saltean en SQL, así sus filas no ocupan la tanda de los demás
+        return self._connect().execute(
+            "SELECT seq, table_name, user_id, idempotency_key, payload, attempts, next_attempt_at FROM ("
+            "  SELECT *, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY seq) AS position FROM wal"
+            "  WHERE user_id NOT IN (SELECT user_id FROM wal WHERE next_attempt_at > ?)"
+            ") WHERE position <= ? ORDER BY seq LIMIT ?", (now, per_user, limit)).fetchall()
+
+    async def ready(self, limit: int = WAL_REPLAY_BATCH, per_user: int = WAL_REPLAY_PER_USER):
+        """Las entradas listas para reproducir: las primeras `per_user` de cada usuario que no está en backoff."""
+        rows = await self._run(self._ready, time.time(), limit, per_user)
+        return [{"seq": r[0], "table": r[1], "user_id": r[2], "key": r[3], "row": json.loads(r[4]),
+                 "attempts": r[5], "next_attempt_at": r[6]} for r in rows]
+
+    def _mark_done(self, seqs):
+        db = self._connect()
+        db.executemany("DELETE FROM wal WHERE seq = ?", [(s,) for s in seqs])
+        db.commit()
+
+    async def mark_done(self, seqs):
+        if seqs:
+            await self._run(self._mark_done, list(seqs))
+
+    def _mark_failed(self, seq: int, attempts: int, error: str, rejected: bool) -> bool:
+        db = self._connect()
+        if rejected or attempts + 1 >= WAL_MAX_ATTEMPTS:
+            db.execute(
+                "INSERT OR REPLACE INTO wal_dead_letter (seq, table_name, user_id, idempotency_key, payload, "
+                "created_at, attempts, last_error, failed_at) SELECT seq, table_name, user_id, idempotency_key, "
+                "payload, created_at, attempts + 1, ?, ? FROM wal WHERE seq = ?", (error[:500], time.time(), seq))
+            db.execute("DELETE FROM wal WHERE seq = ?", (seq,))
+            db.commit()
+            return True
+        delay = min(WAL_RETRY_BASE * (2 ** attempts), WAL_RETRY_MAX)
+        db.execute("UPDATE wal SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE seq = ?",
+                   (time.time() + delay, error[:500], seq))
+        db.commit()
+        return False
+
+    async def mark_failed(self, seq: int, attempts: int, error: str, rejected: bool = False) -> bool:
+        """Agenda el reintento con backoff, o la pasa a wal_dead_letter (devuelve True) si no tiene arreglo."""
+        return await self._run(self._mark_failed, seq, attempts, error, rejected)
+
+    def _dead_letters(self, limit: int):
+        return self._connect().execute(
+            "SELECT seq, table_name, user_id, idempotency_key, payload, attempts, last_error, failed_at "
+            "FROM wal_dead_letter ORDER BY seq DESC LIMIT ?", (limit,)).fetchall()
+
+    async def dead_letters(self, limit: int = 20) -> list:
+        """Las últimas entradas descartadas, para revisarlas (y reinsertarlas a mano si corresponde)."""
+        rows = await self._run(self._dead_letters, limit)
+        return [{"seq": r[0], "table": r[1], "user_id": r[2], "key": r[3], "row": json.loads(r[4]),
+                 "attempts": r[5], "last_error": r[6], "failed_at": r[7]} for r in rows]
+
+    def _stats(self):
+        db = self._connect()
+        count, oldest, retrying = db.execute(
+            "SELECT COUNT(*), MIN(created_at), SUM(CASE WHEN attempts > 0 THEN 1 ELSE 0 END) FROM wal").fetchone()
+        dead, = db.execute("SELECT COUNT(*) FROM wal_dead_letter").fetchone()
+        return {
+            "queue_depth": count,
+            "retrying": retrying or 0,
+            "dead_letter": dead,
+            "replay_lag_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+        }
+
+    async def stats(self) -> dict:
+        return await self._run(self._stats)
+
+    def close(self):
+        def _close():
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+        self._executor.submit(_close).result()
+        self._executor.shutdown(wait=True)
+
+class Replayer:
+    """Drena el WAL hacia Supabase. `insert(table, row)` debe ser idempotente por clave."""
+
+    def __init__(self, wal: WriteAheadLog, insert, interval: float = WAL_REPLAY_INTERVAL,
+                 batch: int = WAL_REPLAY_BATCH):
+        self.wal = wal
+        self.insert = insert
+        self.interval = interval
+        self.batch = batch
+        self._wakeup = None
+        self._worker = None
+        self.replayed = 0
+        self.failures = 0
+        self.dead_lettered = 0
+        self.last_error = None
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = self._wakeup or asyncio.Event()
+            # Contexto vacío: el worker sobrevive al request que lo arranca y no debe heredar su traza
+            self._worker = asyncio.get_running_loop().create_task(self._run(), context=contextvars.Context())
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                drained = await self.replay_once()
+            except Exception as e:
+                logging.error(f"Error reproduciendo el WAL: {e}")
+                drained = 0
+            if drained:
+                continue  # Puede haber más entradas listas: seguimos sin esperar
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def replay_once(self) -> int:
+        """Un ciclo de replay. Devuelve cuántas entradas se confirmaron."""
+        async with self.wal.replay_lock():
+            ready = {}  # usuario -> sus entradas listas, en orden de seq
+            for entry in await self.wal.ready(self.batch):
+                ready.setdefault(entry["user_id"], []).append(entry)
+            if not ready:
+                return 0
+
+            # Usuarios en paralelo (el write-behind los agrupa); las entradas de cada uno, en fila
+            results = await asyncio.gather(*(self._replay_user(entries) for entries in ready.values()))
+            # Un solo commit para todas (si se cae antes, se reenvían y la clave de idempotencia evita duplicados)
+            done = [seq for seqs in results for seq in seqs]
+            await self.wal.mark_done(done)
+        self.replayed += len(done)
+        return len(done)
+
+    async def _replay_user(self, entries: list) -> list:
+        done = []
+        for entry in entries:
+            try:
+                await self.insert(entry["table"], entry["row"], entry["key"])
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                dead = await self.wal.mark_failed(entry["seq"], entry["attempts"], str(e), rejected=is_rejected(e))
+                if not dead:
+                    logging.warning(f"Replay de {entry['table']} #{entry['seq']} falló "
+                                    f"(intento {entry['attempts'] + 1}): {e}")
+                    break  # las siguientes del usuario esperan al reintento
+                self.dead_lettered += 1
+                logging.error(f"Replay de {entry['table']} #{entry['seq']} descartado a wal_dead_letter "
+                              f"después de {entry['attempts'] + 1} intentos: {e}")
+                continue
+            done.append(entry["seq"])
+        return done
+
+    async def drain(self, timeout: float):
+        """Intenta vaciar el WAL antes de apagar; lo que quede se reproduce al próximo arranque."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not await self.replay_once():
+                return
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
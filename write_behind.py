@@ -0,0 +1,158 @@
+"""
+Buffer de escritura diferida (write-behind) para inserts en Supabase.
+
+Agrupa los inserts de una tabla en un único `insert([...])`, disparado al
+llegar a `max_batch` filas o a los `flush_interval` segundos del primer
+insert pendiente. Cada llamador recibe su propio future, así sigue sabiendo
+si su fila se guardó o no. Cuando hay `max_pending` filas en vuelo, los
+nuevos inserts esperan (backpressure) en lugar de acumular memoria.
+"""
+import os
+import asyncio
+import contextvars
+import logging
+
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "50"))
+DB_BATCH_INTERVAL = float(os.getenv("DB_BATCH_INTERVAL", "0.05"))
+DB_BATCH_MAX_PENDING = int(os.getenv("DB_BATCH_MAX_PENDING", "1000"))
+DB_BATCH_FULL_TIMEOUT = float(os.getenv("DB_BATCH_FULL_TIMEOUT", "10"))
+
+class BufferFullError(Exception):
+    """El buffer siguió lleno durante todo el timeout de backpressure."""
+
+def _is_data_error(error: Exception) -> bool:
+    """4xx de PostgREST: la base rechazó los datos de alguna fila, no vale la pena reintentar el lote igual."""
+    status = getattr(error, "status_code", None)
+    return status is not None and 400 <= status < 500
+
+class WriteBehindBuffer:
+    def __init__(self, name: str, insert_rows, max_batch: int = DB_BATCH_SIZE,
+                 flush_interval: float = DB_BATCH_INTERVAL, max_pending: int = DB_BATCH_MAX_PENDING,
+                 full_timeout: float = DB_BATCH_FULL_TIMEOUT):
+        self.name = name
+        self.insert_rows = insert_rows  # async (rows: list) -> list de filas insertadas
+        self.max_batch = max(1, max_batch)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.full_timeout = full_timeout
+        self._items = []
+        self._slots = None
+        self._has_items = None
+        self._batch_full = None
+        self._worker = None
+        self._flushing = 0
+        # Métricas
+        self.submitted = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._slots = self._slots or asyncio.Semaphore(self.max_pending)
+            self._has_items = self._has_items or asyncio.Event()
+            self._batch_full = self._batch_full or asyncio.Event()
+            # Contexto vacío: el worker sobrevive al request que lo arranca y no debe heredar su traza
+            self._worker = asyncio.get_running_loop().create_task(self._run(), context=contextvars.Context())
+
+    async def submit(self, row: dict) -> dict:
+        """Encola una fila y espera a que se inserte. Devuelve la fila que devolvió la base."""
+        self._ensure_worker()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.full_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise BufferFullError(f"Buffer de {self.name} lleno ({self.max_pending} filas pendientes)")
+
+        future = asyncio.get_running_loop().create_future()
+        self._items.append((row, future))
+        self.submitted += 1
+        self._has_items.set()
+        if len(self._items) >= self.max_batch:
+            self._batch_full.set()
+        return await future
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if len(self._items) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush_batch()
+
+    async def _flush_batch(self):
+        batch = self._items[:self.max_batch]
+        del self._items[:len(batch)]
+        if len(self._items) < self.max_batch:
+            self._batch_full.clear()
+        if not self._items:
+            self._has_items.clear()
+        if not batch:
+            return
+
+        rows = [row for row, _ in batch]
+        self._flushing += 1
+        try:
+            inserted = await self.insert_rows(rows)
+            self.flushes += 1
+            self.rows_written += len(rows)
+            for i, (row, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result((inserted[i] if inserted and i < len(inserted) else None) or row)
+        except Exception as e:
+            if len(batch) == 1 or not _is_data_error(e):
+                # Caída de red o 5xx: fila por fila fallaría igual y multiplicaría la carga sobre la base
+                self.failures += len(batch)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                # Un insert masivo se rechaza entero por una fila mala: reintentamos fila por fila para aislarla
+                logging.warning(f"Insert masivo en {self.name} falló ({e}), reintentando fila por fila")
+                for row, future in batch:
+                    try:
+                        inserted = await self.insert_rows([row])
+                        self.flushes += 1
+                        self.rows_written += 1
+                        if not future.done():
+                            future.set_result(inserted[0] if inserted else row)
+                    except Exception as row_error:
+                        self.failures += 1
+                        if not future.done():
+                            future.set_exception(row_error)
+        finally:
+            self._flushing -= 1
+            for _ in batch:
+                self._slots.release()
+
+    async def flush(self):
+        """Escribe todo lo pendiente ya (se usa al apagar)."""
+        while self._items:
+            await self._flush_batch()
+
+    async def close(self):
+        await self.flush()
+        # Esperamos el lote que el worker pueda tener en vuelo antes de cancelarlo
+        while self._flushing or self._items:
+            await asyncio.sleep(0.01)
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._items),
+            "submitted": self.submitted,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "avg_batch": round(self.rows_written / self.flushes, 2) if self.flushes else None,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }